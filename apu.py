@@ -1,15 +1,14 @@
-import pygame
 import math
-import numpy as np
-import pygame.sndarray
+
+import audio
 
 
 
 class APU:
-    def __init__(self, cpu):
-        # I can't actually change the default samp rate
-        self.sample_rate = 22050
-        pygame.mixer.init(frequency = self.sample_rate, size = -16, channels = 2) # 22.05kHz, 16-bit signed, stereo
+    def __init__(self, cpu, output='null'):
+        # an audio.Output or the name of one, see audio.OUTPUTS
+        self.output = audio.open_output(output)
+        self.sample_rate = self.output.sample_rate
 
         self.noise = Noise(self)
         self.triangle = Triangle(self)
@@ -106,17 +105,11 @@ class APU:
 
 
     def play_floats(self, floatsound):
-        floatsound *= 2**15
-        s = np.int16(zip(floatsound, floatsound))
-        self.play(s)
-
-    def play(self, rawsound):
-        s = pygame.sndarray.make_sound(rawsound)
-        s.play(0)
+        self.output.write(floatsound)
 
     def sinetest(self, freq, runtime):
-        raw = np.array([math.sin(x*2.0*math.pi*freq/self.sample_rate) for x in xrange(0, int(runtime*self.sample_rate))])
-        self.play_floats(raw)
+        step = 2.0*math.pi*freq/self.sample_rate
+        self.play_floats([math.sin(x*step) for x in xrange(0, int(runtime*self.sample_rate))])
         
     def testtone(self):
         self.sinetest(440.0, 0.1)
@@ -0,0 +1,104 @@
+'''
+Audio outputs the APU plays its samples through, picked by name in
+OUTPUTS:
+
+    null    drops every sample, for CPU-only and headless runs
+    file    buffers the samples and writes them to a WAV file
+    pygame  plays them through the pygame mixer
+
+Samples are floats from -1 to 1 at the output's sample rate. pygame and
+numpy are only imported when the pygame output is opened, so the other
+outputs work where neither is installed or no audio device exists.
+'''
+import array
+import atexit
+import wave
+
+SAMPLE_RATE = 22050
+
+
+class Output(object):
+    # whether samples are heard as they are written
+    realtime = False
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+
+    def write(self, samples):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullOutput(Output):
+    """ Drops every sample """
+    pass
+
+
+class FileOutput(Output):
+    """
+    Appends the samples to a mono 16-bit WAV file, buffering them so the
+    file is written once every size samples and when closed.
+    """
+    def __init__(self, path, sample_rate=SAMPLE_RATE, size=1 << 16):
+        Output.__init__(self, sample_rate)
+        self.size = size
+        self.buffer = array.array('h')
+        self.wav = wave.open(path, 'wb')
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sample_rate)
+        atexit.register(self.close)
+
+    def write(self, samples):
+        self.buffer.extend(int(sample * 0x7fff) for sample in samples)
+        if len(self.buffer) >= self.size:
+            self.flush()
+
+    def flush(self):
+        self.wav.writeframes(self.buffer.tostring())
+        del self.buffer[:]
+
+    def close(self):
+        if self.wav is None:
+            return
+        self.flush()
+        self.wav.close()
+        self.wav = None
+
+
+class PygameOutput(Output):
+    """ Plays the samples through the pygame mixer, in stereo """
+    realtime = True
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        Output.__init__(self, sample_rate)
+        import numpy
+        import pygame
+        import pygame.sndarray
+        self._numpy = numpy
+        self._sndarray = pygame.sndarray
+        # 16-bit signed, stereo; the mixer may not take every rate
+        pygame.mixer.init(frequency=sample_rate, size=-16, channels=2)
+
+    def write(self, samples):
+        np = self._numpy
+        sound = (np.asarray(samples, dtype=np.float64) * 0x7fff).astype(np.int16)
+        self._sndarray.make_sound(np.column_stack((sound, sound))).play(0)
+
+
+OUTPUTS = {
+    'null': NullOutput,
+    'file': FileOutput,
+    'pygame': PygameOutput,
+}
+
+
+def open_output(output):
+    """ An Output given one or the name of one that needs no arguments """
+    if isinstance(output, Output):
+        return output
+    if output not in OUTPUTS:
+        raise Exception("Unknown audio output {}".format(output))
+    return OUTPUTS[output]()
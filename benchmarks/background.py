@@ -0,0 +1,168 @@
+'''
+Benchmark for the background pass: PPU.create_tile_row against the
+per-pixel loop it replaced, over all 240 lines of a frame, and
+PPU.draw_tile_row redrawing the same unchanged frame from its line cache.
+
+    python benchmarks/background.py [rom] [frames]
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nes
+
+
+class LegacyBackground(object):
+    """ The per-pixel row renderer, kept here only as a reference point """
+    def __init__(self, ppu):
+        self.ppu = ppu
+
+    def create_tile_row(self):
+        ppu = self.ppu
+        nametable = ppu.vram.nametable
+        # get the first tile layer
+        index = nametable.nt_byte(ppu.nametable_addr, ppu.frame_x, ppu.frame_y)
+        tile = self.get_bg_tbl_address(index)
+        self.increment_coarse_x()
+        ppu.shift16_1, ppu.shift16_2 = ppu.vram.read(tile), ppu.vram.read(tile + 8)
+
+        # get the second tile layer
+        attr_buffer = nametable.at_byte(ppu.nametable_addr, ppu.frame_x, ppu.frame_y)
+        index = nametable.nt_byte(ppu.nametable_addr, ppu.frame_x, ppu.frame_y)
+        tile = self.get_bg_tbl_address(index)
+        self.increment_coarse_x()
+        self.shift_in(tile)
+
+        left_latch = 0
+        for tile8 in range(32):
+            for bit in range(8):
+                x = (tile8 * 8) - bit
+                if tile8 == 0:
+                    y = ppu.scanline - 8
+                else:
+                    y = ppu.scanline
+                if ppu.values[y][x] != 0:
+                    continue
+
+                pxvalue = (((ppu.shift16_1 >> bit) & 1) |
+                           (((ppu.shift16_2 >> bit) & 1) << 1))
+                if (ppu.frame_y / 16) % 2 == 0:
+                    palette = self.get_background_entry(((attr_buffer >> (2 * (left_latch % 2))) & 0x3) << 2, pxvalue)
+                elif left_latch == 0:
+                    palette = self.get_background_entry(((attr_buffer >> 4) & 0x3) << 2, pxvalue)
+                else:
+                    palette = self.get_background_entry(((attr_buffer >> 6) & 0x3) << 2, pxvalue)
+
+                ppu.pixels[y][x] = palette % 64
+                ppu.values[y][x] = pxvalue
+                ppu.pindexes[y][x] = 0xff
+                self.increment_frame_xy()
+            if (tile8 + 1) % 2 == 0:
+                left_latch = not left_latch
+                attr_buffer = nametable.at_byte(ppu.nametable_addr, ppu.frame_x, ppu.frame_y)
+            # shift in a new tile
+            index = nametable.nt_byte(ppu.nametable_addr, ppu.frame_x, ppu.frame_y)
+            tile = self.get_bg_tbl_address(index)
+            self.increment_coarse_x()
+            self.shift_in(tile)
+
+    def shift_in(self, tile):
+        ppu = self.ppu
+        low, high = ppu.vram.read(tile), ppu.vram.read(tile + 8)
+        ppu.shift16_1 = ((ppu.shift16_1 << 8) & 0xffff) | low
+        ppu.shift16_2 = ((ppu.shift16_2 << 8) & 0xffff) | high
+
+    def increment_coarse_x(self):
+        ppu = self.ppu
+        # flip 10th bit on wraparound
+        if (ppu.vram_addr & 0x1f) == 0x1f:
+            ppu.vram_addr ^= 0x41f
+        else:
+            ppu.vram_addr += 1
+
+    def get_background_entry(self, attribute, pixel):
+        if not pixel:
+            return self.ppu.vram.read(0x3f00)
+        return self.ppu.vram.read(0x3f00 + attribute + pixel)
+
+    def get_bg_tbl_address(self, v):
+        if self.ppu.background_tbl_addr:
+            table = 0x1000
+        else:
+            table = 0
+
+        return (v << 4) | (self.ppu.vram_addr >> 12) | table
+
+    def increment_frame_xy(self):
+        ppu = self.ppu
+        ppu.frame_x += 1
+        if ppu.frame_x == 256:
+            ppu.frame_x = 0
+            ppu.frame_y += 1
+        if ppu.frame_y == 240:
+            ppu.frame_x = 0
+            ppu.frame_y = 0
+
+
+class CachedBackground(object):
+    """ Rows through the line cache, as the PPU draws them every frame """
+    def __init__(self, ppu):
+        self.ppu = ppu
+
+    def create_tile_row(self):
+        self.ppu.draw_tile_row()
+
+
+def render_frame(ppu, renderer, vram_addr):
+    """ Draw every line of a frame from a cleared buffer """
+    ppu.values.fill(0)
+    ppu.pindexes.fill(0xff)
+    ppu.frame_x = ppu.frame_y = 0
+    ppu.vram_addr = vram_addr
+    for scanline in range(240):
+        ppu.scanline = scanline
+        renderer.create_tile_row()
+    return (ppu.pixels.copy(), ppu.values.copy(), ppu.pindexes.copy(),
+            ppu.frame_x, ppu.frame_y, ppu.vram_addr,
+            ppu.shift16_1, ppu.shift16_2)
+
+
+def main():
+    rom_path = sys.argv[1] if len(sys.argv) > 1 else 'roms/nestest.nes'
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    class Display(object):
+        count = 0
+
+        def NewFrame(self, frame):
+            self.count += 1
+
+    display = Display()
+    with open(rom_path, 'rb') as rom:
+        emu = nes.NES(rom.read(), display)
+    # let the ROM draw its screen first
+    while display.count < frames:
+        emu.step()
+    ppu = emu.ppu
+    vram_addr = ppu.vram_addr
+
+    results = []
+    for name, renderer in (('per pixel', LegacyBackground(ppu)),
+                           ('vectorized', ppu),
+                           ('cached', CachedBackground(ppu))):
+        seconds = min(timeit.repeat(lambda: render_frame(ppu, renderer, vram_addr),
+                                    number=1, repeat=3))
+        # after the timed runs, so the cached rows come from the cache
+        results.append(render_frame(ppu, renderer, vram_addr))
+        print '{:10} {:8.2f} ms/frame {:8.1f} us/line'.format(
+            name, seconds * 1e3, seconds * 1e6 / 240)
+
+    same = all((a == b).all() if hasattr(a, 'all') else a == b
+               for result in results[1:] for a, b in zip(results[0], result))
+    print 'identical output:', 'yes' if same else 'NO'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+'''
+Benchmark for bank switching. Builds a small ROM for each mapper whose
+NMI handler switches PRG and CHR banks every frame (MMC3 also takes a
+scanline IRQ every 64 lines) and times it headless against the same ROM
+without the switching, then times a single switch against copying a bank.
+
+    python benchmarks/bank_switching.py [frames]
+'''
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import headless
+import nes
+
+# every program sits at $E000, which is in the last PRG bank and never
+# switched out
+ORIGIN = 0xe000
+
+RESET = [
+    0x78,                   # SEI
+    0xd8,                   # CLD
+    0xa2, 0xff,             # LDX #$FF
+    0x9a,                   # TXS
+    0xa9, 0x18,             # LDA #$18, show background and sprites
+    0x8d, 0x01, 0x20,       # STA $2001
+    0xa9, 0x80,             # LDA #$80, NMI on vblank
+    0x8d, 0x00, 0x20,       # STA $2000
+]
+
+# write A to the five-bit MMC1 register at high << 8
+def mmc1_write(high):
+    code = []
+    for i in range(5):
+        code += [0x8d, 0x00, high]          # STA $hi00
+        if i < 4:
+            code += [0x4a]                  # LSR A
+    return code
+
+# mapper: (prg 16KB banks, chr 8KB banks, init code, switch code using A)
+MAPPERS = {
+    'MMC1': (1, 8, 4,
+             [0xa9, 0x80, 0x8d, 0x00, 0x80,         # reset the shift register
+              0xa9, 0x1e] + mmc1_write(0x80),       # 4KB CHR, switch $8000
+             [0xaa] + mmc1_write(0xe0) +            # TAX, PRG bank
+             [0x8a] + mmc1_write(0xa0)),            # TXA, CHR bank 0
+    'UxROM': (2, 8, 0, [],
+              [0x8d, 0x00, 0x80]),                  # STA $8000
+    'CNROM': (3, 2, 4, [],
+              [0x29, 0x03,                          # AND #$03
+               0x8d, 0x00, 0x80]),                  # STA $8000
+    'MMC3': (4, 8, 16,
+             [0xa9, 0x3f, 0x8d, 0x00, 0xc0,         # IRQ latch 63
+              0x8d, 0x01, 0xc0,                     # reload
+              0x8d, 0x01, 0xe0,                     # enable
+              0x58],                                # CLI
+             [0xaa,                                 # TAX
+              0xa9, 0x06, 0x8d, 0x00, 0x80,         # select R6, PRG at $8000
+              0x8e, 0x01, 0x80,
+              0xa9, 0x00, 0x8d, 0x00, 0x80,         # select R0, 2KB CHR
+              0x8e, 0x01, 0x80,
+              0xa9, 0x02, 0x8d, 0x00, 0x80,         # select R2, 1KB CHR
+              0x8e, 0x01, 0x80]),
+}
+
+IRQ = [
+    0xe6, 0x11,             # INC $11
+    0x8d, 0x00, 0xe0,       # STA $E000, acknowledge
+    0x8d, 0x01, 0xe0,       # STA $E001, enable again
+    0x40,                   # RTI
+]
+
+
+def build_rom(mapper, switching=True, seed=1):
+    number, prg_banks, chr_banks, init, switch = MAPPERS[mapper]
+    if not switching:
+        switch = []
+    code = RESET + init
+    loop = ORIGIN + len(code)
+    code += [0x4c, loop & 0xff, loop >> 8]                  # JMP loop
+    nmi = ORIGIN + len(code)
+    code += [0xe6, 0x10, 0xa5, 0x10] + switch + [0x40]      # INC $10, LDA $10, RTI
+    irq = ORIGIN + len(code)
+    code += IRQ
+
+    prg = bytearray(0x4000 * prg_banks)
+    start = len(prg) - 0x2000
+    prg[start:start + len(code)] = bytearray(code)
+    prg[-6:] = bytearray([nmi & 0xff, nmi >> 8, ORIGIN & 0xff, ORIGIN >> 8,
+                          irq & 0xff, irq >> 8])
+    rng = random.Random(seed)
+    chr_rom = bytearray(rng.randrange(0x100) for i in range(0x2000 * chr_banks))
+    header = bytearray([0x4e, 0x45, 0x53, 0x1a, prg_banks, chr_banks,
+                        (number & 0xf) << 4, number & 0xf0] + [0] * 8)
+    return str(header + prg + chr_rom)
+
+
+def run(rom, frames, repeat=3):
+    """ Best of repeat runs of rom for the given frames, with the last NES """
+    best = float('inf')
+    for i in range(repeat):
+        display = headless.FrameCounter()
+        emu = nes.NES(rom, display)
+        start = time.time()
+        headless.run_frames(emu, display, frames)
+        best = min(best, time.time() - start)
+    return emu, best
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+
+    print '{:6} {:>14} {:>14} {:>10}'.format('mapper', 'switching', 'static', 'irq/frame')
+    for mapper in sorted(MAPPERS):
+        emu, seconds = run(build_rom(mapper), frames)
+        irqs = emu.cpu.memory.ram[0x11]
+        static = run(build_rom(mapper, switching=False), frames)[1]
+        print '{:6} {:8.2f} ms/fr {:8.2f} ms/fr {:10.2f}'.format(
+            mapper, seconds * 1e3 / frames, static * 1e3 / frames, irqs / float(frames))
+
+    # one MMC3 PRG and CHR switch against copying the banks' bytes
+    emu = run(build_rom('MMC3'), 1, 1)[0]
+    mapper = emu.rom.mapper
+    bank = [0]
+
+    def switch():
+        bank[0] ^= 1
+        mapper.write(0x8000, 6)
+        mapper.write(0x8001, bank[0])
+        mapper.write(0x8000, 2)
+        mapper.write(0x8001, bank[0])
+    window = bytearray(0x2000)
+    image = emu.rom.image
+
+    def copy():
+        bank[0] ^= 1
+        window[:] = image[16 + bank[0] * 0x2000:16 + (bank[0] + 1) * 0x2000]
+        window[:0x400] = image[0x20010 + bank[0] * 0x400:0x20010 + (bank[0] + 1) * 0x400]
+    for name, fn in (('window swap', switch), ('data copy', copy)):
+        seconds = min(timeit.repeat(fn, number=1000, repeat=3)) / 1000
+        print '{:12} {:8.2f} us/switch'.format(name, seconds * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Microbenchmark for CPU.Memory: the page-table decoder against the range
+comparison chain it replaced.
+
+    python benchmarks/memory_map.py [rom]
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nes
+
+
+class RangeChainMemory(object):
+    """ The pre-page-table decoder, kept here only as a reference point """
+    def __init__(self, memory):
+        self.memory = memory
+        self._nes = memory._nes
+
+    def read(self, addr):
+        if 0x0 <= addr < 0x2000:
+            return self.memory.ram[addr & 0x7ff] & 0xff
+        elif 0x2000 <= addr < 0x4000:
+            offset = addr % 0x8
+            return self._nes.ppu.read_register(0x2000 + offset)
+        elif addr == 0x4015:
+            return self.memory.cpu.apu.read(addr)
+        elif addr == 0x4016 or addr == 0x4017:
+            return self.memory.cpu.controller.read(addr)
+        elif 0x4000 <= addr < 0x6000:
+            return 0
+        elif 0x6000 <= addr < 0x8000:
+            return self.memory.sram[addr - 0x6000] & 0xff
+        elif 0x8000 <= addr < 0x10000:
+            rom = self._nes.rom
+            return rom.prg[rom.prg_windows[(addr >> 13) & 0x3] + (addr & 0x1fff)] & 0xff
+        else:
+            raise Exception("Out of memory bounds read at {:#06x}".format(addr))
+
+    def write(self, addr, value):
+        if addr < 0x0 or addr > 0xffff:
+            raise Exception("Out of memory bounds write at {:#06x}".format(addr))
+        elif 0x0 <= addr < 0x2000:
+            self.memory.ram[addr & 0x7ff] = value
+        elif 0x2000 <= addr < 0x4000:
+            offset = addr % 0x8
+            self._nes.ppu.write_register(0x2000 + offset, value)
+        elif 0x6000 <= addr < 0x8000:
+            self.memory.sram[addr - 0x6000] = value
+
+
+def run(memory, reads, writes, number):
+    read = memory.read
+    write = memory.write
+
+    def do_reads():
+        for addr in reads:
+            read(addr)
+
+    def do_writes():
+        for addr in writes:
+            write(addr, 0)
+
+    return (min(timeit.repeat(do_reads, number=number, repeat=5)) /
+            (len(reads) * number),
+            min(timeit.repeat(do_writes, number=number, repeat=5)) /
+            (len(writes) * number))
+
+
+def main():
+    rom_path = sys.argv[1] if len(sys.argv) > 1 else 'roms/nestest.nes'
+    with open(rom_path, 'rb') as rom:
+        emu = nes.NES(rom.read(), 0)
+
+    # a typical mix: zero page and stack traffic plus opcode fetches from
+    # PRG-ROM, with the odd save RAM access
+    ram = [0x0010, 0x00ff, 0x01fd, 0x0300, 0x0700]
+    reads = ram * 4 + [0x8000, 0xc123, 0xc124, 0xc125, 0xfffc] * 3 + [0x6000]
+    writes = ram * 4 + [0x6000]
+    number = 20000
+
+    for name, memory in (('range chain', RangeChainMemory(emu.cpu.memory)),
+                         ('page table', emu.cpu.memory)):
+        read_time, write_time = run(memory, reads, writes, number)
+        print '{:12} read {:6.1f} ns/access   write {:6.1f} ns/access'.format(
+            name, read_time * 1e9, write_time * 1e9)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Benchmark for the rewind history. Runs a ROM recording every frame, then
+reports the memory the history takes per minute of play and the time
+taken to capture a frame and to step back one frame, checking that every
+frame stepped back to matches the state saved when it was first run.
+
+    python benchmarks/rewind.py [rom] [frames]
+'''
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import headless
+import nes
+import rewind
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, 'roms/nestest.nes')
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 600
+    with open(path, 'rb') as rom:
+        data = rom.read()
+
+    display = headless.FrameCounter()
+    emu = nes.NES(data, display)
+    history = rewind.Rewind(emu)
+    states = []
+    capture = [0.0]
+
+    def timed_capture():
+        states.append(emu.save_state())
+        start = time.time()
+        rewind.Rewind.capture(history)
+        capture[0] += time.time() - start
+    history.capture = timed_capture
+    headless.run_frames(emu, display, frames, rewind=history)
+
+    per_minute = history.nbytes * 3600.0 / len(history)
+    print 'frames held     {:10}'.format(len(history))
+    print 'history         {:10.2f} MB'.format(history.nbytes / 1048576.0)
+    print 'per minute      {:10.2f} MB'.format(per_minute / 1048576.0)
+    print 'capture         {:10.2f} ms/frame'.format(capture[0] * 1e3 / frames)
+
+    # scrub back one frame at a time, as holding the rewind key does
+    mismatches = 0
+    steps = 0
+    seconds = 0.0
+    while True:
+        start = time.time()
+        stepped = history.step_back()
+        seconds += time.time() - start
+        if not stepped:
+            break
+        steps += 1
+        if emu.save_state() != states[len(history) - 1]:
+            mismatches += 1
+    print 'step back       {:10.2f} ms/frame'.format(seconds * 1e3 / max(steps, 1))
+    print 'mismatches      {:10}'.format(mismatches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+'''
+Benchmark for the sprite pass: PPU.evaluate_sprites against the
+per-sprite, per-pixel loop it replaced, over all 240 lines of a frame
+with all 64 sprites in use. Also checks that frames skipped by
+fast-forward find sprite 0 hits on the same lines drawn frames do,
+flipped sprites included.
+
+    python benchmarks/sprites.py [rom] [seed]
+'''
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nes
+from ppu import StatusBit
+from utils import set_bit
+
+
+def read_tile(cart, address):
+    """ The 16 bytes of the pattern table tile at address """
+    offset = cart.chr_windows[(address >> 10) & 0x7] + (address & 0x3ff)
+    return cart.chr[offset:offset + 16]
+
+
+class LegacySprites(object):
+    """ The per-pixel sprite renderer, kept here only as a reference point """
+    def __init__(self, ppu):
+        self.ppu = ppu
+
+    def evaluate_sprites(self):
+        ppu = self.ppu
+        if ppu.sprite_size:
+            sprite_height = 16
+        else:
+            sprite_height = 8
+
+        for i, y in enumerate(ppu.sprite_data['y']):
+            if (y > (ppu.scanline - 1) - sprite_height and
+                    y + (sprite_height - 1) < (ppu.scanline - 1) + sprite_height):
+                attr_val = ppu.sprite_data['attributes'][i] & 0x3
+                tile = ppu.sprite_data['tiles'][i]
+                c = (ppu.scanline - 1) - y
+
+                y_flip = ppu.sprite_data['attributes'][i] >> 7
+                if y_flip:
+                    y_coord = y + ((sprite_height - 1) - c)
+                else:
+                    y_coord = y + c + 1
+
+                s = self.get_sprite_tbl_address(tile)
+                if ppu.sprite_size:
+                    top = read_tile(ppu._nes.rom, s)
+                    bottom = read_tile(ppu._nes.rom, s + 16)
+
+                    if c > 7 and y_flip:
+                        tile = top
+                        y_coord += 8
+                    elif c < 8 and y_flip:
+                        tile = bottom
+                        y_coord -= 8
+                    elif c > 7:
+                        tile = bottom
+                    else:
+                        tile = top
+                    c %= 8
+                else:
+                    tile = read_tile(ppu._nes.rom, s)
+                self.mux_tile([tile[c], tile[c + 8]],
+                              ppu.sprite_data['x'][i], y_coord, attr_val, i)
+
+    def mux_tile(self, tiles, x, y, palette_index, index):
+        ppu = self.ppu
+        attr = ppu.sprite_data['attributes'][index]
+        is_sprite0 = (index == 0)
+        for b in range(8):
+            if (attr >> 6) & 1 != 0:
+                x_coord = x + b
+            else:
+                x_coord = x + (7 - b)
+
+            if x_coord > 255:
+                continue
+
+            pixel = (tiles[0] >> b) & 0x1
+            pixel += ((tiles[1] >> b & 0x1) << 1)
+
+            transparent = 0
+            if attr and not pixel:
+                transparent = 1
+
+            if y * 256 + x_coord < 0xf000 and not transparent:
+                priority = (attr >> 5) & 0x1
+
+                hit = (ppu.status & 0x40 == 0x40)
+                if (ppu.values[y][x_coord] != 0 and is_sprite0
+                        and not hit):
+                    ppu.status = set_bit(ppu.status, StatusBit.Sprite0Hit)
+
+                if -1 < ppu.pindexes[y][x_coord] < index:
+                    continue
+                elif ppu.values[y][x_coord] != 0 and priority == 1:
+                    continue
+
+                pal = ppu.vram.read(0x3f10 + (palette_index * 0x4) + pixel)
+                ppu.pixels[y][x_coord] = pal % 64
+                ppu.values[y][x_coord] = pixel
+                ppu.pindexes[y][x_coord] = index
+
+    def get_sprite_tbl_address(self, tile):
+        ppu = self.ppu
+        if ppu.sprite_size:
+            # 8x16 sprites
+            if tile & 1 != 0:
+                return 0x1000 | ((tile >> 1) * 0x20)
+            else:
+                return (tile >> 1) * 0x20
+        # selecting the sprite nametable
+        if ppu.sprite_tbl_addr:
+            table = 0x1000
+        else:
+            table = 0
+
+        return tile * 0x10 + table
+
+
+def render_frame(ppu, renderer, values, status):
+    """ Draw the sprites of every line of a frame over fixed background """
+    ppu.pixels.fill(0)
+    ppu.values[:] = values
+    ppu.pindexes.fill(0xff)
+    ppu.status = status
+    for scanline in range(240):
+        ppu.scanline = scanline
+        renderer.evaluate_sprites()
+    # the old loop never flagged sprite overflow, so only compare sprite 0
+    return (ppu.pixels.copy(), ppu.values.copy(), ppu.pindexes.copy(),
+            ppu.status & 0x40)
+
+
+def hit_line(emu, state, sprites, sprite_size, skip):
+    """ The line sprite 0 hits on in a frame run from state, or None """
+    emu.load_state(state)
+    ppu = emu.ppu
+    ppu.show_sprites = ppu.show_background = 1
+    ppu.sprite_size = sprite_size
+    # only the first few sprites on screen
+    ppu.sprites[:, 0] = 0xf0
+    ppu.sprites[:len(sprites)] = sprites
+    ppu.skip_frame = skip
+    for line in range(-1, 241):
+        ppu.run(341)
+        if ppu.status & 0x40:
+            return line
+    return None
+
+
+def check_hits(rom, rng, count=200):
+    """ Sprite 0 placements whose hit line differs when the frame is skipped """
+    emu = nes.NES(rom, 0, 'null')
+    # far enough in for the ROM to have drawn its screen, then on to the
+    # start of a frame
+    while emu.ppu.frame_count < 30:
+        emu.step()
+    emu.sync_ppu()
+    while emu.ppu.scanline != -1:
+        emu.ppu.run(1)
+    state = emu.save_state()
+    differ = []
+    for _ in range(count):
+        sprites = [[rng.randrange(230), rng.randrange(0x100),
+                    rng.choice((0x00, 0x01, 0x20, 0x40, 0x80, 0xc1)), rng.randrange(0x100)]
+                   for _ in range(4)]
+        sprite_size = rng.randrange(2)
+        drawn = hit_line(emu, state, sprites, sprite_size, False)
+        if hit_line(emu, state, sprites, sprite_size, True) != drawn:
+            differ.append((sprites[0], sprite_size))
+    return differ
+
+
+def main():
+    rom_path = sys.argv[1] if len(sys.argv) > 1 else 'roms/nestest.nes'
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    with open(rom_path, 'rb') as rom:
+        data = rom.read()
+    emu = nes.NES(data, 0)
+    ppu = emu.ppu
+
+    rng = random.Random(seed)
+    for address in range(0x100):
+        ppu.update_sprite_buffer(address, rng.randrange(0x100))
+    values = ppu.values.copy()
+    for x in range(0, 256, 3):
+        values[::2, x] = 1
+
+    ppu.sprite_limit = False
+    results = []
+    for name, renderer in (('per pixel', LegacySprites(ppu)),
+                           ('vectorized', ppu)):
+        for sprite_size in (0, 1):
+            ppu.sprite_size = sprite_size
+            results.append(render_frame(ppu, renderer, values, 0))
+            seconds = min(timeit.repeat(lambda: render_frame(ppu, renderer, values, 0),
+                                        number=1, repeat=3))
+            print '{:10} 8x{:<2} {:8.2f} ms/frame'.format(
+                name, 8 << sprite_size, seconds * 1e3)
+
+    same = all((a == b).all() if hasattr(a, 'all') else a == b
+               for a, b in zip(results[0] + results[1], results[2] + results[3]))
+    print 'identical output without the sprite limit:', 'yes' if same else 'NO'
+
+    differ = check_hits(data, rng)
+    print 'same sprite 0 hit lines when skipped:', 'yes' if not differ else 'NO {}'.format(differ[:4])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+'''
+Benchmark suite over the bundled test ROMs. Each ROM runs headless for a
+fixed number of frames (or cycles) and the wall time is split between the
+PPU (time spent in PPU.run while it catches up) and the CPU (the rest),
+giving CPU instructions/sec, PPU dots/sec and full-system ms/frame.
+
+Results are written to a JSON file and compared against a baseline
+written by an earlier run, flagging anything slower than the threshold:
+
+    python benchmarks/suite.py --update-baseline      # record a baseline
+    python benchmarks/suite.py                        # compare against it
+
+Exits with status 1 when a regression is flagged.
+'''
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import headless
+import nes
+
+ROMS = (['roms/nestest.nes'] +
+        sorted(glob.glob(os.path.join(ROOT, 'roms/more_tests/*.nes'))) +
+        sorted(glob.glob(os.path.join(ROOT, 'roms/apu_reset/*.nes'))) +
+        sorted(glob.glob(os.path.join(ROOT, 'roms/apu_test/rom_singles/*.nes'))))
+
+# metric: True when a higher number is better
+METRICS = {
+    'cpu_instructions_per_sec': True,
+    'ppu_dots_per_sec': True,
+    'system_ms_per_frame': False,
+}
+
+
+def measure(rom, frames=None, cycles=None, mode='table'):
+    """ Run rom once, splitting the wall time between the CPU and the PPU """
+    display = headless.FrameCounter()
+    # no mixer or test tone: nothing to play on a server, and it would
+    # share the machine with what is being timed
+    emu = nes.NES(rom, display, 'null')
+    emu.cpu.dispatch_mode = mode
+
+    ppu_run = emu.ppu.run
+    ppu = {'seconds': 0.0, 'dots': 0}
+
+    def timed_run(dots):
+        start = time.time()
+        ppu_run(dots)
+        ppu['seconds'] += time.time() - start
+        ppu['dots'] += dots
+    emu.ppu.run = timed_run
+
+    start = time.time()
+    spent = headless.run_frames(emu, display, frames, cycles)
+    emu.sync_ppu()
+    seconds = time.time() - start
+    cpu_seconds = seconds - ppu['seconds']
+
+    return {
+        'frames': display.frames,
+        'cycles': spent,
+        'instructions': emu.cpu.instructions,
+        'dots': ppu['dots'],
+        'seconds': seconds,
+        'cpu_seconds': cpu_seconds,
+        'ppu_seconds': ppu['seconds'],
+        'cpu_instructions_per_sec': emu.cpu.instructions / max(cpu_seconds, 1e-9),
+        'ppu_dots_per_sec': ppu['dots'] / max(ppu['seconds'], 1e-9),
+        'system_ms_per_frame': seconds * 1e3 / max(display.frames, 1),
+        'framebuffer': headless.framebuffer_hash(emu),
+    }
+
+
+def best(runs):
+    """ Keep the best figure of each metric over repeated runs """
+    result = dict(runs[0])
+    for metric, higher in METRICS.items():
+        pick = max if higher else min
+        result[metric] = pick(run[metric] for run in runs)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """ Return a line for every metric that got worse than the threshold """
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for metric, higher in sorted(METRICS.items()):
+            if not old.get(metric):
+                continue
+            change = result[metric] / old[metric] - 1
+            if higher:
+                change = -change
+            if change > threshold:
+                regressions.append('{}: {} {:.4g} -> {:.4g} ({:+.1%} slower)'.format(
+                    name, metric, old[metric], result[metric], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bundled test ROMs.')
+    parser.add_argument('roms', nargs='*', help='ROMs to run (default: all bundled)')
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--cycles', type=int,
+                        help='run this many CPU cycles instead of a frame count')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per ROM, the best figures are kept')
+    parser.add_argument('--mode', default='table',
+                        choices=('table', 'legacy', 'blocks'))
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks/results.json'))
+    parser.add_argument('--baseline', default=os.path.join(ROOT, 'benchmarks/baseline.json'))
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown that counts as a regression (default 0.10)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='write the results to the baseline as well')
+    args = parser.parse_args()
+    frames = None if args.cycles else args.frames
+
+    results = {}
+    print '{:48} {:>12} {:>12} {:>10}'.format('rom', 'cpu instr/s', 'ppu dots/s', 'ms/frame')
+    for path in args.roms or ROMS:
+        name = os.path.relpath(os.path.join(ROOT, path), ROOT)
+        with open(os.path.join(ROOT, path), 'rb') as rom:
+            data = rom.read()
+        runs = [measure(data, frames, args.cycles, args.mode)
+                for i in range(args.repeat)]
+        results[name] = result = best(runs)
+        print '{:48} {:12.0f} {:12.0f} {:10.2f}'.format(
+            name, result['cpu_instructions_per_sec'], result['ppu_dots_per_sec'],
+            result['system_ms_per_frame'])
+
+    report = {'mode': args.mode, 'frames': frames, 'cycles': args.cycles,
+              'roms': results}
+    for path in [args.output] + ([args.baseline] if args.update_baseline else []):
+        with open(path, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+        print 'wrote', path
+
+    if args.update_baseline:
+        return
+    if not os.path.exists(args.baseline):
+        print 'no baseline at {}, run with --update-baseline to record one'.format(
+            args.baseline)
+        return
+    with open(args.baseline) as stored:
+        baseline = json.load(stored)
+    if baseline.get('mode') != args.mode:
+        print 'baseline was recorded in {} mode'.format(baseline.get('mode'))
+    regressions = compare(results, baseline['roms'], args.threshold)
+    for line in regressions:
+        print 'REGRESSION', line
+    if regressions:
+        sys.exit(1)
+    print 'no regressions beyond {:.0%}'.format(args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,116 +1,230 @@
+import hashlib
 import logging
-import struct
+
+import mappers
 
 logging.basicConfig(filename='errors.log', level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
 
-def frombyte(byte):
-    return struct.unpack('b', byte)[0]
+def ram_size(shift):
+    """ NES 2.0 RAM sizes are stored as a shift count: 64 << shift bytes """
+    return 64 << shift if shift else 0
 
 
-class Cartridge(object):
-    def __init__(self, nes, rom):
-        self._nes = nes
-        # this is a romloader for the ines format
+def rom_size(low, high, unit):
+    """
+    NES 2.0 ROM size from the low byte and the high nibble: a count of
+    units, or when the nibble is $F an exponent and multiplier.
+    """
+    if high == 0xf:
+        return (1 << (low >> 2)) * ((low & 0x3) * 2 + 1)
+    return ((high << 8) | low) * unit
 
-        # check for NES constant
-        if rom[0:3].decode('utf-8') != 'NES':
-            logger.error("Invalid ROM file")
-            raise Exception('Attempted to load an invalid ROM file')
 
-        # check for MS-DOS EOF
-        if struct.unpack('b', rom[3])[0] != 0x1a:
+class Header(object):
+    """
+    Parsed iNES or NES 2.0 header. Sizes are in bytes; prg_start and
+    chr_start are where the ROM data starts in the file, after the
+    header and the trainer.
+    """
+    # byte 12 bits 0-1 in NES 2.0
+    TIMINGS = ['NTSC', 'PAL', 'Multiple', 'Dendy']
+
+    def __init__(self, data):
+        header = bytearray(data[:16])
+        # check for NES constant and MS-DOS EOF
+        if len(header) < 16 or header[:4] != bytearray('NES\x1a'):
             logger.error("Invalid ROM file")
             raise Exception('Attempted to load an invalid ROM file')
 
-        # size of prg rom banks in 16KB units
-        self.prg_bank_count = frombyte(rom[4])
-        # size of chr rom banks in 8KB units
-        self.chr_bank_count = frombyte(rom[5])
-
-        # set mirroring for this rom in the ppu
-        if frombyte(rom[6]) & 0x1:
-            # vertical mirroring
-            self._nes.ppu.vram.nametable.set_mirroring('Vertical')
+        flags6, flags7 = header[6], header[7]
+        self.nes2 = (flags7 & 0x0c) == 0x08
+        self.format = 'NES 2.0' if self.nes2 else 'iNES'
+        if flags6 & 0x8:
+            self.mirroring = 'FourScreen'
+        elif flags6 & 0x1:
+            self.mirroring = 'Vertical'
         else:
-            # horizontal mirroring
-            self._nes.ppu.vram.nametable.set_mirroring('Horizontal')
-
-        if (frombyte(rom[6]) >> 1) & 0x1:
-            self.battery = True
+            self.mirroring = 'Horizontal'
+        self.battery = bool(flags6 & 0x2)
+        self.trainer = bool(flags6 & 0x4)
+        # The lower 4 bits of the mapper come from bits 4-7 of flags 6,
+        # the next 4 from bits 4-7 of flags 7 and, in NES 2.0, the upper
+        # 4 from byte 8.
+        self.mapper = flags6 >> 4
+
+        if self.nes2:
+            self.mapper |= (flags7 & 0xf0) | ((header[8] & 0x0f) << 8)
+            self.submapper = header[8] >> 4
+            self.prg_rom_size = rom_size(header[4], header[9] & 0x0f, 0x4000)
+            self.chr_rom_size = rom_size(header[5], header[9] >> 4, 0x2000)
+            self.prg_ram_size = ram_size(header[10] & 0x0f)
+            self.prg_nvram_size = ram_size(header[10] >> 4)
+            self.chr_ram_size = ram_size(header[11] & 0x0f)
+            self.chr_nvram_size = ram_size(header[11] >> 4)
+            self.timing = self.TIMINGS[header[12] & 0x3]
+        else:
+            # dumping tools used to write their name over bytes 7-15, so
+            # flags 7 only counts when the tail of the header is clear
+            if not any(header[12:16]):
+                self.mapper |= flags7 & 0xf0
+            self.submapper = 0
+            self.prg_rom_size = header[4] * 0x4000
+            self.chr_rom_size = header[5] * 0x2000
+            # 8KB units, with 0 meaning 8KB for compatibility
+            self.prg_ram_size = (header[8] or 1) * 0x2000
+            self.prg_nvram_size = self.prg_ram_size if self.battery else 0
+            self.chr_ram_size = 0 if self.chr_rom_size else 0x2000
+            self.chr_nvram_size = 0
+            self.timing = 'PAL' if header[9] & 0x1 else 'NTSC'
+
+        self.prg_start = 16 + (512 if self.trainer else 0)
+        self.chr_start = self.prg_start + self.prg_rom_size
+        self.size = self.chr_start + self.chr_rom_size
+
+    def as_dict(self):
+        return dict(vars(self))
 
-        self.data = rom[16:]
 
-        # The lower 4 bits of the mapper come from bits rom[6].4-7,
-        # and the upper 4 bits come from rom[7].4-7.
-        mapper = (frombyte(rom[6]) >> 4) | (frombyte(rom[7]) & 0xf0)
+class Cartridge(object):
+    def __init__(self, nes, rom):
+        self._nes = nes
+        # this is a romloader for the ines format
+        self.header = header = Header(rom)
 
-        # only nrom mapper (mapper 0) is currently supported
-        if mapper == 0:
-            self.load_nrom()
-        else:
+        # size of prg rom banks in 16KB units
+        self.prg_bank_count = header.prg_rom_size / 0x4000
+        # size of chr rom banks in 8KB units
+        self.chr_bank_count = header.chr_rom_size / 0x2000
+
+        # set mirroring for this rom in the ppu, four-screen cartridges
+        # are not emulated and get vertical mirroring. A machine without
+        # a PPU (see conformance) only runs the CPU side of the cartridge.
+        ppu = self._nes.ppu
+        if ppu is not None:
+            if header.mirroring == 'Horizontal':
+                ppu.vram.nametable.set_mirroring('Horizontal')
+            else:
+                ppu.vram.nametable.set_mirroring('Vertical')
+
+        self.battery = header.battery
+
+        # the image is copied once into a bytearray and the banks are
+        # offsets into it, so reads index the image directly
+        self.image = bytearray(rom)
+        self.prg_start = header.prg_start
+        self.chr_start = header.chr_start
+
+        self.mapper_number = header.mapper
+        if self.mapper_number not in mappers.MAPPERS:
             logger.error("Unsupported memory mapper")
-            raise Exception("Unsupported memory mapper")
-
-    def load_nrom(self):
-        self.prg_banks = [[] for i in range(self.prg_bank_count)]
-
-        # add prg banks from data
-        for i in range(self.prg_bank_count):
-            bank = [0] * 0x4000
-            for offset in range(0x4000):
-                bank[offset] = frombyte(self.data[(0x4000 * i) + offset])
-            self.prg_banks[i] = bank
-        # with open('prgdump.txt', 'w') as out:
-        #     for bank in self.prg_banks:
-        #         for byte in bank:
-        #             out.write(byte)
-
-        # add chr banks from data (they're after prg banks)
-        chr_rom = self.data[0x4000 * len(self.prg_banks):]
-
-        if self.chr_bank_count > 0:
-            self.chr_banks = [[] for i in range(self.chr_bank_count)*2]
+            raise Exception("Unsupported memory mapper {}".format(self.mapper_number))
+
+        if len(self.image) < header.size or not header.prg_rom_size:
+            logger.error("Truncated ROM file")
+            raise Exception('Attempted to load a truncated ROM file')
+
+        self.prg = self.image
+        self.prg_size = header.prg_rom_size
+        # chr rom comes after the prg banks, without it the cartridge has
+        # chr ram, 8KB unless the header says otherwise
+        if header.chr_rom_size:
+            self.chr = self.image
+            self.chr_base = self.chr_start
+            self.chr_size = header.chr_rom_size
         else:
-            self.chr_banks = [[], []]
-
-        for i in range(len(self.chr_banks)):
-            bank = [0] * 0x1000
-
-            if self.chr_bank_count > 0:
-                for offset in range(0x1000):
-                    bank[offset] = frombyte(chr_rom[(0x1000 * i) + offset])
-            self.chr_banks[i] = bank
-        # with open('chrdump.txt', 'w') as out:
-        #     for bank in self.chr_banks:
-        #         for byte in bank:
-        #             out.write(byte)
-
-    def read_prg(self, address):
-        offset = address & 0x3fff
-        if address >= 0xc000:
-            return self.prg_banks[len(self.prg_banks)-1][offset]
-
-        return self.prg_banks[0][offset]
-
-    def read_chr(self, address):
-        offset = address & 0xfff
-        if address >= 0x1000:
-            return self.chr_banks[len(self.chr_banks)-1][offset]
-
-        return self.chr_banks[0][offset]
-
-    def write_chr(self, address, value):
-        if address >= 0x1000:
-            self.chr_banks[len(self.chr_banks)-1][address & 0xfff] = value
+            self.chr_size = max(header.chr_ram_size + header.chr_nvram_size, 0x2000)
+            self.chr = bytearray(self.chr_size)
+            self.chr_base = 0
+
+        # offsets into prg/chr of the 8KB windows at $8000-$FFFF and the
+        # 1KB windows at $0000-$1FFF, moved around by the mapper
+        self.prg_windows = [self.prg_start] * 4
+        self.chr_windows = [self.chr_base] * 8
+        self.scanline_counter = None
+        if ppu is not None:
+            ppu.set_scanline_counter(None)
+            ppu.vram.attach(self)
+            ppu.tiles.attach(self)
+        self.mapper = mappers.MAPPERS[self.mapper_number](self)
+        self._digest = None
+
+    def digest(self):
+        """ SHA-1 of the ROM image, save states record it """
+        if self._digest is None:
+            self._digest = hashlib.sha1(self.image).digest()
+        return self._digest
+
+    def installed(self):
+        """ Whether the NES is running this cartridge (not still loading it) """
+        return self._nes.rom is self
+
+    def sync_ppu(self):
+        if self.installed():
+            self._nes.sync_ppu()
+
+    def switch_prg(self, address, size, bank):
+        """
+        Map the size-byte bank numbered bank (negative counts from the
+        end) at CPU address. Only the window offsets move.
+        """
+        start = bank * size
+        first = (address >> 13) & 0x3
+        for i in range(size / 0x2000):
+            offset = self.prg_start + (start + i * 0x2000) % self.prg_size
+            if self.prg_windows[first + i] == offset:
+                continue
+            self.prg_windows[first + i] = offset
+            if self.installed():
+                self._nes.cpu.memory.move_pages(0x80 + (first + i) * 0x20, 0x20, offset)
+
+    def switch_chr(self, address, size, bank):
+        """
+        Map the size-byte bank numbered bank at PPU address, catching the
+        PPU up first so what it has left to draw uses the old banks.
+        """
+        start = bank * size
+        first = address >> 10
+        offsets = [self.chr_base + (start + i * 0x400) % self.chr_size
+                   for i in range(size / 0x400)]
+        if self.chr_windows[first:first + len(offsets)] == offsets:
             return
+        self.sync_ppu()
+        ppu = self._nes.ppu
+        if ppu is None:
+            self.chr_windows[first:first + len(offsets)] = offsets
+            return
+        for i, offset in enumerate(offsets):
+            self.chr_windows[first + i] = offset
+            ppu.vram.map_window(first + i, offset)
+            ppu.tiles.map_window(first + i, (offset - self.chr_base) >> 4)
 
-        self.chr_banks[0][address & 0xfff] = value
-
-    def read_tile(self, address):
-        offset = address & 0xfff
-        if address >= 0x1000:
-            return self.chr_banks[len(self.chr_banks)-1][offset:offset + 16]
-
-        return self.chr_banks[0][offset:offset + 16]
+    def set_mirroring(self, mirroring):
+        if self._nes.ppu is None:
+            return
+        nametable = self._nes.ppu.vram.nametable
+        if nametable.mirroring == mirroring:
+            return
+        self.sync_ppu()
+        nametable.set_mirroring(mirroring)
+
+    def set_scanline_counter(self, counter):
+        """ Have the PPU clock counter at the end of every rendered line """
+        self.scanline_counter = counter
+        if self._nes.ppu is not None:
+            self._nes.ppu.set_scanline_counter(counter)
+
+    def set_irq(self, level):
+        """ Drive the cartridge's IRQ line to the CPU """
+        self._nes.cpu.irq_requested = 1 if level else 0
+
+    def write_prg(self, address, value):
+        self.mapper.write(address, value)
+
+    def prg_page(self, page):
+        """
+        Return the (buffer, offset) backing the 256-byte CPU page at
+        page << 8, used by the CPU's page table.
+        """
+        return self.prg, self.prg_windows[(page >> 5) & 0x3] + ((page & 0x1f) << 8)
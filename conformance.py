@@ -0,0 +1,191 @@
+'''
+nestest conformance runner: runs nestest.nes from $C000, its automated
+entry point, and diffs the CPU trace line by line against a golden log,
+stopping at the first line that differs.
+
+    python -m conformance golden.log [--rom roms/nestest.nes] [--count N]
+                          [--mode table|legacy|blocks] [--no-timing]
+
+The golden log is not shipped, any nestest log in the usual format will
+do. Lines are compared field by field: the address, the instruction
+bytes, the mnemonic and A, X, Y, P and SP, so the disassembled operands a
+log may carry are ignored. A register missing from a log line, or not a
+number there, counts as a difference. CYC (PPU dots into the scanline)
+and SL are compared too when the log has them in that form, unless
+--no-timing is given; logs in the newer "PPU: line, dot CYC: cycles"
+form are compared without timing.
+
+Only the CPU and the cartridge are built, there is no PPU and the APU
+plays to the null audio output, so a run takes a second or two.
+'''
+import argparse
+import collections
+import itertools
+import re
+import sys
+import time
+
+import cartridge
+from cpu import cpu
+
+# fields after the mnemonic, A:00 ... CYC:  0 SL:241
+REGISTERS = re.compile(r'\b(A|X|Y|P|SP|CYC|SL):\s*(\S*)')
+CPU_REGISTERS = ('A', 'X', 'Y', 'P', 'SP')
+TIMING = ('CYC', 'SL')
+# what each field's value must look like: hex registers, decimal timing
+VALUES = dict([(name, re.compile(r'[0-9A-Fa-f]+$')) for name in CPU_REGISTERS] +
+              [(name, re.compile(r'-?[0-9]+$')) for name in TIMING])
+
+
+class Machine(object):
+    """
+    Just the CPU and the cartridge, for running code that leaves the PPU
+    alone. PPU registers raise instead of being emulated.
+    """
+    def __init__(self, rom):
+        self.ppu = None
+        self.rom = None
+        self.rom = cartridge.Cartridge(self, rom)
+        self.cpu = cpu.CPU(self, self.rom, 'null')
+        for page in range(0x20, 0x40):
+            self.cpu.memory.map_handlers(page, self.read_ppu, self.write_ppu)
+
+    def sync_ppu(self):
+        pass
+
+    def read_ppu(self, addr):
+        raise Exception("No PPU to read {:#06x} from".format(0x2000 + (addr & 0x7)))
+
+    def write_ppu(self, addr, value):
+        raise Exception("No PPU to write {:#06x} to".format(0x2000 + (addr & 0x7)))
+
+
+def parse(line):
+    """ The fields of a trace line as [(name, value), ...] """
+    fields = [('PC', line[0:4]), ('bytes', line[6:15].split()), ('op', line[15:19].strip())]
+    fields.extend(REGISTERS.findall(line[19:]))
+    return fields
+
+
+class Divergence(Exception):
+    def __init__(self, number, field, expected, got, context):
+        Exception.__init__(self, 'line {}: {} differs'.format(number, field))
+        self.number = number
+        self.field = field
+        self.expected = expected
+        self.got = got
+        self.context = context
+
+
+class Checker(object):
+    """
+    Compares chunks of trace records, as a Tracer sink, against the
+    golden lines, raising Divergence at the first difference.
+    """
+    def __init__(self, golden, timing=True, context=5):
+        self.golden = golden
+        self.timing = timing
+        # the last lines that matched, shown before a divergence
+        self.context = collections.deque(maxlen=context)
+        self.tracer = None
+        self.lines = 0
+        self.done = False
+
+    def check(self, data):
+        for got in self.tracer.format(data):
+            expected = next(self.golden, None)
+            if expected is None:
+                # ran past the end of the log
+                self.done = True
+                return
+            self.lines += 1
+            got = got.rstrip('\r\n')
+            expected = expected.rstrip('\r\n')
+            field = self.compare(expected, got)
+            if field is not None:
+                raise Divergence(self.lines, field, expected, got, list(self.context))
+            self.context.append(got)
+
+    def compare(self, expected, got):
+        """
+        The name of the first field that differs, or None. A register the
+        golden line lacks, or has a value that is not a number, differs.
+        """
+        expected = parse(expected)
+        got = dict(parse(got))
+        names = dict(expected)
+        timed = self.timing and 'SL' in names
+        for name in CPU_REGISTERS:
+            if name not in names:
+                return name
+        for name, value in expected:
+            if name in TIMING and not timed:
+                continue
+            if (name in VALUES and not VALUES[name].match(value)) or got.get(name) != value:
+                return name
+        return None
+
+
+def run(rom, golden, count=None, mode='table', timing=True, context=5, chunk=1024):
+    """
+    Trace rom from $C000 against the golden log lines in golden for count
+    instructions (default: the whole log). Returns the number of lines
+    compared; raises Divergence at the first one that differs.
+    """
+    golden = itertools.islice(golden, count)
+    machine = Machine(rom)
+    processor = machine.cpu
+    processor.dispatch_mode = mode
+    checker = Checker(golden, timing, context)
+    checker.tracer = tracer = processor.start_trace(size=chunk, sink=checker.check)
+    try:
+        # chunks are compared as they fill, so this runs on for up to a
+        # chunk past the end of the log
+        while not checker.done:
+            processor.execute()
+        tracer.flush()
+    except Divergence:
+        raise
+    except Exception:
+        # the instructions up to the crash may explain it, they are
+        # checked first and a divergence among them is reported instead
+        tracer.flush()
+        if not checker.done:
+            raise
+    finally:
+        processor.stop_trace()
+    return checker.lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff the nestest CPU trace against a golden log.')
+    parser.add_argument('golden', help='the nestest log to compare against')
+    parser.add_argument('--rom', default='roms/nestest.nes')
+    parser.add_argument('--count', type=int, help='compare only the first N lines')
+    parser.add_argument('--mode', default='table', choices=('table', 'legacy', 'blocks'),
+                        help='CPU dispatch mode')
+    parser.add_argument('--no-timing', dest='timing', action='store_false',
+                        help='ignore the CYC and SL columns')
+    parser.add_argument('--context', type=int, default=5,
+                        help='matching lines shown before a divergence')
+    args = parser.parse_args()
+
+    with open(args.rom, 'rb') as rom:
+        data = rom.read()
+    start = time.time()
+    with open(args.golden) as golden:
+        try:
+            lines = run(data, golden, args.count, args.mode, args.timing, args.context)
+        except Divergence as divergence:
+            print '{}:{}: {} differs'.format(args.golden, divergence.number, divergence.field)
+            first = divergence.number - len(divergence.context)
+            for number, line in enumerate(divergence.context, first):
+                print '  {:6}  {}'.format(number, line)
+            print '- {:6}  {}'.format(divergence.number, divergence.expected)
+            print '+ {:6}  {}'.format(divergence.number, divergence.got)
+            sys.exit(1)
+    print '{} lines match ({:.2f} s)'.format(lines, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
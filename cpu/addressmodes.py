@@ -3,10 +3,10 @@ class AddressingMode:
         byte_size = 1
         @classmethod
         def read(self, cpu, op1=None, op2=None):
-            return cpu.registers['a'].read(), False
+            return cpu.a, False
         @classmethod
         def write(self, cpu, op1=None, op2=None, value=0):
-            cpu.registers['a'].write(value)
+            cpu.a = value & 0xff
             return True
 
     class Absolute:
@@ -28,7 +28,7 @@ class AddressingMode:
         def read(self, cpu, op1, op2):
             page_crossed = False
             addr = op2 << 8 | op1
-            x = cpu.registers['x'].read()
+            x = cpu.x
             addr = (addr + x) & 0xffff
             value = cpu.memory.read(addr)
             
@@ -40,7 +40,7 @@ class AddressingMode:
         @classmethod
         def write(self, cpu, op1, op2, value):
             addr = op2 << 8 | op1
-            addr += cpu.registers['x'].read()
+            addr += cpu.x
             cpu.memory.write(addr, value)
             return True
 
@@ -50,7 +50,7 @@ class AddressingMode:
         def read(self, cpu, op1, op2):
             page_crossed = False
             addr = op2 << 8 | op1
-            y = cpu.registers['y'].read()
+            y = cpu.y
             addr = (addr + y) & 0xffff
             value = cpu.memory.read(addr)
             
@@ -62,7 +62,7 @@ class AddressingMode:
         @classmethod
         def write(self, cpu, op1, op2, value):
             addr = op2 << 8 | op1
-            addr += cpu.registers['y'].read()
+            addr += cpu.y
             cpu.memory.write(addr, value)
             return True
 
@@ -112,14 +112,14 @@ class AddressingMode:
         def read(self, cpu, op1, op2=None):
             # this addressing mode works on the zero page, so
             # wrap around
-            indir_addr = (op1 + cpu.registers['x'].read()) % 0x100
+            indir_addr = (op1 + cpu.x) % 0x100
             addr = cpu.memory.read(indir_addr) & 0xff
             addr += (cpu.memory.read((indir_addr + 1) & 0xff) << 8)
             return cpu.memory.read(addr), False
 
         @classmethod
         def write(self, cpu, op1, op2=None, value=0):
-            indir_addr = (op1 + cpu.registers['x'].read()) % 0x100
+            indir_addr = (op1 + cpu.x) % 0x100
             addr = cpu.memory.read(indir_addr) & 0xff
             addr += (cpu.memory.read((indir_addr + 1) & 0xff) << 8)
             cpu.memory.write(addr, value)
@@ -134,7 +134,7 @@ class AddressingMode:
             addr2 = cpu.memory.read((op1 + 1) & 0xff)
 
             addr = (addr1 & 0xff) + ((addr2 & 0xff) << 8)
-            y = cpu.registers['y'].read()
+            y = cpu.y
 
             if (addr & 0xff00) != ((addr + y) & 0xff00):
                 page_crossed = True
@@ -152,7 +152,7 @@ class AddressingMode:
                 page_crossed = True
 
             addr = (addr1 & 0xff) + ((addr2 & 0xff) << 8)
-            y = cpu.registers['y'].read()
+            y = cpu.y
 
             cpu.memory.write((addr+y)&0xfff, value)
             return None
@@ -179,7 +179,7 @@ class AddressingMode:
                 op1 += 1
                 op1 *= -1
 
-            pc = cpu.registers['pc'].read()
+            pc = cpu.pc
 
             if (pc & 0xff00) != ((pc + op1) & 0xff00):
                 page_crossed = True
@@ -206,14 +206,14 @@ class AddressingMode:
         @classmethod
         def read(self, cpu, op1, op2=None):
             # zero page wrap around
-            addr = (op1 + cpu.registers['x'].read()) % 0x100
+            addr = (op1 + cpu.x) % 0x100
             value = cpu.memory.read(addr)
             return value, False
 
         @classmethod
         def write(self, cpu, op1, op2=None, value=0):
             # zero page wrap around
-            addr = (op1 + cpu.registers['x'].read()) % 0x100
+            addr = (op1 + cpu.x) % 0x100
             cpu.memory.write(addr, value)
             return True
 
@@ -222,13 +222,13 @@ class AddressingMode:
         @classmethod
         def read(self, cpu, op1, op2=None):
             # zero page wrap around
-            addr = (op1 + cpu.registers['y'].read()) % 0x100
+            addr = (op1 + cpu.y) % 0x100
             value = cpu.memory.read(addr)
             return value, False
 
         @classmethod
         def write(self, cpu, op1, op2=None, value=0):
             # zero page wrap around
-            addr = (op1 + cpu.registers['y'].read()) % 0x100
+            addr = (op1 + cpu.y) % 0x100
             cpu.memory.write(addr, value)
             return True
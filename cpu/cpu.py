@@ -2,14 +2,14 @@
 NES CPU: Ricoh 2A05
 '''
 
-import numpy as np
+import functools
 import logging
 import instructions
 from addressmodes import *
+from translator import Translator
+from tracing import Tracer
 import apu
 
-f=open("cpu.log","w")
-
 scanlines = 241
 
 class CPU:
@@ -17,95 +17,178 @@ class CPU:
     CPU emulation
     '''
     class Memory:
+        """
+        CPU address space, decoded through a 256-entry page table keyed by
+        the high byte of the address. A page is either backed by a buffer
+        (read_buffers/read_bases give the buffer and the offset of the
+        page inside it) or by an I/O handler when its buffer is None.
+        """
         def __init__(self, nes, cpu):
             self.cpu = cpu
             self._nes = nes
-            self._memory = bytearray(0x10000)
-            self._memory[0x100:0x200] = [0xff] * 0xff
+            # 2KB of internal RAM, mirrored 4 times through $0000-$1FFF
+            self.ram = bytearray(0x800)
+            # $4000-$40FF, only $4018-$401F are plain storage
+            self.io = bytearray(0x100)
+            # Save RAM at $6000-$7FFF
+            self.sram = bytearray(0x2000)
+            # Expansion ROM is not emulated and reads back as zero
+            self._expansion = bytearray(0x100)
+
+            self.read_buffers = [None] * 0x100
+            self.read_bases = [0] * 0x100
+            self.read_handlers = [None] * 0x100
+            self.write_buffers = [None] * 0x100
+            self.write_bases = [0] * 0x100
+            self.write_handlers = [None] * 0x100
+
+            for page in range(0x00, 0x20):
+                self.map_page(page, self.ram, (page & 0x7) << 8, writable=True)
+            for page in range(0x20, 0x40):
+                self.map_handlers(page, self.read_ppu, self.write_ppu)
+            self.map_handlers(0x40, self.read_io, self.write_io)
+            for page in range(0x41, 0x60):
+                self.map_page(page, self._expansion, 0)
+                self.write_handlers[page] = self.write_expansion
+            for page in range(0x60, 0x80):
+                self.map_page(page, self.sram, (page - 0x60) << 8, writable=True)
+            self.map_prg()
+
+        def map_page(self, page, buf, base, writable=False):
+            self.read_buffers[page] = buf
+            self.read_bases[page] = base
+            if writable:
+                self.write_buffers[page] = buf
+                self.write_bases[page] = base
+
+        def map_handlers(self, page, read, write):
+            self.read_buffers[page] = None
+            self.read_handlers[page] = read
+            self.write_buffers[page] = None
+            self.write_handlers[page] = write
+
+        def map_prg(self):
+            """
+            Point $8000-$FFFF at the cartridge's current PRG windows; bank
+            switches after that only move the pages' offsets (move_pages).
+            """
+            cart = self._nes.rom
+            for page in range(0x80, 0x100):
+                if cart is None:
+                    self.map_handlers(page, self.read_rom, self.write_rom)
+                else:
+                    bank, base = cart.prg_page(page)
+                    self.map_page(page, bank, base)
+                    self.write_handlers[page] = cart.write_prg
+
+        def move_pages(self, first, count, base):
+            """
+            Point count pages from first at consecutive offsets from base
+            in the buffers they already read from, for a bank switch.
+            """
+            self.read_bases[first:first + count] = range(base, base + (count << 8), 0x100)
 
         def read(self, addr):
-            # The Zero Page, Stack, and RAM mirrored 4 times, we will only
-            # use one copy rather than mirroring them all since we have a
-            # mod operator
-            if 0x0 <= addr < 0x2000:
-                return self._memory[addr] & 0xff
+            page = addr >> 8
+            buf = self.read_buffers[page]
+            if buf is None:
+                return self.read_handlers[page](addr)
+            return buf[self.read_bases[page] + (addr & 0xff)]
+
+        def write(self, addr, value):
+            page = addr >> 8
+            buf = self.write_buffers[page]
+            if buf is None:
+                self.write_handlers[page](addr, value)
+            else:
+                buf[self.write_bases[page] + (addr & 0xff)] = value
+
+        # I/O handlers, the PPU is brought up to date before any access
+        def read_ppu(self, addr):
             # I/O Registers, mirrored a bunch of times
-            elif 0x2000 <= addr < 0x4000:
-                offset = addr % 0x8
-                return self._nes.ppu.read_register(0x2000 + offset)
-            elif addr == 0x4015:
+            self._nes.sync_ppu()
+            return self._nes.ppu.read_register(0x2000 + (addr & 0x7))
+
+        def write_ppu(self, addr, value):
+            self._nes.sync_ppu()
+            self._nes.ppu.write_register(0x2000 + (addr & 0x7), value)
+
+        def read_io(self, addr):
+            if addr == 0x4015:
                 return self.cpu.apu.read(addr)
             # Controller ports
             elif addr == 0x4016 or addr == 0x4017:
                 return self.cpu.controller.read(addr)
-            # Unmirrored I/O registers, Expansion ROM, and Save RAM
-            elif 0x4000 <= addr < 0x8000:
-                return self._memory[addr] & 0xff
-            # Cartridge ROM
-            elif 0x8000 <= addr < 0x10000:
-                # return the cartridge ROM value
-                return (self._nes.rom.read_prg(addr) & 0xff)
-            else:
-                raise Exception("Out of memory bounds read at {:#06x}".format(addr))
+            return self.io[addr & 0xff]
 
-        def write(self, addr, value):
-            if addr < 0x0 or addr > 0xffff:
-                raise Exception("Out of memory bounds write at {:#06x}".format(addr))
-            # The Zero Page, Stack, and RAM mirrored 4 times, we will only
-            # use one copy rather than mirroring them all since we have a
-            # mod operator
-            elif 0x0 <= addr < 0x2000:
-                self._memory[addr] = value
-            # I/O Registers, mirrored a bunch of times
-            elif 0x2000 <= addr < 0x4000:
-                offset = addr % 0x8
-                self._nes.ppu.write_register(0x2000 + offset, value)
-            # Unmirrored I/O registers
-            elif addr == 0x4014:
+        def write_io(self, addr, value):
+            if addr == 0x4014:
+                self._nes.sync_ppu()
                 self._nes.ppu.write_register(0x4014, value)
+                # the DMA moves the PPU ahead, so its deadline moves too
+                self._nes.sync_ppu()
             elif addr == 0x4016:
-                self.cpu.controller.write(value)
                 # a write to 4016 writes to both 4016 and 4017
-                self._memory[addr] = value
-                self._memory[0x4017] = value
-            elif 0x4000 <= addr < 0x4018:
+                self.cpu.controller.write(value)
+            elif addr < 0x4018:
                 self.cpu.apu.write(addr, value)
-            elif 0x4018 <= addr < 0x4020:
-                self._memory[addr] = value
-            # Expansion ROM cannot be written to
-            elif 0x4020 <= addr < 0x6000:
-                raise Exception("Cannot write to Expansion ROM at address {:#06x}!".format(addr))
-            # Save RAM
-            elif 0x6000 <= addr < 0x8000:
-                self._memory[addr] = value
-            # Cartridge ROM
-            elif 0x8000 <= addr < 0x10000:
-                raise Exception("Cannot write to ROM at address {:#06x}!".format(addr))
+            elif addr < 0x4020:
+                self.io[addr & 0xff] = value
+            else:
+                self.write_expansion(addr, value)
+
+        def write_expansion(self, addr, value):
+            raise Exception("Cannot write to Expansion ROM at address {:#06x}!".format(addr))
+
+        def read_rom(self, addr):
+            raise Exception("No cartridge mapped for read at {:#06x}".format(addr))
+
+        def write_rom(self, addr, value):
+            raise Exception("Cannot write to ROM at address {:#06x}!".format(addr))
 
 
     class Register:
-        def __init__(self, size):
-            self._size = size
-            self._value = 0x00
+        """
+        Compatibility view of one register in the register file. The
+        registers themselves are plain attributes of the CPU (pc, sp, a, x,
+        y and p); this keeps registers['x'].read() style callers working.
+        """
+        def __init__(self, cpu, name, size):
+            self._cpu = cpu
+            self._name = name
+            if size == 8:
+                self._bits = 0xff
+            else:
+                self._bits = 0xffff
 
         def read(self):
-            return self._value
+            return getattr(self._cpu, self._name)
 
         def write(self, value):
-            if self._size == 8:
-                bits = 0xff
-            else:
-                bits = 0xffff
-            self._value = value & bits
+            setattr(self._cpu, self._name, value & self._bits)
 
         def assign_bit(self, bit_number, set_it):
             if set_it:
-                self._value |= 0x1 << bit_number
+                self.write(self.read() | (0x1 << bit_number))
             else:
-                self._value &= ~(0x1 << bit_number)
+                self.write(self.read() & ~(0x1 << bit_number))
 
         def adjust(self, value=1):
-            self.write(self._value + value)
+            self.write(self.read() + value)
+
+    class StatusRegister(Register):
+        """
+        Compatibility view of the status register. P is only assembled from
+        the unpacked flags when something reads it.
+        """
+        def __init__(self, cpu):
+            CPU.Register.__init__(self, cpu, 'p', 8)
+
+        def read(self):
+            return self._cpu.get_p()
+
+        def write(self, value):
+            self._cpu.set_p(value & 0xff)
 
 
     class Instruction:
@@ -120,12 +203,45 @@ class CPU:
             extra_cycles = self._instruction(self._cpu, self._addressing, op1, op2)
             return self._cycles + extra_cycles
 
+        def predecode(self):
+            """
+            Build a handler specialized for this opcode. The handler takes
+            the address of the opcode, fetches its own operands, advances
+            the program counter and returns the cycles taken, so execute()
+            only has to do a single list index to dispatch.
+            """
+            cpu = self._cpu
+            instruction = self._instruction
+            mode = self._addressing
+            cycles = self._cycles
+            read = cpu.memory.read
+
+            if mode.byte_size == 1:
+                def handler(pc):
+                    cpu.pc = (pc + 1) & 0xffff
+                    return cycles + instruction(cpu, mode, None, None)
+            elif mode.byte_size == 2:
+                def handler(pc):
+                    op1 = read(pc + 1)
+                    cpu.pc = (pc + 2) & 0xffff
+                    return cycles + instruction(cpu, mode, op1, None)
+            else:
+                def handler(pc):
+                    op1 = read(pc + 1)
+                    op2 = read(pc + 2)
+                    cpu.pc = (pc + 3) & 0xffff
+                    return cycles + instruction(cpu, mode, op1, op2)
+            handler.__doc__ = instruction.__doc__
+            return handler
+
     class Controller:
         def __init__(self, cpu):
             self._shiftreg = [0,0]
             self._controllerstatus = [0,0]
             # self._shift = [0,0]
             self._strobe = 0
+            # a movie.Movie recording or replaying what is latched
+            self.movie = None
             self.buttons = {
                 'up': 4,
                 'down': 5,
@@ -145,8 +261,11 @@ class CPU:
 
         def write(self, val):
             if self._strobe and not val&1:
-                self._shiftreg[0] = ~0 & self._controllerstatus[0]
-                self._shiftreg[1] = ~0 & self._controllerstatus[1]
+                status = self._controllerstatus
+                if self.movie is not None:
+                    status = self.movie.latch(status)
+                self._shiftreg[0] = ~0 & status[0]
+                self._shiftreg[1] = ~0 & status[1]
             self._strobe = val&1
 
         def read(self, reg):
@@ -160,23 +279,51 @@ class CPU:
                 return ret
 
 
-    def __init__(self, nes, cart):
+    def __init__(self, nes, cart, audio='null'):
         self._nes = nes
         self.memory = CPU.Memory(nes, self)
         self._cycles = 0
+        # instructions executed since power up
+        self.instructions = 0
+        # the tracing.Tracer debug execution records into
+        self.tracer = None
         self._cart = cart
         self.controller = CPU.Controller(self)
-        self.apu = apu.APU(self)
-        self.apu.testtone()
+        # audio is the APU's output, see audio.OUTPUTS
+        self.apu = apu.APU(self, audio)
+        if self.apu.output.realtime:
+            self.apu.testtone()
 
         # interrupt flags
         self.irq_requested = 0
         self.nmi_requested = 0
 
-        # Create the CPU registers
-        self.registers = {'pc': CPU.Register(16), 'sp': CPU.Register(8),
-                          'a': CPU.Register(8), 'x': CPU.Register(8),
-                          'y': CPU.Register(8), 'p': CPU.Register(8)}
+        # The register file. Instructions access these attributes directly
+        # and mask only where a result can leave the register's range.
+        self.pc = 0
+        self.sp = 0
+        self.a = 0
+        self.x = 0
+        self.y = 0
+
+        # The status flags are kept unpacked, and P is only assembled by
+        # get_p() when it is pushed or inspected. Negative and zero are
+        # evaluated lazily from nz, the last result: Z is set when the low
+        # byte is zero, N when bit 7 (or bit 8, see set_p) is set.
+        self.carry = 0
+        self.interrupt = 0
+        self.decimal = 0
+        self.brk = 0
+        self.unused = 0
+        self.overflow = 0
+        self.nz = 0x1
+
+        self.registers = {'pc': CPU.Register(self, 'pc', 16),
+                          'sp': CPU.Register(self, 'sp', 8),
+                          'a': CPU.Register(self, 'a', 8),
+                          'x': CPU.Register(self, 'x', 8),
+                          'y': CPU.Register(self, 'y', 8),
+                          'p': CPU.StatusRegister(self)}
 
         # Bit positions in the status register
         self.status = {'carry': 0, 'zero': 1, 'interrupt': 2, 'decimal': 3,
@@ -427,32 +574,73 @@ class CPU:
             0xff: CPU.Instruction(self, instructions.ISB_UNDOC, AddressingMode.Absolute_X, 7) # undocumented
         }
 
-        self.registers['pc'].write(0xc000)
-        self.registers['p'].write(0x24)
-        self.registers['sp'].write(0xfd)
-        self.memory._memory[0x0000:0x0800] = [0xff]
-        self.memory._memory[0x0008] = 0xf7
-        self.memory._memory[0x0009] = 0xef
-        self.memory._memory[0x000a] = 0xdf
-        self.memory._memory[0x000f] = 0xbf
+        # Flat dispatch table indexed by opcode. 'table' executes through
+        # the pre-decoded handlers, 'legacy' through the opcodes dict and
+        # 'blocks' runs translated basic blocks where it can, falling back
+        # to the table.
+        self.dispatch_mode = 'table'
+        self.dispatch = [self.illegal_opcode] * 0x100
+        for opcode, instruction in self.opcodes.items():
+            self.dispatch[opcode] = instruction.predecode()
+        self.translator = Translator(self)
+
+        self.pc = 0xc000
+        self.set_p(0x24)
+        self.sp = 0xfd
+        self.memory.ram[0x0000] = 0xff
+        self.memory.ram[0x0008] = 0xf7
+        self.memory.ram[0x0009] = 0xef
+        self.memory.ram[0x000a] = 0xdf
+        self.memory.ram[0x000f] = 0xbf
 
     def execute(self, debug=False):
-        global scanlines
         # fetch
         cycles = 0
         # check for interrupts
-        if self.irq_requested:
-            if not self.get_status('interrupt'):
-                self.irq()
-                self.interrupt_requested = 0
-        elif self.nmi_requested:
+        if self.nmi_requested:
             self.nmi()
             self.nmi_requested = 0
             cycles += 7
+        elif self.irq_requested and not self.interrupt:
+            # the IRQ line stays up until the device acknowledges it
+            self.irq()
+            cycles += 7
+
+        pc = self.pc
+        if self.dispatch_mode == 'blocks':
+            block = self.translator.lookup(pc, debug)
+            if block is not None:
+                return block(cycles)
 
-        pc = self.registers['pc'].read()
         opcode = self.memory.read(pc)
 
+        if debug:
+            self.log_instruction(pc, opcode)
+
+        if self.dispatch_mode == 'legacy':
+            cycles += self.execute_legacy(pc, opcode)
+        else:
+            cycles += self.dispatch[opcode](pc)
+
+        self.tick(cycles)
+        # self.apu.clock(cycles)
+        return cycles
+
+    def tick(self, cycles, instructions=1):
+        """
+        Advance the instruction count and the cycle and scanline counters
+        shown in the trace
+        """
+        global scanlines
+        self.instructions += instructions
+        self._cycles += cycles * 3 # times 3 for ppu multiplier
+        while self._cycles >= 341:
+            self._cycles -= 341
+            scanlines += 1
+            if scanlines == 261:
+                scanlines = -1
+
+    def execute_legacy(self, pc, opcode):
         # decode
         operands = self.opcodes[opcode]._addressing.byte_size
         ops = [None, None]
@@ -461,25 +649,46 @@ class CPU:
             if i == 0: continue # skip instruction opcode
             ops[i-1] = self.memory.read(pc + i) # fill in operands
         # update program counter
-        self.registers['pc'].write(pc + operands)
+        self.pc = (pc + operands) & 0xffff
 
         #execute
-        if debug:
-            f.write("{:04X}  {:02X} {} {} {}   A:{:02X} X:{:02X} Y:{:02X} P:{:02X} SP:{:02X} CYC:{:3} SL:{}\n".format(pc, opcode,
-                                                            "  " if ops[0] == None else "{:02X}".format(ops[0]), "  " if ops[1] == None else "{:02X}".format(ops[1]),
-                                                            self.opcodes[opcode]._instruction.__doc__,
-                            self.registers['a'].read(), self.registers['x'].read(), self.registers['y'].read(),
-                            self.registers['p'].read(), self.registers['sp'].read(), self._cycles, scanlines))
-        cycles += self.opcodes[opcode](ops[0], ops[1])
-
-        temp = self._cycles
-        self._cycles = (self._cycles + cycles * 3) % 341 # times 3 for ppu multiplier
-        if temp > self._cycles:
-            scanlines += 1
-            if scanlines == 261:
-                scanlines = -1
-        # self.apu.clock(cycles)
-        return cycles
+        return self.opcodes[opcode](ops[0], ops[1])
+
+    def illegal_opcode(self, pc):
+        raise Exception("Illegal opcode {:#04x} at address {:#06x}".format(
+            self.memory.read(pc), pc))
+
+    def log_instruction(self, pc, opcode):
+        """
+        Record the instruction about to run at pc in the trace, which goes
+        to cpu.log unless start_trace() set one up
+        """
+        tracer = self.tracer
+        if tracer is None:
+            tracer = self.tracer = Tracer(self.opcodes, 'cpu.log')
+        size = tracer.sizes[opcode]
+        op1 = self.memory.read(pc + 1) if size > 1 else 0
+        op2 = self.memory.read(pc + 2) if size > 2 else 0
+        tracer.record(pc, opcode, op1, op2, self.a, self.x, self.y, self.get_p(),
+                      self.sp, self._cycles, scanlines)
+
+    def start_trace(self, path=None, size=1 << 16, sink=None):
+        """
+        Trace every instruction from now on into a new Tracer, which keeps
+        the last size instructions and writes them all to path (or hands
+        them to sink) if given. execute() is swapped for its debug form,
+        so untraced runs pay nothing for tracing.
+        """
+        self.stop_trace()
+        self.tracer = Tracer(self.opcodes, path, size, sink)
+        self.execute = functools.partial(CPU.execute, self, True)
+        return self.tracer
+
+    def stop_trace(self):
+        """ Stop tracing and write out what is left """
+        self.__dict__.pop('execute', None)
+        if self.tracer is not None:
+            self.tracer.close()
 
     def run(self):
         global scanlines
@@ -488,62 +697,91 @@ class CPU:
 
     # status methods
     def get_status(self, flag):
-        pos = self.status[flag]
-        return (self.registers['p'].read() >> pos) & 0x1
+        return (self.get_p() >> self.status[flag]) & 0x1
 
     def set_status(self, flag, value):
-        self.registers['p'].assign_bit(self.status[flag], value)
+        if value:
+            self.set_p(self.get_p() | (0x1 << self.status[flag]))
+        else:
+            self.set_p(self.get_p() & ~(0x1 << self.status[flag]))
+
+    def get_p(self):
+        """ Assemble the P register from the unpacked flags """
+        nz = self.nz
+        return (self.carry |
+                (not nz & 0xff) << 1 |
+                self.interrupt << 2 |
+                self.decimal << 3 |
+                self.brk << 4 |
+                self.unused << 5 |
+                self.overflow << 6 |
+                (not not nz & 0x180) << 7)
+
+    def set_p(self, p):
+        """ Unpack a P register value into the individual flags """
+        self.carry = p & 0x1
+        self.interrupt = (p >> 2) & 0x1
+        self.decimal = (p >> 3) & 0x1
+        self.brk = (p >> 4) & 0x1
+        self.unused = (p >> 5) & 0x1
+        self.overflow = (p >> 6) & 0x1
+        # N and Z both set cannot be expressed by a single result byte, so
+        # bit 8 stands in for N in that case
+        if p & 0x2:
+            self.nz = (p & 0x80) << 1
+        else:
+            self.nz = (p & 0x80) | 0x1
 
     # Stack methods
     def push_stack(self, value):
-        self.memory.write(0x100 + self.registers['sp'].read(), value)
-        self.registers['sp'].adjust(value=-1)
+        self.memory.write(0x100 + self.sp, value)
+        self.sp = (self.sp - 1) & 0xff
 
     def pop_stack(self):
-        self.registers['sp'].adjust(value=1)
-        result = self.memory.read(0x100 + self.registers['sp'].read())
-        return result
+        self.sp = (self.sp + 1) & 0xff
+        return self.memory.read(0x100 + self.sp)
 
     def set_reset_vector(self):
         high = self.memory.read(0xfffd)
         low = self.memory.read(0xfffc)
 
-        self.registers['pc'].write((high << 8) + low)
+        self.pc = (high << 8) + low
 
     def reset(self):
-        self.registers['x'].write(0)
-        self.registers['y'].write(0)
-        self.registers['a'].write(0)
-        self.registers['p'].write(0x34)
-        self.registers['sp'].write(0xfd)
+        self.x = 0
+        self.y = 0
+        self.a = 0
+        self.set_p(0x34)
+        self.sp = 0xfd
         self.cycles = 0
         # self.set_reset_vector()
 
         # interrupt stuff?
 
     def irq(self):
-        pc = self.registers['pc'].read()
+        pc = self.pc
         high = pc >> 8
         low = pc & 0xff
 
         self.push_stack(high)
         self.push_stack(low)
-        self.push_stack(self.registers['p'].read())
+        self.push_stack(self.get_p())
 
         high = self.memory.read(0xffff)
         low = self.memory.read(0xfffe)
 
-        self.registers['pc'].write((high << 8) + low)
+        self.pc = (high << 8) + low
+        self.interrupt = 1
 
     def nmi(self):
-        pc = self.registers['pc'].read()
+        pc = self.pc
         high = pc >> 8
         low = pc & 0xff
 
         self.push_stack(high)
         self.push_stack(low)
-        self.push_stack(self.registers['p'].read())
+        self.push_stack(self.get_p())
 
         high = self.memory.read(0xfffb)
         low = self.memory.read(0xfffa)
-        self.registers['pc'].write((high << 8) + low)
+        self.pc = (high << 8) + low
@@ -1,21 +1,23 @@
+'''
+6502 instructions.
+
+The negative and zero flags are evaluated lazily from cpu.nz, which holds
+the last result byte: Z is set when its low byte is zero and N when bit 7
+is set. Bit 8 stands in for N when an instruction sets N and Z together
+(BIT, PLP, RTI), see CPU.set_p.
+'''
+
 def ADC(cpu, mode, op1=None, op2=None):
     ''' ADC'''
     extra_cycles = 0
     value, page_crossed = mode.read(cpu, op1, op2)
-    c = cpu.get_status('carry')
-    a = cpu.registers['a'].read()
-    result = value + a + c
-    
-    cpu.set_status('negative', result & 0x80 == 0x80)
-    cpu.set_status('zero', result & 0xff == 0x0)
-    if ((a ^ value) & 0x80 == 0) and ((a ^ result) & 0x80 == 0x80):
-        cpu.set_status('overflow', 1)
-    else:
-        cpu.set_status('overflow', 0)
-    c2 = cpu.get_status('carry')
-    cpu.set_status('carry', a + value + c2 > 0xff)
+    a = cpu.a
+    result = value + a + cpu.carry
 
-    cpu.registers['a'].write(result & 0xff)
+    cpu.overflow = ((a ^ result) & (value ^ result) & 0x80) >> 7
+    cpu.carry = result >> 8
+
+    cpu.a = cpu.nz = result & 0xff
 
     if page_crossed:
         extra_cycles = 1
@@ -26,13 +28,10 @@ def AND(cpu, mode, op1=None, op2=None):
     ''' AND'''
     extra_cycles = 0
     value, page_crossed = mode.read(cpu, op1, op2)
-    a = cpu.registers['a'].read()
+    a = cpu.a
 
     result = a & value
-    cpu.registers['a'].write(result)
-
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
+    cpu.a = cpu.nz = result
 
     if page_crossed:
         extra_cycles = 1
@@ -42,14 +41,12 @@ def AND(cpu, mode, op1=None, op2=None):
 def ASL(cpu, mode, op1=None, op2=None):
     ''' ASL'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    bit7 = value & 0x80
-    cpu.set_status('carry', bit7)
+    cpu.carry = value >> 7
 
     result = (value << 1) & 0xff
 
     mode.write(cpu, op1, op2, result)
-    cpu.set_status('zero', (result & 0xff) == 0)
-    cpu.set_status('negative', (result & 0xff) >> 7)
+    cpu.nz = result
 
     return 0 # no extra cycles
 
@@ -58,15 +55,14 @@ def BCC(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    if cpu.get_status('carry') == 0:
+    if not cpu.carry:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
+
         if page_crossed:
             extra_cycles = 2
         else:
             extra_cycles = 1
-
-    if not cpu.get_status('carry'):
-        pc = cpu.registers['pc'].read()
-        cpu.registers['pc'].write(pc + value)
     return extra_cycles
 
 def BCS(cpu, mode, op1=None, op2=None):
@@ -74,9 +70,9 @@ def BCS(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    if cpu.get_status('carry'):
-        pc = cpu.registers['pc'].read()
-        cpu.registers['pc'].write(pc + value)
+    if cpu.carry:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
 
         if page_crossed:
             extra_cycles = 2
@@ -89,9 +85,9 @@ def BEQ(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    pc = cpu.registers['pc'].read()
-    if cpu.get_status('zero'):
-        cpu.registers['pc'].write(pc + value)
+    if not cpu.nz & 0xff:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
 
         if page_crossed:
             extra_cycles = 2
@@ -102,12 +98,14 @@ def BEQ(cpu, mode, op1=None, op2=None):
 def BIT(cpu, mode, op1=None, op2=None):
     ''' BIT'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    a = cpu.registers['a'].read()
+    a = cpu.a
 
-    result = a & value
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', value >> 7)
-    cpu.set_status('overflow', (value >> 6) & 0x1 )
+    # N comes from the operand while Z comes from the AND result
+    if a & value:
+        cpu.nz = (value & 0x80) | 0x1
+    else:
+        cpu.nz = (value & 0x80) << 1
+    cpu.overflow = (value >> 6) & 0x1
 
     return 0 # no extra cycles
 
@@ -116,15 +114,14 @@ def BMI(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    if cpu.get_status('negative') == 1:
+    if cpu.nz & 0x180:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
+
         if page_crossed:
             extra_cycles = 2
         else:
             extra_cycles = 1
-
-    if cpu.get_status('negative'):
-        pc = cpu.registers['pc'].read()
-        cpu.registers['pc'].write(pc + value)
     return extra_cycles
 
 def BNE(cpu, mode, op1=None, op2=None):
@@ -132,15 +129,14 @@ def BNE(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    if cpu.get_status('zero') == 0:
+    if cpu.nz & 0xff:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
+
         if page_crossed:
             extra_cycles = 2
         else:
             extra_cycles = 1
-
-    if not cpu.get_status('zero'):
-        pc = cpu.registers['pc'].read()
-        cpu.registers['pc'].write(pc + value)
     return extra_cycles
 
 def BPL(cpu, mode, op1=None, op2=None):
@@ -148,30 +144,29 @@ def BPL(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    if cpu.get_status('negative') == 0:
+    if not cpu.nz & 0x180:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
+
         if page_crossed:
             extra_cycles = 2
         else:
             extra_cycles = 1
-
-    if not cpu.get_status('negative'):
-        pc = cpu.registers['pc'].read()
-        cpu.registers['pc'].write(pc + value)
     return extra_cycles
 
 def BRK(cpu, mode, op1=None, op2=None):
     ''' BRK'''
-    pc = cpu.registers['pc'].read()
+    pc = cpu.pc
 
     cpu.push_stack(pc & 0xff)
     cpu.push_stack(pc >> 8)
-    cpu.push_stack(cpu.registers['p'].read())
+    cpu.push_stack(cpu.get_p())
 
     irq = cpu.memory.read(0xfffe)
     irq |= cpu.memory.read(0xffff)
 
-    cpu.registers['pc'].write(irq)
-    cpu.set_status('break', 1)
+    cpu.pc = irq
+    cpu.brk = 1
     return 0
 
 def BVC(cpu, mode, op1=None, op2=None):
@@ -179,15 +174,14 @@ def BVC(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    if cpu.get_status('overflow') == 0:
+    if not cpu.overflow:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
+
         if page_crossed:
             extra_cycles = 2
         else:
             extra_cycles = 1
-
-    if not cpu.get_status('overflow'):
-        pc = cpu.registers['pc'].read()
-        cpu.registers['pc'].write(pc + value)
     return extra_cycles
 
 def BVS(cpu, mode, op1=None, op2=None):
@@ -195,49 +189,44 @@ def BVS(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    if cpu.get_status('overflow') == 1:
+    if cpu.overflow:
+        pc = cpu.pc
+        cpu.pc = (pc + value) & 0xffff
+
         if page_crossed:
             extra_cycles = 2
         else:
             extra_cycles = 1
-
-    if cpu.get_status('overflow'):
-        pc = cpu.registers['pc'].read()
-        cpu.registers['pc'].write(pc + value)
     return extra_cycles
 
 def CLC(cpu, mode, op1=None, op2=None):
     ''' CLC'''
-    cpu.set_status('carry', 0)
+    cpu.carry = 0
     return 0
 
 def CLD(cpu, mode, op1=None, op2=None):
     ''' CLD'''
-    cpu.set_status('decimal', 0)
+    cpu.decimal = 0
     return 0
 
 def CLI(cpu, mode, op1=None, op2=None):
     ''' CLI'''
-    cpu.set_status('interrupt', 0)
+    cpu.interrupt = 0
     return 0
 
 def CLV(cpu, mode, op1=None, op2=None):
     ''' CLV'''
-    cpu.set_status('overflow', 0)
+    cpu.overflow = 0
     return 0
 
 def CMP(cpu, mode, op1=None, op2=None):
     ''' CMP'''
     extra_cycles = 0
     value, page_crossed = mode.read(cpu, op1, op2)
-    n = cpu.get_status('negative')
-    a = cpu.registers['a'].read()
+    result = cpu.a - value
 
-    result = a - value
-
-    cpu.set_status('carry', a >= value)
-    cpu.set_status('zero', a == value)
-    cpu.set_status('negative', result >> 7)
+    cpu.carry = 1 if result >= 0 else 0
+    cpu.nz = result & 0xff
 
     if page_crossed:
         extra_cycles = 1
@@ -247,24 +236,20 @@ def CMP(cpu, mode, op1=None, op2=None):
 def CPX(cpu, mode, op1=None, op2=None):
     ''' CPX'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    x = cpu.registers['x'].read()
-    result = x - value
+    result = cpu.x - value
 
-    cpu.set_status('carry', x >= value)
-    cpu.set_status('zero', x == value)
-    cpu.set_status('negative', result >> 7)
+    cpu.carry = 1 if result >= 0 else 0
+    cpu.nz = result & 0xff
 
     return 0
 
 def CPY(cpu, mode, op1=None, op2=None):
     ''' CPY'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    y = cpu.registers['y'].read()
-    result = y - value
+    result = cpu.y - value
 
-    cpu.set_status('carry', y >= value)
-    cpu.set_status('zero', y == value)
-    cpu.set_status('negative', result >> 7)
+    cpu.carry = 1 if result >= 0 else 0
+    cpu.nz = result & 0xff
 
     return 0
 
@@ -272,14 +257,13 @@ def DCP_UNDOC(cpu, mode, op1=None, op2=None):
     '''*DCP'''
     value, page_crossed = mode.read(cpu, op1, op2)
     value -= 1
-    a = cpu.registers['a'].read()
+    a = cpu.a
 
     result = a - value
     mode.write(cpu, op1, op2, (value) & 0xff)
 
-    cpu.set_status('carry', a >= value)
-    cpu.set_status('negative', (result & 0xff) >> 7)
-    cpu.set_status('zero', result & 0xff == 0x0)
+    cpu.carry = 1 if a >= value else 0
+    cpu.nz = result & 0xff
     return 0
 
 def DEC(cpu, mode, op1=None, op2=None):
@@ -289,38 +273,27 @@ def DEC(cpu, mode, op1=None, op2=None):
     result = (value - 1) & 0xff
     mode.write(cpu, op1, op2, result)
 
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
+    cpu.nz = result
     return 0
 
 def DEX(cpu, mode, op1=None, op2=None):
     ''' DEX'''
-    value = cpu.registers['x'].read()
-    value -= 1
-    cpu.set_status('zero', value == 0)
-    cpu.set_status('negative', value >> 7)
-    cpu.registers['x'].write(value)
+    cpu.x = cpu.nz = (cpu.x - 1) & 0xff
     return 0
 
 def DEY(cpu, mode, op1=None, op2=None):
     ''' DEY'''
-    value = cpu.registers['y'].read()
-    value -= 1
-    cpu.set_status('zero', value == 0)
-    cpu.set_status('negative', value >> 7)
-    cpu.registers['y'].write(value)
+    cpu.y = cpu.nz = (cpu.y - 1) & 0xff
     return 0
 
 def EOR(cpu, mode, op1=None, op2=None):
     ''' EOR'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    a = cpu.registers['a'].read()
+    a = cpu.a
     extra_cycles = 0
 
     result = (a ^ value) & 0xff
-    cpu.registers['a'].write(result)
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
+    cpu.a = cpu.nz = result
 
     if page_crossed:
         extra_cycles = 1
@@ -334,26 +307,17 @@ def INC(cpu, mode, op1=None, op2=None):
     result = (value + 1) & 0xff
     mode.write(cpu, op1, op2, result)
 
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
+    cpu.nz = result
     return 0
 
 def INX(cpu, mode, op1=None, op2=None):
     ''' INX'''
-    value = cpu.registers['x'].read()
-    value += 1
-    cpu.set_status('zero', (value & 0xff) == 0)
-    cpu.set_status('negative', (value & 0xff) >> 7)
-    cpu.registers['x'].write(value)
+    cpu.x = cpu.nz = (cpu.x + 1) & 0xff
     return 0
 
 def INY(cpu, mode, op1=None, op2=None):
     ''' INY'''
-    value = cpu.registers['y'].read()
-    value += 1
-    cpu.set_status('zero', (value & 0xff) == 0)
-    cpu.set_status('negative', (value & 0xff) >> 7)
-    cpu.registers['y'].write(value)
+    cpu.y = cpu.nz = (cpu.y + 1) & 0xff
     return 0
 
 def ISB_UNDOC(cpu, mode, op1=None, op2=None):
@@ -361,47 +325,46 @@ def ISB_UNDOC(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     value += 1
     mode.write(cpu, op1, op2, value & 0xff)
-    a = cpu.registers['a'].read()
-    c = cpu.get_status('carry')
-    
+    a = cpu.a
+    c = cpu.carry
+
     result = a - value - (1 - c)
-    cpu.registers['a'].write(result)
+    cpu.a = cpu.nz = result & 0xff
+
+    if result > 0xff or ((result < 0xff) and c) or (result < 0 and c):
+        cpu.carry = 1
+    else:
+        cpu.carry = 0
+    cpu.overflow = 0
 
-    cpu.set_status('carry', (result > 0xff or ((result < 0xff) and c) or (result < 0 and c)))
-    cpu.set_status('negative', (result & 0xff) >> 7)
-    cpu.set_status('zero', result & 0xff == 0x0)
-    cpu.set_status('overflow', 0)
-    
     return 0
 
 def JMP(cpu, mode, op1=None, op2=None):
     ''' JMP'''
     address, page_crossed = mode.read(cpu, op1, op2)
-    cpu.registers['pc'].write(address)
+    cpu.pc = address
     return 0
 
 def JSR(cpu, mode, op1=None, op2=None):
     ''' JSR'''
     address, page_crossed = mode.read(cpu, op1, op2)
-    pc = cpu.registers['pc'].read()
+    pc = cpu.pc
     pc -= 1
     cpu.push_stack(pc >> 8)
     cpu.push_stack((pc & 0xff))
-    
 
-    cpu.registers['pc'].write(address)
+
+    cpu.pc = address
     return 0
 
 def LAX_UNDOC(cpu, mode, op1=None, op2=None):
     '''*LAX'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    cpu.registers['x'].write(value)
-    cpu.registers['a'].write(value)
+    cpu.x = value
+    cpu.a = value
 
     extra_cycles = 0
-    result = value
-    cpu.set_status('zero', (result & 0xff) == 0)
-    cpu.set_status('negative', (result & 0xff) >> 7)
+    cpu.nz = value
 
     if page_crossed:
         extra_cycles = 1
@@ -411,13 +374,9 @@ def LAX_UNDOC(cpu, mode, op1=None, op2=None):
 def LDA(cpu, mode, op1=None, op2=None):
     ''' LDA'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    cpu.registers['a'].write(value)
+    cpu.a = cpu.nz = value
     extra_cycles = 0
 
-    result = value
-    cpu.set_status('zero', (result & 0xff) == 0)
-    cpu.set_status('negative', (result & 0xff) >> 7)
-
     if page_crossed:
         extra_cycles = 1
 
@@ -426,12 +385,9 @@ def LDA(cpu, mode, op1=None, op2=None):
 def LDX(cpu, mode, op1=None, op2=None):
     ''' LDX'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    cpu.registers['x'].write(value)
+    cpu.x = cpu.nz = value
 
     extra_cycles = 0
-    result = value
-    cpu.set_status('zero', (result & 0xff) == 0)
-    cpu.set_status('negative', (result & 0xff) >> 7)
 
     if page_crossed:
         extra_cycles = 1
@@ -441,12 +397,9 @@ def LDX(cpu, mode, op1=None, op2=None):
 def LDY(cpu, mode, op1=None, op2=None):
     ''' LDY'''
     value, page_crossed = mode.read(cpu, op1, op2)
-    cpu.registers['y'].write(value)
+    cpu.y = cpu.nz = value
 
     extra_cycles = 0
-    result = value
-    cpu.set_status('zero', (result & 0xff) == 0)
-    cpu.set_status('negative', (result & 0xff) >> 7)
 
     if page_crossed:
         extra_cycles = 1
@@ -460,9 +413,8 @@ def LSR(cpu, mode, op1=None, op2=None):
     result = (value >> 1) & 0xff
     mode.write(cpu, op1, op2, result)
 
-    cpu.set_status('carry', value & 0x1)
-    cpu.set_status('zero', (result & 0xff) == 0)
-    cpu.set_status('negative', (result & 0xff) >> 7)
+    cpu.carry = value & 0x1
+    cpu.nz = result
     return 0
 
 def NOP(cpu, mode, op1=None, op2=None):
@@ -473,7 +425,7 @@ def NOP_UNDOC(cpu, mode, op1=None, op2=None):
     '''*NOP'''
     extra_cycles = 0
     value, page_crossed = mode.read(cpu, op1, op2)
-    
+
     if page_crossed:
         extra_cycles = 1
 
@@ -484,12 +436,10 @@ def ORA(cpu, mode, op1=None, op2=None):
     value, page_crossed = mode.read(cpu, op1, op2)
     extra_cycles = 0
 
-    a = cpu.registers['a'].read()
+    a = cpu.a
 
     result = a | value
-    cpu.registers['a'].write(result)
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
+    cpu.a = cpu.nz = result
 
     if page_crossed:
         extra_cycles = 1
@@ -497,13 +447,13 @@ def ORA(cpu, mode, op1=None, op2=None):
 
 def PHA(cpu, mode, op1=None, op2=None):
     ''' PHA'''
-    a = cpu.registers['a'].read()
+    a = cpu.a
     cpu.push_stack(a)
     return 0
 
 def PHP(cpu, mode, op1=None, op2=None):
     ''' PHP'''
-    p = cpu.registers['p'].read()
+    p = cpu.get_p()
     p |= 0x1 << 4
     cpu.push_stack(p)
     return 0
@@ -512,98 +462,79 @@ def PLA(cpu, mode, op1=None, op2=None):
     ''' PLA'''
     result = cpu.pop_stack()
 
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
-    cpu.registers['a'].write(result)
+    cpu.a = cpu.nz = result
     return 0
 
 def PLP(cpu, mode, op1=None, op2=None):
     ''' PLP'''
     p = cpu.pop_stack()
-    cpu.registers['p'].write(p)
+    cpu.set_p(p)
 
-    cpu.set_status('carry', p & 0x1)
-    cpu.set_status('zero', p >> 1 & 0x1)
-    cpu.set_status('interrupt', p >> 2 & 0x1)
-    cpu.set_status('decimal', p >> 3 & 0x1)
-    cpu.set_status('break', 0)
-    cpu.set_status('unused', 1)
-    cpu.set_status('overflow', p >> 6 & 0x1)
-    cpu.set_status('negative', p >> 7)
+    cpu.brk = 0
+    cpu.unused = 1
     return 0
 
 def RLA_UNDOC(cpu, mode, op1=None, op2=None):
     '''*RLA'''
     value, page_crossed = mode.read(cpu, op1, op2)
     bit7 = value >> 7
-    carry = cpu.get_status('carry')
+    carry = cpu.carry
     result = (value << 1) & 0xff
     result = (result & 0xfe) | carry
 
     mode.write(cpu, op1, op2, result)
-    
-    a = cpu.registers['a'].read()
+
+    a = cpu.a
     result &= a
-    cpu.registers['a'].write(result)
+    cpu.a = cpu.nz = result
 
-    cpu.set_status('carry', bit7)
-    cpu.set_status('negative', (result & 0xff) >> 7)
-    cpu.set_status('zero', result & 0xff == 0x0)
+    cpu.carry = bit7
     return 0
 
 def ROL(cpu, mode, op1=None, op2=None):
     ''' ROL'''
     value, page_crossed = mode.read(cpu, op1, op2)
     bit7 = value >> 7
-    carry = cpu.get_status('carry')
+    carry = cpu.carry
     result = (value << 1) & 0xff
     result = (result & 0xfe) | carry
 
     mode.write(cpu, op1, op2, result)
 
-    cpu.set_status('carry', bit7)
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
+    cpu.carry = bit7
+    cpu.nz = result
     return 0
 
 def ROR(cpu, mode, op1=None, op2=None):
     ''' ROR'''
     value, page_crossed = mode.read(cpu, op1, op2)
     bit0 = value & 0x1
-    carry = cpu.get_status('carry')
+    carry = cpu.carry
     result = (value >> 1) & 0xff
     result = (result & 0x7f) | (carry << 7)
 
     mode.write(cpu, op1, op2, result)
 
-    cpu.set_status('carry', bit0)
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
+    cpu.carry = bit0
+    cpu.nz = result
     return 0
 
 def RRA_UNDOC(cpu, mode, op1=None, op2=None):
     '''*RRA'''
     value, page_crossed = mode.read(cpu, op1, op2)
     bit0 = value & 0x1
-    carry = cpu.get_status('carry')
+    carry = cpu.carry
     value = (value >> 1) & 0xff
     value = (value & 0x7f) | (carry << 7)
 
     mode.write(cpu, op1, op2, value)
-    cpu.set_status('carry', bit0)
 
-    a = cpu.registers['a'].read()
+    a = cpu.a
     result = a + value + bit0
-    cpu.registers['a'].write(result)
-
-    cpu.set_status('carry', result > 0xff)
-    cpu.set_status('negative', (result & 0xff) >> 7)
-    cpu.set_status('zero', result & 0xff == 0x0)
+    cpu.a = cpu.nz = result & 0xff
 
-    if ((a ^ value) & 0x80 == 0) and ((a ^ result) & 0x80 == 0x80):
-        cpu.set_status('overflow', 1)
-    else:
-        cpu.set_status('overflow', 0)
+    cpu.carry = result >> 8
+    cpu.overflow = ((a ^ result) & (value ^ result) & 0x80) >> 7
 
     return 0
 
@@ -613,17 +544,10 @@ def RTI(cpu, mode, op1=None, op2=None):
     pc = cpu.pop_stack()
     pc |= (cpu.pop_stack() << 8)
 
-    cpu.registers['p'].write(p)
-    cpu.registers['pc'].write(pc)
+    cpu.set_p(p)
+    cpu.pc = pc
 
-    cpu.set_status('carry', p & 0x1)
-    cpu.set_status('zero', p >> 1 & 0x1)
-    cpu.set_status('interrupt', p >> 2 & 0x1)
-    cpu.set_status('decimal', p >> 3 & 0x1)
-    cpu.set_status('break', p >> 4 & 0x1)
-    cpu.set_status('unused', 1)
-    cpu.set_status('overflow', p >> 6 & 0x1)
-    cpu.set_status('negative', p >> 7)
+    cpu.unused = 1
 
     return 0
 
@@ -632,13 +556,13 @@ def RTS(cpu, mode, op1=None, op2=None):
     pc = cpu.pop_stack()
     pc |= (cpu.pop_stack() << 8)
 
-    cpu.registers['pc'].write(pc+1)
+    cpu.pc = (pc+1) & 0xffff
     return 0
 
 def SAX_UNDOC(cpu, mode, op1=None, op2=None):
     '''*SAX'''
-    a = cpu.registers['a'].read()
-    x = cpu.registers['x'].read()
+    a = cpu.a
+    x = cpu.x
 
     result = (a & x) & 0xff
     mode.write(cpu, op1, op2, result)
@@ -648,20 +572,13 @@ def SBC(cpu, mode, op1=None, op2=None):
     ''' SBC'''
     extra_cycles = 0
     value, page_crossed = mode.read(cpu, op1, op2)
-    c = cpu.get_status('carry')
-    a = cpu.registers['a'].read()
-    result = a - value - (1 - c)
+    a = cpu.a
+    result = a - value - (1 - cpu.carry)
 
-    cpu.set_status('negative', result & 0x80 == 0x80)
-    cpu.set_status('zero', result & 0xff == 0x0)
-    if ((a ^ value) & 0x80 != 0) and ((a ^ result) & 0x80 != 0):
-        cpu.set_status('overflow', 1)
-    else:
-        cpu.set_status('overflow', 0)
-    
-    cpu.set_status('carry', result >> 8 == 0)
+    cpu.overflow = ((a ^ value) & (a ^ result) & 0x80) >> 7
+    cpu.carry = 1 if result >= 0 else 0
 
-    cpu.registers['a'].write(result & 0xff)
+    cpu.a = cpu.nz = result & 0xff
 
     if page_crossed:
         extra_cycles = 1
@@ -672,20 +589,13 @@ def SBC_UNDOC(cpu, mode, op1=None, op2=None):
     '''*SBC'''
     extra_cycles = 0
     value, page_crossed = mode.read(cpu, op1, op2)
-    c = cpu.get_status('carry')
-    a = cpu.registers['a'].read()
-    result = a - value - (1 - c)
+    a = cpu.a
+    result = a - value - (1 - cpu.carry)
 
-    cpu.set_status('negative', result & 0x80 == 0x80)
-    cpu.set_status('zero', result & 0xff == 0x0)
-    if ((a ^ value) & 0x80 != 0) and ((a ^ result) & 0x80 != 0):
-        cpu.set_status('overflow', 1)
-    else:
-        cpu.set_status('overflow', 0)
-    
-    cpu.set_status('carry', result >> 8 == 0)
+    cpu.overflow = ((a ^ value) & (a ^ result) & 0x80) >> 7
+    cpu.carry = 1 if result >= 0 else 0
 
-    cpu.registers['a'].write(result & 0xff)
+    cpu.a = cpu.nz = result & 0xff
 
     if page_crossed:
         extra_cycles = 1
@@ -694,17 +604,17 @@ def SBC_UNDOC(cpu, mode, op1=None, op2=None):
 
 def SEC(cpu, mode, op1=None, op2=None):
     ''' SEC'''
-    cpu.set_status('carry', 1)
+    cpu.carry = 1
     return 0
 
 def SED(cpu, mode, op1=None, op2=None):
     ''' SED'''
-    cpu.set_status('decimal', 1)
+    cpu.decimal = 1
     return 0
 
 def SEI(cpu, mode, op1=None, op2=None):
     ''' SEI'''
-    cpu.set_status('interrupt', 1)
+    cpu.interrupt = 1
     return 0
 
 def SLO_UNDOC(cpu, mode, op1=None, op2=None):
@@ -713,14 +623,12 @@ def SLO_UNDOC(cpu, mode, op1=None, op2=None):
     value <<= 1
     mode.write(cpu, op1, op2, value & 0xff)
 
-    a = cpu.registers['a'].read()
+    a = cpu.a
     result = a | value
-       
-    cpu.registers['a'].write(result)
 
-    cpu.set_status('carry', result > 0xff)
-    cpu.set_status('negative', (result & 0xff) >> 7)
-    cpu.set_status('zero', result & 0xff == 0x0)
+    cpu.a = cpu.nz = result & 0xff
+
+    cpu.carry = result >> 8
     return 0
 
 def SRE_UNDOC(cpu, mode, op1=None, op2=None):
@@ -730,81 +638,59 @@ def SRE_UNDOC(cpu, mode, op1=None, op2=None):
     value >>= 1
     mode.write(cpu, op1, op2, value)
 
-    a = cpu.registers['a'].read()
+    a = cpu.a
     result = a ^ value
-    cpu.registers['a'].write(result)
+    cpu.a = cpu.nz = result
 
-    cpu.set_status('carry', bit0)
-    cpu.set_status('zero', (result & 0xff) == 0)
-    cpu.set_status('negative', (result & 0xff) >> 7)
+    cpu.carry = bit0
 
     return 0 # no extra cycles
 
 def STA(cpu, mode, op1=None, op2=None):
     ''' STA'''
-    a = cpu.registers['a'].read()
+    a = cpu.a
     mode.write(cpu, op1, op2, a)
     return 0
 
 def STX(cpu, mode, op1=None, op2=None):
     ''' STX'''
-    x = cpu.registers['x'].read()
+    x = cpu.x
     mode.write(cpu, op1, op2, x)
     return 0
 
 def STY(cpu, mode, op1=None, op2=None):
     ''' STY'''
-    y = cpu.registers['y'].read()
+    y = cpu.y
     mode.write(cpu, op1, op2, y)
     return 0
 
 def TAX(cpu, mode, op1=None, op2=None):
     ''' TAX'''
-    result = cpu.registers['a'].read()
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
-
-    cpu.registers['x'].write(result)
+    cpu.x = cpu.nz = cpu.a
     return 0
 
 def TAY(cpu, mode, op1=None, op2=None):
     ''' TAY'''
-    result = cpu.registers['a'].read()
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
-
-    cpu.registers['y'].write(result)
+    cpu.y = cpu.nz = cpu.a
     return 0
 
 def TSX(cpu, mode, op1=None, op2=None):
     ''' TSX'''
-    result = cpu.registers['sp'].read()
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
-
-    cpu.registers['x'].write(result)
+    cpu.x = cpu.nz = cpu.sp
     return 0
 
 def TXA(cpu, mode, op1=None, op2=None):
     ''' TXA'''
-    result = cpu.registers['x'].read()
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
-
-    cpu.registers['a'].write(result)
+    cpu.a = cpu.nz = cpu.x
     return 0
 
 def TXS(cpu, mode, op1=None, op2=None):
     ''' TXS'''
-    x = cpu.registers['x'].read()
-    cpu.registers['sp'].write(x)
+    x = cpu.x
+    cpu.sp = x
     return 0
 
 def TYA(cpu, mode, op1=None, op2=None):
     ''' TYA'''
-    result = cpu.registers['y'].read()
-    cpu.set_status('zero', result == 0)
-    cpu.set_status('negative', result >> 7)
-
-    cpu.registers['a'].write(result)
+    cpu.a = cpu.nz = cpu.y
     return 0
@@ -0,0 +1,128 @@
+'''
+Instruction tracing. Every traced instruction is packed as one fixed-size
+binary record into a preallocated ring buffer; turning records into
+nestest-style text is left to a background writer thread, or to a later
+pass over the ring:
+
+    C000  4C F5 C5  JMP   A:00 X:00 Y:00 P:24 SP:FD CYC:  0 SL:241
+'''
+import atexit
+import Queue
+import struct
+import threading
+
+# pc, opcode, two operand bytes, a, x, y, p, sp, cycle, scanline
+RECORD = struct.Struct('<HBBBBBBBBHh')
+LINE = '%04X  %02X %s %s %s   A:%02X X:%02X Y:%02X P:%02X SP:%02X CYC:%3d SL:%d\n'
+HEX = ['%02X' % value for value in range(0x100)]
+
+
+class Writer(threading.Thread):
+    """ Formats chunks of records handed to it and appends them to a file """
+    def __init__(self, path, format):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.format = format
+        self.chunks = Queue.Queue()
+
+    def run(self):
+        with open(self.path, 'w') as log:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is not None:
+                    log.writelines(self.format(chunk))
+                    log.flush()
+                self.chunks.task_done()
+                if chunk is None:
+                    return
+
+
+class Tracer(object):
+    """
+    Holds the last size records. With a path, each time the ring fills
+    its records go to a Writer, so the file gets every instruction; a
+    sink instead is called with each full ring of records itself.
+    """
+    def __init__(self, opcodes, path=None, size=1 << 16, sink=None):
+        self.names = ['???'] * 0x100
+        self.sizes = [1] * 0x100
+        for opcode, instruction in opcodes.items():
+            self.names[opcode] = instruction._instruction.__doc__
+            self.sizes[opcode] = instruction._addressing.byte_size
+
+        self.size = size
+        self.buffer = bytearray(size * RECORD.size)
+        self._pack = RECORD.pack_into
+        # next slot in the ring, and records taken in all
+        self.index = 0
+        self.count = 0
+
+        self.writer = None
+        self.sink = sink
+        if path is not None:
+            self.writer = Writer(path, self.format)
+            self.writer.start()
+            self.sink = self.writer.chunks.put
+            atexit.register(self.close)
+
+    def record(self, pc, opcode, op1, op2, a, x, y, p, sp, cycle, scanline):
+        index = self.index
+        self._pack(self.buffer, index * RECORD.size,
+                   pc, opcode, op1, op2, a, x, y, p, sp, cycle, scanline)
+        index += 1
+        self.count += 1
+        if index == self.size:
+            self.index = 0
+            if self.sink is not None:
+                self.sink(str(self.buffer))
+        else:
+            self.index = index
+
+    def records(self):
+        """ The records still in the ring, oldest first """
+        end = self.index * RECORD.size
+        if self.sink is None and self.count >= self.size:
+            return str(self.buffer[end:] + self.buffer[:end])
+        return str(self.buffer[:end])
+
+    def format(self, data):
+        """ nestest-style lines for a string of records """
+        names, sizes = self.names, self.sizes
+        unpack = RECORD.unpack_from
+        lines = []
+        for offset in xrange(0, len(data), RECORD.size):
+            pc, opcode, op1, op2, a, x, y, p, sp, cycle, scanline = unpack(data, offset)
+            size = sizes[opcode]
+            lines.append(LINE % (pc, opcode,
+                                 HEX[op1] if size > 1 else '  ',
+                                 HEX[op2] if size > 2 else '  ',
+                                 names[opcode], a, x, y, p, sp, cycle, scanline))
+        return lines
+
+    def lines(self):
+        """ The ring formatted, for tracing without a file """
+        return self.format(self.records())
+
+    def dump(self, path):
+        with open(path, 'w') as log:
+            log.writelines(self.lines())
+
+    def flush(self):
+        """ Hand the records so far to the sink and wait until they are written """
+        if self.sink is None or self.writer is not None and not self.writer.is_alive():
+            return
+        if self.index:
+            # cleared first, a sink may raise to stop the run
+            end, self.index = self.index, 0
+            self.sink(str(self.buffer[:end * RECORD.size]))
+        if self.writer is not None:
+            self.writer.chunks.join()
+
+    def close(self):
+        """ Write out everything and stop the writer """
+        if self.writer is None or not self.writer.is_alive():
+            return
+        self.flush()
+        self.writer.chunks.put(None)
+        self.writer.join()
@@ -0,0 +1,388 @@
+'''
+Basic-block translator for the 6502 core.
+
+Straight-line code in read-only memory (PRG-ROM) is compiled into one
+Python function per basic block. Operands, addresses, branch targets and
+base cycle counts are folded into the generated source, common
+instructions are expanded inline and the rest call into instructions.py,
+so running a block costs one call instead of a fetch, decode and
+dispatch per instruction.
+
+A block ends after a branch, jump, return or BRK, before an instruction
+that may touch I/O (the PPU only catches up between calls to
+CPU.execute) and at the end of its 256 byte page. Blocks are cached by
+entry PC together with the buffer and offset mapped at that page, so a
+bank switch makes the entry stale and it is compiled again. Code running
+from RAM is never translated and goes through the interpreter.
+'''
+
+import instructions
+from addressmodes import AddressingMode
+
+# instructions that add a cycle when an indexed read crosses a page
+PAGE_CROSS = set(['ADC', 'AND', 'CMP', 'EOR', 'LAX_UNDOC', 'LDA', 'LDX',
+                  'LDY', 'NOP_UNDOC', 'ORA', 'SBC', 'SBC_UNDOC'])
+
+# instructions that end a block because they change the program counter
+CONTROL = set(['BCC', 'BCS', 'BEQ', 'BMI', 'BNE', 'BPL', 'BVC', 'BVS',
+               'BRK', 'JMP', 'JSR', 'RTI', 'RTS'])
+
+# instructions that write their operand, translated or not
+WRITES = set(['ASL', 'DCP_UNDOC', 'DEC', 'INC', 'ISB_UNDOC', 'LSR',
+              'RLA_UNDOC', 'ROL', 'ROR', 'RRA_UNDOC', 'SAX_UNDOC',
+              'SLO_UNDOC', 'SRE_UNDOC', 'STA', 'STX', 'STY'])
+
+BRANCHES = {
+    'BCC': 'not cpu.carry',
+    'BCS': 'cpu.carry',
+    'BEQ': 'not cpu.nz & 0xff',
+    'BMI': 'cpu.nz & 0x180',
+    'BNE': 'cpu.nz & 0xff',
+    'BPL': 'not cpu.nz & 0x180',
+    'BVC': 'not cpu.overflow',
+    'BVS': 'cpu.overflow',
+}
+
+# instructions without an operand
+IMPLIED = {
+    'CLC': ['cpu.carry = 0'],
+    'CLD': ['cpu.decimal = 0'],
+    'CLI': ['cpu.interrupt = 0'],
+    'CLV': ['cpu.overflow = 0'],
+    'DEX': ['cpu.x = cpu.nz = (cpu.x - 1) & 0xff'],
+    'DEY': ['cpu.y = cpu.nz = (cpu.y - 1) & 0xff'],
+    'INX': ['cpu.x = cpu.nz = (cpu.x + 1) & 0xff'],
+    'INY': ['cpu.y = cpu.nz = (cpu.y + 1) & 0xff'],
+    'NOP': [],
+    'PHA': ['ram[0x100 + cpu.sp] = cpu.a',
+            'cpu.sp = (cpu.sp - 1) & 0xff'],
+    'PLA': ['cpu.sp = (cpu.sp + 1) & 0xff',
+            'cpu.a = cpu.nz = ram[0x100 + cpu.sp]'],
+    'SEC': ['cpu.carry = 1'],
+    'SED': ['cpu.decimal = 1'],
+    'SEI': ['cpu.interrupt = 1'],
+    'TAX': ['cpu.x = cpu.nz = cpu.a'],
+    'TAY': ['cpu.y = cpu.nz = cpu.a'],
+    'TSX': ['cpu.x = cpu.nz = cpu.sp'],
+    'TXA': ['cpu.a = cpu.nz = cpu.x'],
+    'TXS': ['cpu.sp = cpu.x'],
+    'TYA': ['cpu.a = cpu.nz = cpu.y'],
+}
+
+# instructions that only read their operand, {r} is the value
+READS = {
+    'ADC': ['v = {r}',
+            't = cpu.a + v + cpu.carry',
+            'cpu.overflow = ((cpu.a ^ t) & (v ^ t) & 0x80) >> 7',
+            'cpu.carry = t >> 8',
+            'cpu.a = cpu.nz = t & 0xff'],
+    'AND': ['cpu.a = cpu.nz = cpu.a & {r}'],
+    'BIT': ['v = {r}',
+            'if cpu.a & v:',
+            '    cpu.nz = (v & 0x80) | 0x1',
+            'else:',
+            '    cpu.nz = (v & 0x80) << 1',
+            'cpu.overflow = (v >> 6) & 0x1'],
+    'CMP': ['t = cpu.a - {r}',
+            'cpu.carry = 1 if t >= 0 else 0',
+            'cpu.nz = t & 0xff'],
+    'CPX': ['t = cpu.x - {r}',
+            'cpu.carry = 1 if t >= 0 else 0',
+            'cpu.nz = t & 0xff'],
+    'CPY': ['t = cpu.y - {r}',
+            'cpu.carry = 1 if t >= 0 else 0',
+            'cpu.nz = t & 0xff'],
+    'EOR': ['cpu.a = cpu.nz = cpu.a ^ {r}'],
+    'LDA': ['cpu.a = cpu.nz = {r}'],
+    'LDX': ['cpu.x = cpu.nz = {r}'],
+    'LDY': ['cpu.y = cpu.nz = {r}'],
+    'NOP_UNDOC': [],
+    'ORA': ['cpu.a = cpu.nz = cpu.a | {r}'],
+    'SBC': ['v = {r}',
+            'a = cpu.a',
+            't = a - v - (1 - cpu.carry)',
+            'cpu.overflow = ((a ^ v) & (a ^ t) & 0x80) >> 7',
+            'cpu.carry = 1 if t >= 0 else 0',
+            'cpu.a = cpu.nz = t & 0xff'],
+}
+READS['SBC_UNDOC'] = READS['SBC']
+
+# instructions that write their operand, {r} is the value read and {w}
+# stores t
+WRITES_INLINE = {
+    'ASL': ['v = {r}',
+            'cpu.carry = v >> 7',
+            't = cpu.nz = (v << 1) & 0xff',
+            '{w}'],
+    'DEC': ['t = cpu.nz = ({r} - 1) & 0xff',
+            '{w}'],
+    'INC': ['t = cpu.nz = ({r} + 1) & 0xff',
+            '{w}'],
+    'LSR': ['v = {r}',
+            'cpu.carry = v & 0x1',
+            't = cpu.nz = v >> 1',
+            '{w}'],
+    'ROL': ['v = {r}',
+            't = cpu.nz = ((v << 1) & 0xfe) | cpu.carry',
+            'cpu.carry = v >> 7',
+            '{w}'],
+    'ROR': ['v = {r}',
+            't = cpu.nz = (v >> 1) | (cpu.carry << 7)',
+            'cpu.carry = v & 0x1',
+            '{w}'],
+    'STA': ['t = cpu.a', '{w}'],
+    'STX': ['t = cpu.x', '{w}'],
+    'STY': ['t = cpu.y', '{w}'],
+}
+
+
+class Translator:
+    '''
+    Compiles and caches basic blocks. lookup() returns a function taking
+    the cycles already spent on this step (an interrupt) that runs the
+    block, advances the CPU's cycle counters and returns the cycles
+    taken. Traced blocks log every instruction like the interpreter does.
+    '''
+    MAX_INSTRUCTIONS = 32
+
+    def __init__(self, cpu):
+        self._cpu = cpu
+        self._memory = cpu.memory
+        self._blocks = {}
+        self._traced_blocks = {}
+
+        self._namespace = {
+            'cpu': cpu,
+            'ram': cpu.memory.ram,
+            'read': cpu.memory.read,
+            'write': cpu.memory.write,
+            'tick': cpu.tick,
+            'log': cpu.log_instruction,
+        }
+        for name in dir(instructions):
+            if name.isupper():
+                self._namespace['I_' + name] = getattr(instructions, name)
+        for name in dir(AddressingMode):
+            if not name.startswith('_'):
+                self._namespace['M_' + name] = getattr(AddressingMode, name)
+
+    def lookup(self, pc, trace=False):
+        '''
+        Return the block starting at pc, or None when the instruction
+        there has to go through the interpreter.
+        '''
+        memory = self._memory
+        page = pc >> 8
+        buf = memory.read_buffers[page]
+        if buf is None or memory.write_buffers[page] is not None:
+            # I/O or RAM, which can be rewritten under a cached block
+            return None
+        # keyed by where the page is mapped from as well, so switching
+        # a bank back in finds its blocks again
+        key = memory.read_bases[page] << 16 | pc
+        if trace:
+            blocks = self._traced_blocks
+        else:
+            blocks = self._blocks
+        entry = blocks.get(key)
+        if entry is None or entry[0] is not buf:
+            entry = (buf, self.compile(pc, trace))
+            blocks[key] = entry
+        return entry[1]
+
+    def flush(self):
+        ''' Forget every translated block '''
+        self._blocks.clear()
+        self._traced_blocks.clear()
+
+    def compile(self, pc, trace=False):
+        read = self._memory.read
+        opcodes = self._cpu.opcodes
+        end = pc | 0xff
+        addr = pc
+        body = []
+        static_cycles = 0
+        count = 0
+        branched = False
+
+        while count < self.MAX_INSTRUCTIONS:
+            opcode = read(addr)
+            instruction = opcodes.get(opcode)
+            if instruction is None:
+                break
+            size = instruction._addressing.byte_size
+            if addr + size - 1 > end:
+                break
+            op1 = op2 = None
+            if size > 1:
+                op1 = read(addr + 1)
+            if size > 2:
+                op2 = read(addr + 2)
+            next_pc = (addr + size) & 0xffff
+
+            lines = self.translate(instruction, next_pc, op1, op2)
+            if lines is None:
+                break
+
+            if trace:
+                body.append('log(0x{:04x}, 0x{:02x})'.format(addr, opcode))
+                if count == 0:
+                    body.append('c = cycles + {}'.format(instruction._cycles))
+                else:
+                    body.append('c = {}'.format(instruction._cycles))
+                body.extend(lines)
+                body.append('tick(c)')
+                body.append('total += c')
+            else:
+                body.extend(lines)
+                static_cycles += instruction._cycles
+
+            count += 1
+            addr = next_pc
+            if instruction._instruction.__name__ in CONTROL:
+                branched = True
+                break
+
+        if count == 0:
+            return None
+
+        if not branched:
+            body.append('cpu.pc = 0x{:04x}'.format(addr))
+        if trace:
+            body.insert(0, 'total = 0')
+            body.append('return total')
+        else:
+            body.insert(0, 'c = cycles')
+            body.append('c += {}'.format(static_cycles))
+            body.append('tick(c, {})'.format(count))
+            body.append('return c')
+
+        name = 'block_{:04x}'.format(pc)
+        source = 'def {}(cycles):\n    {}\n'.format(name, '\n    '.join(body))
+        namespace = dict(self._namespace)
+        exec(compile(source, '<{}>'.format(name), 'exec'), namespace)
+        return namespace[name]
+
+    def translate(self, instruction, next_pc, op1, op2):
+        '''
+        Return the source lines for one instruction, or None when it may
+        touch I/O and has to end the block.
+        '''
+        name = instruction._instruction.__name__
+        mode = instruction._addressing
+
+        if name in BRANCHES:
+            offset = op1 - 0x100 if op1 >> 7 else op1
+            target = (next_pc + offset) & 0xffff
+            extra = 1
+            if (next_pc & 0xff00) != ((next_pc + offset) & 0xff00):
+                extra = 2
+            return ['if {}:'.format(BRANCHES[name]),
+                    '    cpu.pc = 0x{:04x}'.format(target),
+                    '    c += {}'.format(extra),
+                    'else:',
+                    '    cpu.pc = 0x{:04x}'.format(next_pc)]
+        if name == 'JMP' and mode is AddressingMode.JMP_Absolute:
+            return ['cpu.pc = 0x{:04x}'.format(op2 << 8 | op1)]
+        if name == 'JSR':
+            ret = next_pc - 1
+            return ['ram[0x100 + cpu.sp] = 0x{:02x}'.format(ret >> 8),
+                    'cpu.sp = (cpu.sp - 1) & 0xff',
+                    'ram[0x100 + cpu.sp] = 0x{:02x}'.format(ret & 0xff),
+                    'cpu.sp = (cpu.sp - 1) & 0xff',
+                    'cpu.pc = 0x{:04x}'.format(op2 << 8 | op1)]
+        if name == 'RTS':
+            return ['cpu.sp = (cpu.sp + 1) & 0xff',
+                    'v = ram[0x100 + cpu.sp]',
+                    'cpu.sp = (cpu.sp + 1) & 0xff',
+                    'cpu.pc = ((ram[0x100 + cpu.sp] << 8 | v) + 1) & 0xffff']
+        if name in IMPLIED:
+            return list(IMPLIED[name])
+
+        operand = self.operand(mode, op1, op2)
+        if operand is None:
+            return None
+        r, w, crossed = operand
+
+        if name in READS and r is not None:
+            lines = [line.format(r=r) for line in READS[name]]
+        elif name in WRITES_INLINE and w is not None and (r is not None or name.startswith('ST')):
+            lines = [line.format(r=r, w=w) for line in WRITES_INLINE[name]]
+        elif r is not None and (w is not None or name not in WRITES):
+            lines = ['c += I_{}(cpu, M_{}, {}, {})'.format(
+                name, mode.__name__, _hex(op1), _hex(op2))]
+            if name in CONTROL:
+                lines.insert(0, 'cpu.pc = 0x{:04x}'.format(next_pc))
+            return lines
+        else:
+            return None
+
+        if crossed is not None and name in PAGE_CROSS:
+            lines.append('c += {}'.format(crossed))
+        return lines
+
+    def operand(self, mode, op1, op2):
+        '''
+        Return (read expression, store statement for t, page crossing
+        expression) for an addressing mode. Either of the first two is
+        None if it may reach an I/O page, and the whole result is None
+        for modes whose address is not known until run time.
+        '''
+        memory = self._memory
+
+        if mode is AddressingMode.Implied or mode is AddressingMode.Relative:
+            return '', None, None
+        if mode is AddressingMode.Accumulator:
+            return 'cpu.a', 'cpu.a = t', None
+        if mode is AddressingMode.Immediate:
+            return _hex(op1), None, None
+        if mode is AddressingMode.Zero_Page:
+            ref = 'ram[{}]'.format(_hex(op1))
+            return ref, ref + ' = t', None
+        if mode is AddressingMode.Zero_Page_X:
+            ref = 'ram[({} + cpu.x) & 0xff]'.format(_hex(op1))
+            return ref, ref + ' = t', None
+        if mode is AddressingMode.Zero_Page_Y:
+            ref = 'ram[({} + cpu.y) & 0xff]'.format(_hex(op1))
+            return ref, ref + ' = t', None
+
+        if mode is AddressingMode.Absolute or mode is AddressingMode.JMP_Absolute:
+            addr = op2 << 8 | op1
+            if addr < 0x2000:
+                ref = 'ram[0x{:03x}]'.format(addr & 0x7ff)
+                return ref, ref + ' = t', None
+            r = w = None
+            if memory.read_buffers[addr >> 8] is not None:
+                r = 'read(0x{:04x})'.format(addr)
+            if memory.write_buffers[addr >> 8] is not None:
+                w = 'write(0x{:04x}, t)'.format(addr)
+            return r, w, None
+        if mode is AddressingMode.Absolute_X or mode is AddressingMode.Absolute_Y:
+            index = 'cpu.x' if mode is AddressingMode.Absolute_X else 'cpu.y'
+            addr = op2 << 8 | op1
+            last = addr + 0xff
+            crossed = None
+            if op1:
+                crossed = '({} + {}) >> 8'.format(_hex(op1), index)
+            if last < 0x2000:
+                ref = 'ram[(0x{:04x} + {}) & 0x7ff]'.format(addr, index)
+                return ref, ref + ' = t', crossed
+            pages = (addr >> 8, (last & 0xffff) >> 8)
+            r = w = None
+            if all(memory.read_buffers[page] is not None for page in pages):
+                r = 'read((0x{:04x} + {}) & 0xffff)'.format(addr, index)
+            if last <= 0xffff and all(memory.write_buffers[page] is not None
+                                      for page in pages):
+                w = 'write(0x{:04x} + {}, t)'.format(addr, index)
+            return r, w, crossed
+        if mode is AddressingMode.Indirect:
+            addr = op2 << 8 | op1
+            if memory.read_buffers[addr >> 8] is not None:
+                return '', None, None
+        return None
+
+
+def _hex(value):
+    if value is None:
+        return 'None'
+    return '0x{:02x}'.format(value)
@@ -1,9 +1,12 @@
 import threading
+import time
 import ConfigParser
+import Queue
 from wx.lib.pubsub import pub
 from view.wx_view import *
 from view.options_dialogs import *
 import nes
+import rewind
 from utils import key_to_pykey
 
 
@@ -15,20 +18,26 @@ class EmulatorThread(threading.Thread):
         self.running = False
         self.paused = False
         self.save = False
+        # (function, result) pairs for call() to run between frames
+        self.requests = Queue.Queue()
 
     def load_emulator(self, rom_path, display):
         with open(rom_path, 'rb') as rom:
-            self.nes = nes.NES(rom.read(), display)
+            self.nes = nes.NES(rom.read(), display, 'pygame')
         self.rom_path = rom_path
+        self.rewind = rewind.Rewind(self.nes)
+        self.display = display
         display.nes = self.nes
 
     def run(self):
         import StringIO, pstats
         self.running = True
         while self.running:
-            cycles = self.nes.cpu.execute()
-            for i in range(3 * cycles):
-                self.nes.ppu.step()
+            if self.display.rewinding:
+                self.step_back()
+            else:
+                self.run_frame()
+            self.run_requests()
             # if self.nes.ppu.frame_count == 100 and self.nes.ppu.scanline == 1:
             #     s = StringIO.StringIO()
             #     sortby = 'cumulative'
@@ -41,8 +50,55 @@ class EmulatorThread(threading.Thread):
             #     ps.print_stats()
             #     print s.getvalue()
 
+    def run_frame(self):
+        """ Run to the next frame and record it for rewinding """
+        ppu = self.nes.ppu
+        frame = ppu.frame_count
+        while self.running and ppu.frame_count == frame:
+            self.nes.step()
+        self.rewind.capture()
+
+    def step_back(self):
+        """ Show the previous frame, at the speed frames are played """
+        if self.rewind.step_back():
+            self.display.NewFrame(self.nes.ppu.frame)
+        time.sleep(1 / 60.0)
+
+    def call(self, function):
+        """
+        Run function on this thread between two frames and wait for it, so
+        that other threads never touch the machine while it is stepping
+        """
+        if threading.current_thread() is self:
+            return function()
+        result = {}
+        self.requests.put((function, result))
+        while 'done' not in result:
+            if not self.is_alive():
+                # not running (any more), nothing else is stepping
+                self.run_requests()
+            else:
+                time.sleep(0.01)
+        if 'error' in result:
+            raise result['error']
+        return result.get('value')
+
+    def run_requests(self):
+        """ Run the functions queued by call() """
+        while True:
+            try:
+                function, result = self.requests.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result['value'] = function()
+            except Exception as e:
+                result['error'] = e
+            result['done'] = True
+
     def save_game(self):
-        self.nes.save_state()
+        with open(self.rom_path + '.state', 'wb') as state:
+            state.write(self.nes.save_state())
 
 
 class Controller(object):
@@ -100,8 +156,10 @@ class Controller(object):
     def start_emulation(self, rom_path):
         """ Initialize emulation thread """
         if self.emu_thread.running:
-            self.emu_thread.save_game()
-            self.emu_thread.load_emulator(rom_path, self.main_view.display)
+            def switch():
+                self.emu_thread.save_game()
+                self.emu_thread.load_emulator(rom_path, self.main_view.display)
+            self.emu_thread.call(switch)
         else:
             self.emu_thread.load_emulator(rom_path, self.main_view.display)
             self.emu_thread.start()
@@ -0,0 +1,185 @@
+'''
+Headless runner: runs a ROM with no display, and by default no audio, for
+a number of frames or CPU cycles and reports the throughput and a hash of
+the final framebuffer.
+
+    python -m headless rom [--frames N] [--cycles N] [--input FILE]
+                           [--mode table|legacy|blocks] [--frame-skip N]
+                           [--record MOVIE | --play MOVIE] [--trace FILE]
+                           [--audio null|pygame | --wav FILE]
+
+An input file holds one button change per line, applied when the given
+frame starts:
+
+    # frame gamepad button pressed
+    30 1 start 1
+    32 1 start 0
+
+--record writes the controller input of the run to a movie file (see
+movie), --play replays one, by default to its end, and reports the
+frames whose framebuffer differed from the recording. --trace logs every
+instruction to a file in the nestest format. --wav writes the audio to a
+WAV file instead of dropping it.
+'''
+import argparse
+import hashlib
+import time
+
+import audio
+import movie
+import nes
+
+
+class FrameCounter(object):
+    """ Stands in for the display, only counting the frames it is given """
+    def __init__(self):
+        self.frames = 0
+
+    def NewFrame(self, frame):
+        self.frames += 1
+
+    def SkipFrame(self):
+        self.frames += 1
+
+
+def load_input(path):
+    """ Read an input file into {frame: [(gamepad, button, pressed), ...]} """
+    script = {}
+    with open(path) as lines:
+        for number, line in enumerate(lines, 1):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            try:
+                frame, gamepad, button, pressed = line.split()
+                event = (int(gamepad), button, int(pressed))
+                script.setdefault(int(frame), []).append(event)
+            except ValueError:
+                raise Exception("{}:{}: expected 'frame gamepad button pressed'".format(
+                    path, number))
+    return script
+
+
+def run_frames(emu, display, frames=None, cycles=None, script=None, rewind=None):
+    """
+    Step emu until display has counted the given number of frames or the
+    given number of CPU cycles have passed, whichever comes first,
+    applying script's button changes as each frame starts and recording
+    each frame in rewind if given. Returns the cycles spent.
+    """
+    script = script or {}
+    step = emu.step
+    frame_limit = frames if frames is not None else float('inf')
+    cycle_limit = cycles if cycles is not None else float('inf')
+    spent = 0
+    while display.frames < frame_limit and spent < cycle_limit:
+        for gamepad, button, pressed in script.get(display.frames, ()):
+            emu.parse_input(gamepad, button, pressed)
+        if rewind is not None:
+            rewind.capture()
+        frame = display.frames
+        while display.frames == frame and spent < cycle_limit:
+            spent += step()
+    return spent
+
+
+def run(rom, frames=None, cycles=None, script=None, mode='table', frame_skip=1,
+        record=None, play=None, trace=None, output='null'):
+    """
+    Run rom headless (see run_frames), recording a movie to the path
+    record or playing back the one at play, tracing instructions to the
+    path trace and playing audio to output (see audio.OUTPUTS). Returns
+    a dict of the counts, the elapsed time, the framebuffer hash and,
+    when playing a movie, the frames that did not match it.
+    """
+    display = FrameCounter()
+    emu = nes.NES(rom, display, output)
+    emu.cpu.dispatch_mode = mode
+    emu.set_frame_skip(frame_skip)
+
+    session = None
+    if play:
+        session = movie.Movie(emu)
+        session.load(play)
+        session.play()
+        if frames is None and cycles is None:
+            frames = len(session)
+    elif record:
+        session = movie.Movie(emu)
+        session.record()
+
+    if trace:
+        emu.cpu.start_trace(trace)
+    start = time.time()
+    spent = run_frames(emu, display, frames, cycles, script)
+    elapsed = time.time() - start
+    if trace:
+        emu.cpu.stop_trace()
+    emu.cpu.apu.output.close()
+
+    if record:
+        session.save(record)
+    return {
+        'frames': display.frames,
+        'cycles': spent,
+        'instructions': emu.cpu.instructions,
+        'seconds': elapsed,
+        'framebuffer': framebuffer_hash(emu),
+        'mismatches': session.mismatches if play else None,
+    }
+
+
+def framebuffer_hash(emu):
+    """ SHA-1 of the PPU's framebuffer, to tell runs apart """
+    return hashlib.sha1(emu.ppu.frame.tobytes()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a ROM without a display.')
+    parser.add_argument('rom')
+    parser.add_argument('--frames', type=int,
+                        help='stop after this many frames (default 60)')
+    parser.add_argument('--cycles', type=int,
+                        help='stop after this many CPU cycles')
+    parser.add_argument('--input', help='scripted button changes')
+    parser.add_argument('--mode', default='table',
+                        choices=('table', 'legacy', 'blocks'),
+                        help='CPU dispatch mode')
+    parser.add_argument('--frame-skip', type=int, default=1,
+                        help='draw only every Nth frame (fast-forward)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', help='record the input to a movie file')
+    group.add_argument('--play', help='replay a movie file and check it')
+    parser.add_argument('--trace', help='log every instruction to this file')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--audio', default='null', choices=('null', 'pygame'),
+                       help='audio output')
+    group.add_argument('--wav', help='write the audio to this WAV file')
+    args = parser.parse_args()
+    if args.frames is None and args.cycles is None and not args.play:
+        args.frames = 60
+
+    with open(args.rom, 'rb') as rom:
+        data = rom.read()
+    script = load_input(args.input) if args.input else None
+    output = audio.FileOutput(args.wav) if args.wav else args.audio
+    result = run(data, args.frames, args.cycles, script, args.mode, args.frame_skip,
+                 args.record, args.play, args.trace, output)
+
+    seconds = result['seconds'] or 1e-9
+    print 'frames       {:10}  {:10.2f} /s'.format(result['frames'],
+                                                 result['frames'] / seconds)
+    print 'instructions {:10}  {:10.0f} /s'.format(result['instructions'],
+                                                 result['instructions'] / seconds)
+    print 'cycles       {:10}  {:10.0f} /s'.format(result['cycles'],
+                                                 result['cycles'] / seconds)
+    print 'seconds      {:10.2f}'.format(result['seconds'])
+    print 'framebuffer  {}'.format(result['framebuffer'])
+    if args.play:
+        mismatches = result['mismatches']
+        print 'mismatches   {:10}{}'.format(
+            len(mismatches), '  first at frame {}'.format(mismatches[0]) if mismatches else '')
+
+
+if __name__ == '__main__':
+    main()
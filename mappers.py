@@ -0,0 +1,250 @@
+'''
+Cartridge mappers, keyed by iNES mapper number in MAPPERS.
+
+A mapper owns the cartridge's bank windows: it handles writes to
+$8000-$FFFF and points the 8KB PRG windows and 1KB CHR windows at banks
+through Cartridge.switch_prg/switch_chr, which only move offsets into
+the ROM image. Nametable mirroring goes through Cartridge.set_mirroring.
+'''
+
+
+class Mapper(object):
+    # registers a save state keeps, as int attributes
+    STATE = ()
+
+    def __init__(self, cart):
+        self.cart = cart
+        self.reset()
+
+    def reset(self):
+        """ Map the power-on banks: the first and last 16KB of PRG """
+        self.cart.switch_prg(0x8000, 0x4000, 0)
+        self.cart.switch_prg(0xc000, 0x4000, -1)
+        self.cart.switch_chr(0x0000, 0x2000, 0)
+
+    def write(self, address, value):
+        """ A CPU write to $8000-$FFFF """
+        pass
+
+    def save_state(self):
+        """ The mapper's registers as a list of ints """
+        return [getattr(self, name) for name in self.STATE]
+
+    def load_state(self, values):
+        """
+        Restore registers from save_state(). The bank windows are restored
+        by the cartridge, so nothing is switched here.
+        """
+        for name, value in zip(self.STATE, values):
+            setattr(self, name, value)
+
+
+class NROM(Mapper):
+    """ Mapper 0: no bank switching, writes to ROM are ignored """
+    pass
+
+
+class MMC1(Mapper):
+    """
+    Mapper 1: registers are loaded through a 5-bit serial port, one bit
+    per write; the fifth write picks the register from bits 13-14 of its
+    address.
+    """
+    # control register bits 0-1; set_mirroring's 'SingleUpper' shows the
+    # first nametable everywhere and 'SingleLower' the second
+    MIRRORING = ['SingleUpper', 'SingleLower', 'Vertical', 'Horizontal']
+    STATE = ('shift', 'shift_count', 'control', 'chr_bank0', 'chr_bank1', 'prg_bank')
+
+    def reset(self):
+        self.shift = 0
+        self.shift_count = 0
+        self.control = 0x0c
+        self.chr_bank0 = 0
+        self.chr_bank1 = 0
+        self.prg_bank = 0
+        self.update_prg()
+        self.update_chr()
+
+    def write(self, address, value):
+        if value & 0x80:
+            self.shift = 0
+            self.shift_count = 0
+            self.control |= 0x0c
+            self.update_prg()
+            return
+
+        self.shift |= (value & 0x1) << self.shift_count
+        self.shift_count += 1
+        if self.shift_count < 5:
+            return
+
+        register = (address >> 13) & 0x3
+        value = self.shift
+        self.shift = 0
+        self.shift_count = 0
+        if register == 0:
+            self.control = value
+            self.cart.set_mirroring(self.MIRRORING[value & 0x3])
+            self.update_prg()
+            self.update_chr()
+        elif register == 1:
+            self.chr_bank0 = value
+            self.update_chr()
+        elif register == 2:
+            self.chr_bank1 = value
+            self.update_chr()
+        else:
+            self.prg_bank = value & 0xf
+            self.update_prg()
+
+    def update_prg(self):
+        mode = (self.control >> 2) & 0x3
+        if mode < 2:
+            # 32KB at $8000, the low bit of the bank number is ignored
+            self.cart.switch_prg(0x8000, 0x8000, self.prg_bank >> 1)
+        elif mode == 2:
+            # first bank fixed at $8000, switch $C000
+            self.cart.switch_prg(0x8000, 0x4000, 0)
+            self.cart.switch_prg(0xc000, 0x4000, self.prg_bank)
+        else:
+            # switch $8000, last bank fixed at $C000
+            self.cart.switch_prg(0x8000, 0x4000, self.prg_bank)
+            self.cart.switch_prg(0xc000, 0x4000, -1)
+
+    def update_chr(self):
+        if self.control & 0x10:
+            # two 4KB banks
+            self.cart.switch_chr(0x0000, 0x1000, self.chr_bank0)
+            self.cart.switch_chr(0x1000, 0x1000, self.chr_bank1)
+        else:
+            # one 8KB bank, the low bit of the bank number is ignored
+            self.cart.switch_chr(0x0000, 0x2000, self.chr_bank0 >> 1)
+
+
+class UxROM(Mapper):
+    """ Mapper 2: switch the 16KB bank at $8000, the last one is fixed """
+    def write(self, address, value):
+        self.cart.switch_prg(0x8000, 0x4000, value)
+
+
+class CNROM(Mapper):
+    """ Mapper 3: switch the whole 8KB of CHR """
+    def write(self, address, value):
+        self.cart.switch_chr(0x0000, 0x2000, value)
+
+
+class MMC3(Mapper):
+    """
+    Mapper 4: eight bank registers selected through $8000 and written
+    through $8001, and a scanline counter, clocked by the PPU at the end
+    of every rendered line, that raises an IRQ when it reaches zero.
+    """
+    STATE = ('bank_select', 'irq_latch', 'irq_counter', 'irq_reload', 'irq_enabled')
+
+    def reset(self):
+        self.bank_select = 0
+        self.registers = [0, 2, 4, 5, 6, 7, 0, 1]
+        self.irq_latch = 0
+        self.irq_counter = 0
+        self.irq_reload = False
+        self.irq_enabled = False
+        self.update_prg()
+        self.update_chr()
+        self.cart.set_scanline_counter(self)
+
+    def save_state(self):
+        return Mapper.save_state(self) + self.registers
+
+    def load_state(self, values):
+        Mapper.load_state(self, values)
+        self.registers[:] = values[len(self.STATE):]
+
+    def write(self, address, value):
+        even = not address & 0x1
+        if address < 0xa000:
+            if even:
+                changed = self.bank_select ^ value
+                self.bank_select = value
+                if changed & 0x40:
+                    self.update_prg()
+                if changed & 0x80:
+                    self.update_chr()
+            else:
+                register = self.bank_select & 0x7
+                self.registers[register] = value
+                if register >= 6:
+                    self.update_prg()
+                else:
+                    self.update_chr_register(register)
+        elif address < 0xc000:
+            if even:
+                self.cart.set_mirroring('Horizontal' if value & 0x1 else 'Vertical')
+            # odd: PRG RAM protect, the RAM is always enabled here
+        else:
+            # bring the counter up to date before changing it, then move
+            # the deadline the PPU is run to
+            self.cart.sync_ppu()
+            if address < 0xe000:
+                if even:
+                    self.irq_latch = value
+                else:
+                    self.irq_counter = 0
+                    self.irq_reload = True
+            elif even:
+                self.irq_enabled = False
+                self.cart.set_irq(False)
+            else:
+                self.irq_enabled = True
+            self.cart.sync_ppu()
+
+    def update_prg(self):
+        r6, r7 = self.registers[6], self.registers[7]
+        if self.bank_select & 0x40:
+            self.cart.switch_prg(0x8000, 0x2000, -2)
+            self.cart.switch_prg(0xc000, 0x2000, r6)
+        else:
+            self.cart.switch_prg(0x8000, 0x2000, r6)
+            self.cart.switch_prg(0xc000, 0x2000, -2)
+        self.cart.switch_prg(0xa000, 0x2000, r7)
+        self.cart.switch_prg(0xe000, 0x2000, -1)
+
+    def update_chr(self):
+        for register in range(6):
+            self.update_chr_register(register)
+
+    def update_chr_register(self, register):
+        # R0 and R1 are 2KB banks, R2-R5 1KB banks; bit 7 of the bank
+        # select swaps which half of the pattern tables each group is in
+        value = self.registers[register]
+        low = 0x1000 if self.bank_select & 0x80 else 0
+        if register < 2:
+            self.cart.switch_chr(low + 0x800 * register, 0x800, value >> 1)
+        else:
+            self.cart.switch_chr((low ^ 0x1000) + 0x400 * (register - 2), 0x400, value)
+
+    def clock(self):
+        """ The PPU finished a rendered scanline """
+        if self.irq_counter == 0 or self.irq_reload:
+            self.irq_counter = self.irq_latch
+            self.irq_reload = False
+        else:
+            self.irq_counter -= 1
+        if self.irq_counter == 0 and self.irq_enabled:
+            self.cart.set_irq(True)
+
+    def clocks_to_irq(self):
+        """ Scanline clocks until the next IRQ, None when disabled """
+        if not self.irq_enabled:
+            return None
+        if self.irq_counter == 0 or self.irq_reload:
+            return self.irq_latch + 1 if self.irq_latch else 1
+        return self.irq_counter
+
+
+MAPPERS = {
+    0: NROM,
+    1: MMC1,
+    2: UxROM,
+    3: CNROM,
+    4: MMC3,
+}
@@ -0,0 +1,182 @@
+'''
+Input movies: the controller state of every frame, recorded from a save
+state and replayed from it.
+
+Input only reaches a game when it latches the controllers by strobing
+$4016, so that is where a movie hooks in. The first latch of each frame
+(by ppu.frame_count) fixes both gamepads for the whole frame: recording
+stores the live state, playback hands back the stored one instead. The
+same latch records a CRC32 of the framebuffer, which playback checks to
+catch a run drifting from the recording.
+
+A movie file is the zlib-compressed
+
+    'PYNM', format version (uint16), SHA-1 of the ROM image (20 bytes)
+    first and last frame (uint32 each)
+    start state: length (uint32), savestate blob
+    input changes: count (uint32), then frame (uint32), gamepad 1, gamepad 2 (bytes)
+    frame hashes: count (uint32), then frame, CRC32 (uint32 each)
+'''
+import struct
+import zlib
+
+MAGIC = 'PYNM'
+VERSION = 3
+HEADER = struct.Struct('<4sH20sII')
+COUNT = struct.Struct('<I')
+CHANGE = struct.Struct('<IBB')
+HASH = struct.Struct('<II')
+
+
+class Movie(object):
+    def __init__(self, nes):
+        self.nes = nes
+        self.state = None
+        self.first = self.last = 0
+        # (frame, gamepad 1, gamepad 2) whenever the input changed
+        self.changes = []
+        # frame -> CRC32 of the framebuffer at its first latch
+        self.hashes = {}
+        # frames whose hash did not match on playback
+        self.mismatches = []
+        self.recording = self.playing = False
+        # the frame latched last, what it latched and the next change to
+        # play back
+        self.frame = None
+        self.input = (0, 0)
+        self.change = 0
+
+    def record(self):
+        """ Start a new recording from the NES's current state """
+        self.state = self.nes.save_state()
+        self.first = self.last = self.nes.ppu.frame_count
+        del self.changes[:]
+        self.hashes.clear()
+        self.start(recording=True)
+
+    def play(self):
+        """ Restore the start state and replay the recorded input """
+        self.nes.load_state(self.state)
+        del self.mismatches[:]
+        self.start(recording=False)
+
+    def start(self, recording):
+        self.recording = recording
+        self.playing = not recording
+        self.frame = None
+        self.input = (0, 0)
+        self.change = 0
+        self.nes.cpu.controller.movie = self
+
+    def stop(self):
+        if self.recording:
+            self.finish()
+        self.recording = self.playing = False
+        self.nes.cpu.controller.movie = None
+
+    def __len__(self):
+        """ Number of frames recorded """
+        return self.last - self.first + 1 if self.state else 0
+
+    @property
+    def finished(self):
+        return self.playing and self.nes.ppu.frame_count > self.last
+
+    def latch(self, status):
+        """
+        The controllers are being latched with status; return the
+        gamepads to latch instead.
+        """
+        self.nes.sync_ppu()
+        frame = self.nes.ppu.frame_count
+        if frame == self.frame:
+            return self.input
+        self.frame = frame
+        # the framebuffer is only comparable when every frame is drawn
+        crc = None
+        if self.nes.ppu.frame_skip == 1:
+            crc = zlib.crc32(self.nes.ppu.frame.tobytes()) & 0xffffffff
+
+        if self.recording:
+            if frame <= self.last and self.changes:
+                # stepped back by a rewind or a state load, record over
+                # what came after
+                self.truncate(frame)
+            self.last = frame
+            self.input = (status[0] & 0xff, status[1] & 0xff)
+            if not self.changes or self.changes[-1][1:] != self.input:
+                self.changes.append((frame,) + self.input)
+            if crc is not None:
+                self.hashes[frame] = crc
+        else:
+            changes = self.changes
+            while self.change < len(changes) and changes[self.change][0] <= frame:
+                self.input = changes[self.change][1:]
+                self.change += 1
+            if crc is not None and self.hashes.get(frame, crc) != crc:
+                self.mismatches.append(frame)
+        return self.input
+
+    def finish(self):
+        """
+        End the recording at the last frame run, whether or not the game
+        latched the controllers in the frames since the last latch
+        """
+        self.nes.sync_ppu()
+        ppu = self.nes.ppu
+        last = ppu.frame_count
+        if ppu.scanline < 241 or ppu.scanline == 241 and ppu.cycle <= 1:
+            # the frame in progress is not out yet
+            last -= 1
+        if self.frame is not None:
+            # the frame in progress counts once its input is latched
+            last = max(last, self.frame)
+        last = max(last, self.first)
+        if last < self.last:
+            # stepped back since, the frames after are gone
+            self.truncate(last + 1)
+        self.last = last
+
+    def truncate(self, frame):
+        """ Forget the frames from frame on """
+        self.changes = [change for change in self.changes if change[0] < frame]
+        for old in [old for old in self.hashes if old >= frame]:
+            del self.hashes[old]
+
+    def save(self, path):
+        if self.recording:
+            self.finish()
+        data = [HEADER.pack(MAGIC, VERSION, self.nes.rom.digest(), self.first, self.last),
+                COUNT.pack(len(self.state)), self.state,
+                COUNT.pack(len(self.changes))]
+        data += [CHANGE.pack(*change) for change in self.changes]
+        data.append(COUNT.pack(len(self.hashes)))
+        data += [HASH.pack(frame, crc) for frame, crc in sorted(self.hashes.items())]
+        with open(path, 'wb') as movie:
+            movie.write(zlib.compress(''.join(data), 9))
+
+    def load(self, path):
+        with open(path, 'rb') as movie:
+            data = zlib.decompress(movie.read())
+        magic, version, digest, self.first, self.last = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise Exception('Not a movie')
+        if version != VERSION:
+            raise Exception('Unsupported movie version {}'.format(version))
+        if digest != self.nes.rom.digest():
+            raise Exception('Movie was recorded with a different ROM')
+
+        offset = HEADER.size
+        length = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        self.state = data[offset:offset + length]
+        offset += length
+        count = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        self.changes = [CHANGE.unpack_from(data, offset + i * CHANGE.size)
+                        for i in range(count)]
+        offset += count * CHANGE.size
+        count = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        self.hashes = dict(HASH.unpack_from(data, offset + i * HASH.size)
+                           for i in range(count))
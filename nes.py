@@ -4,49 +4,79 @@ The entry point for the emulator
 from cpu import cpu
 import ppu
 import cartridge
+import savestate
 import cProfile
 import pstats
 import StringIO
 
 
 class NES(object):
-    def __init__(self, rom=None, display=None):
+    def __init__(self, rom=None, display=None, audio='null'):
+        # The PPU runs behind the CPU and catches up only when the CPU
+        # touches one of its registers or the cartridge, or the next
+        # vblank or cartridge IRQ is due. ppu_dots is how far behind it is
+        # and ppu_deadline how many dots it can fall behind.
+        self.ppu_dots = 0
+        self.ppu_deadline = 0
+        # a cartridge only counts as inserted once it has finished loading
+        self.rom = None
         if rom:
             self.ppu = ppu.PPU(self, display)
             self.rom = cartridge.Cartridge(self, rom)
-            self.cpu = cpu.CPU(self, self.rom)
+            self.cpu = cpu.CPU(self, self.rom, audio)
             self.halt_cpu = 0
 
             self.power_up()
         else:
-            self.rom = None
-            self.cpu = cpu.CPU(self, self.rom)
+            self.cpu = cpu.CPU(self, self.rom, audio)
             self.ppu = ppu.PPU(self)
             self.halt_cpu = 0
 
     def power_up(self):
         self.cpu.set_reset_vector()
 
+    def set_frame_skip(self, frames):
+        """
+        Fast-forward: draw and output only every frames-th frame (1 draws
+        them all). Skipped frames still raise vblank, the NMI, sprite
+        overflow and sprite 0 hit, and the display is told of them with
+        SkipFrame() instead of NewFrame().
+        """
+        self.ppu.frame_skip = max(1, frames)
+
     def save_state(self):
-        pass
+        """ Snapshot the whole machine, see savestate """
+        return savestate.save(self)
 
-    def load_state(self):
-        pass
+    def load_state(self, data):
+        """ Restore a snapshot taken by save_state() """
+        savestate.load(self, data)
 
     def step(self):
+        """ Run one instruction (or translated block), return its cycles """
         if not self.halt_cpu:
             cycles = self.cpu.execute()
         else:
             cycles = 1
             self.halt_cpu -= 1
 
-        for i in range(3 * cycles):
-            self.ppu.step()
+        self.ppu_dots += 3 * cycles
+        if self.ppu_dots >= self.ppu_deadline:
+            self.sync_ppu()
+        return cycles
+
+    def sync_ppu(self):
+        """ Run the PPU up to the CPU's current timestamp """
+        if self.ppu_dots:
+            self.ppu.run(self.ppu_dots)
+            self.ppu_dots = 0
+        self.ppu_deadline = self.ppu.dots_to_event()
 
     def load_rom(self, rom_data):
         self.rom = cartridge.Cartridge(self, rom_data)
+        self.cpu.memory.map_prg()
+        self.cpu.translator.flush()
         # self.cpu.set_reset_vector()
 
     def parse_input(self, gamepad, button, updown):
-        print "Button {} {}".format(button, "pressed" if updown else "released")
         self.cpu.controller.button_change(gamepad, button, updown)
@@ -12,6 +12,17 @@ MirrorType = enum('Horizontal', 'Vertical', 'SingleUpper', 'SingleLower')
 PATTERN_TABLE_SIZE = 0x1000
 NAMETABLE_SIZE = 0x400
 StatusBit = enum(SpriteOverflow=5, Sprite0Hit=6, InVblank=7)
+DOTS_PER_SCANLINE = 341
+VBLANK_DOT = 241 * DOTS_PER_SCANLINE + 1
+
+# Dots of each scanline (-1 to 260) on which step() has work to do; on
+# every other dot it only advances the cycle. 340 ends the line.
+LINE_EVENTS = ([(1, 304, 340)] + [(254, 256, 257, 340)] * 240 +
+               [(340,), (1, 340)] + [(340,)] * 19)
+# the same with dot 260 of the rendered lines, where a cartridge's
+# scanline counter is clocked
+COUNTER_LINE_EVENTS = ([(1, 260, 304, 340)] + [(254, 256, 257, 260, 340)] * 240 +
+                       LINE_EVENTS[241:])
 
 rgb_palette = [
     0x666666, 0x002A88, 0x1412A7, 0x3B00A4, 0x5C007E,
@@ -28,65 +39,51 @@ rgb_palette = [
     0xF7D8A5, 0xE4E594, 0xCFEF96, 0xBDF4AB, 0xB3F3CC,
     0xB5EBF2, 0xB8B8B8, 0x000000, 0x000000,
 ]
+RGB_PALETTE = np.array(rgb_palette, dtype=np.uint32)
+
+# Background pixels in the order create_tile_row draws them: bit b of the
+# pattern row fetched for tile t goes to column t * 8 - b (wrapping to the
+# right edge), on the line above for the first tile.
+FRAME_PIXELS = 256 * 240
+ROW_TILE = np.arange(256) >> 3
+ROW_BIT = np.arange(256) & 0x7
+ROW_X = (ROW_TILE * 8 - ROW_BIT) % 256
+# the attribute shift for tiles t and t + 1 comes from the byte fetched
+# after tile t - 1, and the latch alternates between those pairs
+ROW_ATTR_FETCH = ROW_TILE & ~0x1
+ROW_LATCH = (ROW_TILE >> 1) & 0x1
+# Column offsets of the 8 pattern bits of a sprite row for each attribute
+# byte: bit 7 on the left, unless bit 6 flips the sprite horizontally.
+SPRITE_COLUMNS = np.where((np.arange(256) >> 6 & 0x1)[:, np.newaxis],
+                          np.arange(8), 7 - np.arange(8))
+# The columns of the row drawn on a line, as slices of the lines they are
+# on: the first tile's columns (0 and 249-255) are 8 lines above
+ROW_SPANS = ((0, slice(1, 249)), (-8, slice(0, 1)), (-8, slice(249, 256)))
+# pixels from the start of a row to each of its 33 tile fetches, when
+# every pixel is drawn
+FETCH_STEPS = 8 * np.arange(33)
 
 
 class PPU(object):
     class Memory(object):
+        """
+        PPU address space. The pattern tables at $0000-$1FFF are eight 1KB
+        windows into the cartridge's CHR memory, windows[addr >> 10]
+        giving the offset of each, so a CHR bank switch moves a single
+        offset (map_window). The rest is decoded through a flat table:
+        buffers[addr] and offsets[addr] give the byte behind every address
+        from $2000 to $3FFF, with the nametable and palette mirrors built
+        in, and are remapped when the mirroring is set.
+        """
         class NameTable(object):
-            def __init__(self):
+            def __init__(self, remap):
                 self.nametables = [[], [], [], []]
                 self.attrtables = [[], [], [], []]
-                self.nt_changed = [0] * 32
-                self.at_changed = [0] * 32
                 self._nametables = [bytearray(0x3c0), bytearray(0x3c0)]
                 self._attrtables = [bytearray(0x40), bytearray(0x40)]
                 self._mirroring = None
-
-            def read(self, addr):
-                if 0x2000 <= addr < 0x23c0:
-                    return self.nametables[0][addr - 0x2000]
-                elif addr < 0x2400:
-                    return self.attrtables[0][addr - 0x23c0]
-                elif addr < 0x27c0:
-                    return self.nametables[1][addr - 0x2400]
-                elif addr < 0x2800:
-                    return self.attrtables[1][addr - 0x27c0]
-                elif addr < 0x2bc0:
-                    return self.nametables[2][addr - 0x2800]
-                elif addr < 0x2c00:
-                    return self.attrtables[2][addr - 0x2bc0]
-                elif addr < 0x2fc0:
-                    return self.nametables[3][addr - 0x2c00]
-                elif addr < 0x3000:
-                    return self.attrtables[3][addr - 0x2fc0]
-                else:
-                    return self.read(addr - 0x1000)
-
-            def write(self, addr, value):
-                if 0x2000 <= addr < 0x23c0:
-                    self.nametables[0][addr - 0x2000] = value
-                    self.nt_changed[(addr - 0x2000) / 32] = 1
-                elif addr < 0x2400:
-                    self.attrtables[0][addr - 0x23c0] = value
-                    self.at_changed[(addr - 0x23c0) / 8] = 1
-                elif addr < 0x27c0:
-                    self.nametables[1][addr - 0x2400] = value
-                    self.nt_changed[(addr - 0x2400) / 32] = 1
-                elif addr < 0x2800:
-                    self.attrtables[1][addr - 0x27c0] = value
-                    self.at_changed[(addr - 0x27c0) / 8] = 1
-                elif addr < 0x2bc0:
-                    self.nametables[2][addr - 0x2800] = value
-                    self.nt_changed[(addr - 0x2800) / 32] = 1
-                elif addr < 0x2c00:
-                    self.attrtables[2][addr - 0x2bc0] = value
-                    self.at_changed[(addr - 0x2bc0) / 8] = 1
-                elif addr < 0x2fc0:
-                    self.nametables[3][addr - 0x2c00] = value
-                    self.nt_changed[(addr - 0x2c00) / 32] = 1
-                elif addr < 0x3000:
-                    self.attrtables[3][addr - 0x2fc0] = value
-                    self.at_changed[(addr - 0x2fc0) / 8] = 1
+                # called after the mirroring changes
+                self._remap = remap
 
             def nt_byte(self, nametable, x, y):
                 x = (x / 8) - 1
@@ -117,87 +114,105 @@ class PPU(object):
                     for (i, j) in zip(range(4), [1, 1, 1, 1]):
                         self.nametables[i] = self._nametables[j]
                         self.attrtables[i] = self._attrtables[j]
+                self._remap()
 
         class PaletteTable(object):
             def __init__(self):
                 self._memory = bytearray(0x20)
 
-            def read(self, addr):
-                if 0x3f00 <= addr < 0x3f20:
-                    return self._memory[addr - 0x3f00]
-                elif 0x3f20 <= addr < 0x3f40:
-                    return self.read(addr - 0x20)
-                elif 0x3f40 <= addr < 0x3f60:
-                    return self.read(addr - 0x40)
-                elif 0x3f60 <= addr < 0x3f80:
-                    return self.read(addr - 0x60)
-                elif 0x3f80 <= addr < 0x3fa0:
-                    return self.read(addr - 0x80)
-                elif 0x3fa0 <= addr < 0x3fc0:
-                    return self.read(addr - 0xa0)
-                elif 0x3fc0 <= addr < 0x3fe0:
-                    return self.read(addr - 0xc0)
-                elif 0x3fe0 <= addr < 0x4000:
-                    return self.read(addr - 0xe0)
-
-            def write(self, addr, value):
-                if 0x3f00 <= addr < 0x3f20:
-                    if addr == 0x3F00 or addr == 0x3F10:
-                        self._memory[0x00] = value
-                        self._memory[0x10] = value
-                    elif addr == 0x3F04 or addr == 0x3F14:
-                        self._memory[0x04] = value
-                        self._memory[0x14] = value
-                    elif addr == 0x3F08 or addr == 0x3F18:
-                        self._memory[0x08] = value
-                        self._memory[0x18] = value
-                    elif addr == 0x3F0C or addr == 0x3F1C:
-                        self._memory[0x0C] = value
-                        self._memory[0x1C] = value
-                    else:
-                        self._memory[addr - 0x3f00] = value
-                elif 0x3f20 <= addr < 0x3f40:
-                    self.write(addr - 0x20, value)
-                elif 0x3f40 <= addr < 0x3f60:
-                    self.write(addr - 0x40, value)
-                elif 0x3f60 <= addr < 0x3f80:
-                    self.write(addr - 0x60, value)
-                elif 0x3f80 <= addr < 0x3fa0:
-                    self.write(addr - 0x80, value)
-                elif 0x3fa0 <= addr < 0x3fc0:
-                    self.write(addr - 0xa0, value)
-                elif 0x3fc0 <= addr < 0x3fe0:
-                    self.write(addr - 0xc0, value)
-                elif 0x3fe0 <= addr < 0x4000:
-                    self.write(addr - 0xe0, value)
-
         # Memory functions
-        def __init__(self, nes):
+        def __init__(self, nes, line_cache):
             self._nes = nes
-            self._memory = bytearray(0x8000)
-            self.nametable = PPU.Memory.NameTable()
+            self.line_cache = line_cache
+            # the physical nametable (0 or 1) each of the four shows
+            self.quarters = [0] * 4
+            self.nametable = PPU.Memory.NameTable(self.map_nametables)
             self.palettetable = PPU.Memory.PaletteTable()
+            self.windows = [0] * 8
+            self.buffers = [None] * 0x4000
+            self.offsets = [0] * 0x4000
+
+            # $3F00-$3FFF repeats the 32 palette entries, and the sprite
+            # palettes' first entries $3F10/$3F14/$3F18/$3F1C are the
+            # background's $3F00/$3F04/$3F08/$3F0C
+            palette = self.palettetable._memory
+            for addr in range(0x3f00, 0x4000):
+                offset = addr & 0x1f
+                if not offset & 0x3:
+                    offset &= 0x0f
+                self.buffers[addr] = palette
+                self.offsets[addr] = offset
+            self.attach(None)
+
+        def attach(self, cart):
+            """ Map the pattern tables to the CHR memory of cart """
+            if cart is None:
+                self.chr = bytearray(0x2000)
+                self.chr_base = 0
+                windows = range(0, 0x2000, 0x400)
+            else:
+                self.chr = cart.chr
+                self.chr_base = cart.chr_base
+                windows = cart.chr_windows
+            # CHR ROM is part of the ROM image, which writes must not touch
+            self.chr_rom = cart is not None and cart.chr is cart.image
+            self.windows[:] = windows
+
+        def map_window(self, window, offset):
+            """ Point the 1KB pattern table window at offset in the CHR memory """
+            self.windows[window] = offset
+
+        def map_nametables(self):
+            """ Map $2000-$3EFF to the nametables the mirroring selects """
+            physical = self.nametable._nametables[0]
+            self.quarters = [0 if names is physical else 1
+                             for names in self.nametable.nametables]
+            for quarter in range(4):
+                buffers = ([self.nametable.nametables[quarter]] * 0x3c0 +
+                           [self.nametable.attrtables[quarter]] * 0x40)
+                offsets = range(0x3c0) + range(0x40)
+                # $3000-$3EFF mirrors $2000-$2EFF
+                for start in (0x2000 + quarter * 0x400, 0x3000 + quarter * 0x400):
+                    end = min(start + 0x400, 0x3f00)
+                    self.buffers[start:end] = buffers[:end - start]
+                    self.offsets[start:end] = offsets[:end - start]
 
         def read(self, addr):
-            if 0x0000 <= addr < 0x2000:
-                return self._nes.rom.read_chr(addr)
-            elif 0x2000 <= addr < 0x3f00:
-                return self.nametable.read(addr)
-            elif 0x3f00 <= addr < 0x4000:
-                return self.palettetable.read(addr)
-            else:
-                return self.read(addr % 0x4000)
+            addr &= 0x3fff
+            if addr < 0x2000:
+                return self.chr[self.windows[addr >> 10] + (addr & 0x3ff)]
+            return self.buffers[addr][self.offsets[addr]]
 
         def write(self, addr, value):
-            self._memory[addr] = value
-            if 0x0000 <= addr < 0x2000:
-                self._nes.rom.write_chr(addr, value)
-            elif 0x2000 <= addr < 0x3f00:
-                self.nametable.write(addr, value)
-            elif 0x3f00 <= addr < 0x4000:
-                self.palettetable.write(addr, value)
+            addr &= 0x3fff
+            if addr < 0x2000:
+                if self.chr_rom:
+                    return
+                offset = self.windows[addr >> 10] + (addr & 0x3ff)
+                buffer = self.chr
             else:
-                self.write(addr % 0x4000)
+                offset = self.offsets[addr]
+                buffer = self.buffers[addr]
+            if buffer[offset] == value:
+                # games rewrite the same bytes every frame, leaving the
+                # lines drawn from them as they were
+                return
+            buffer[offset] = value
+            if addr >= 0x3f00:
+                # the renderers look the sprite palettes up by their own
+                # entries, so the shared ones are written to both
+                if not offset & 0x3:
+                    self.palettetable._memory[offset | 0x10] = value
+                if offset < 0x10:
+                    self.line_cache.palette = self.line_cache.stamp()
+            elif addr >= 0x2000:
+                table = self.quarters[(addr >> 10) & 0x3]
+                if addr & 0x3ff < 0x3c0:
+                    self.line_cache.names[table][offset >> 5] = self.line_cache.stamp()
+                else:
+                    self.line_cache.attrs[table][offset >> 3] = self.line_cache.stamp()
+            else:
+                self._nes.ppu.tiles.invalidate((offset - self.chr_base) >> 4)
 
     class OAM(object):
         def __init__(self, nes):
@@ -217,24 +232,191 @@ class PPU(object):
             left_x = self._memory[addr + 3]
             return (top_y, tile_index, attributes, left_x)
 
+    class TileCache(object):
+        """
+        CHR tiles decoded into 2-bit pixel values, indexed by
+        [tile][row][bit] where tile counts 16-byte tiles from the start of
+        the cartridge's CHR memory and bit 7 is the leftmost pixel.
+        tile_map takes the 0x200 pattern table tiles (address / 16) to
+        them through the current CHR banks, so a bank switch only rewrites
+        part of it. A tile is decoded on first use and again after its CHR
+        bytes are written.
+        """
+        def __init__(self, nes, line_cache):
+            self._nes = nes
+            self.line_cache = line_cache
+            self.tile_map = np.arange(0x200)
+            self.attach(None)
+
+        def attach(self, cart):
+            """ Start over with the CHR memory of cart """
+            if cart is None:
+                self.chr = np.zeros((0x200, 16), dtype=np.uint8)
+            else:
+                self.chr = np.frombuffer(cart.chr, dtype=np.uint8, count=cart.chr_size,
+                                         offset=cart.chr_base).reshape(-1, 16)
+            self.pixels = np.zeros((len(self.chr), 8, 8), dtype=np.uint8)
+            self.valid = np.zeros(len(self.chr), dtype=bool)
+            self.tile_map[:] = np.arange(0x200) % len(self.chr)
+            self.line_cache.clear()
+
+        def map_window(self, window, tile):
+            """ Point the 64 tiles of a 1KB CHR window at tile onwards """
+            self.tile_map[window * 64:(window + 1) * 64] = np.arange(tile, tile + 64)
+            self.line_cache.patterns[window * 64:(window + 1) * 64] = self.line_cache.stamp()
+
+        def invalidate(self, tile):
+            # a tile only becomes valid again by being decoded for a
+            # line, so the lines drawn from it are stamped out once
+            if self.valid[tile]:
+                self.valid[tile] = False
+                self.line_cache.patterns[self.tile_map == tile] = self.line_cache.stamp()
+
+        def invalidate_all(self):
+            self.valid.fill(False)
+            self.line_cache.clear()
+
+        def get(self, tiles, rows=None):
+            """
+            Return the decoded pixels for an array of pattern table tiles,
+            or just one row of each when rows is given
+            """
+            tiles = self.tile_map[tiles]
+            stale = tiles[~self.valid[tiles]]
+            if len(stale):
+                self.decode(np.unique(stale))
+            if rows is None:
+                return self.pixels[tiles]
+            return self.pixels[tiles, rows]
+
+        def decode(self, tiles):
+            data = self.chr[tiles]
+            bits = np.arange(8)
+            low = (data[:, :8, np.newaxis] >> bits) & 0x1
+            high = (data[:, 8:, np.newaxis] >> bits) & 0x1
+            self.pixels[tiles] = low | (high << 1)
+            self.valid[tiles] = True
+
+    class LineCache(object):
+        """
+        The background row drawn on each line, kept with what it was drawn
+        from so the next frame can copy it back instead of drawing it
+        again.
+
+        Every write the background depends on is stamped with a running
+        count: the nametable and attribute rows of each physical
+        nametable (a line fetches whole rows of tiles), the pattern table
+        tiles, as they are written or switched in, and the background
+        palette. A line is copied when it starts from the same scroll
+        position, nametable, fine y and pattern table, and nothing it
+        fetched was stamped after it was drawn.
+        """
+        def __init__(self):
+            self.now = 0
+            self.names = [[0] * 30, [0] * 30]
+            self.attrs = [[0] * 8, [0] * 8]
+            self.patterns = np.zeros(0x200, dtype=np.int64)
+            self.palette = 0
+            # the row of each line, by column
+            self.pixels = np.zeros((240, 256), dtype=np.uint8)
+            self.values = np.zeros((240, 256), dtype=np.uint8)
+            self.clear()
+
+        def clear(self):
+            """ Forget every line """
+            self.keys = [None] * 240
+            self.stamps = [0] * 240
+            # (physical nametable, name rows, attribute rows, pattern tiles)
+            self.sources = [None] * 240
+            self.shifts = [None] * 240
+
+        def stamp(self):
+            self.now += 1
+            return self.now
+
+        def fresh(self, line, key):
+            """ Whether the row kept for line can stand in for drawing it from key """
+            if self.keys[line] != key:
+                return False
+            stamp = self.stamps[line]
+            table, names, attrs, patterns = self.sources[line]
+            if self.palette > stamp:
+                return False
+            for row in names:
+                if self.names[table][row] > stamp:
+                    return False
+            for row in attrs:
+                if self.attrs[table][row] > stamp:
+                    return False
+            return self.patterns[patterns].max() <= stamp
+
+        def store(self, line, key, sources, shifts):
+            self.keys[line] = key
+            self.stamps[line] = self.now
+            self.sources[line] = sources
+            self.shifts[line] = shifts
+
+    class Frame(object):
+        """
+        The picture as the PPU outputs it: the NES color (0-63) of every
+        pixel, indexed [y][x] like the lines it is drawn in, and the
+        emphasis bits (PPUMASK bits 5-7) of every line. Colors are only
+        looked up when a display asks for them, so frames nobody looks at
+        cost nothing to convert.
+        """
+        def __init__(self):
+            # black, $0F, until something is drawn
+            self.pixels = np.empty((240, 256), dtype=np.uint8)
+            self.pixels.fill(0x0f)
+            self.emphasis = np.zeros(240, dtype=np.uint8)
+
+        def rgb(self, palette=RGB_PALETTE):
+            """
+            The frame in the colors of palette, an array of the 64 NES
+            colors, or 8 x 64 to look them up by each line's emphasis
+            """
+            if palette.ndim == 1:
+                return palette[self.pixels]
+            return palette[self.emphasis[:, np.newaxis], self.pixels]
+
+        def copy(self, frame):
+            """ Overwrite this frame with frame """
+            self.pixels[:] = frame.pixels
+            self.emphasis[:] = frame.emphasis
+
+        def tobytes(self):
+            return self.pixels.tobytes() + self.emphasis.tobytes()
+
     def __init__(self, nes, display):
         self.pr = cProfile.Profile()
         self._nes = nes
         # ppu memory
-        self.vram = PPU.Memory(nes)
+        self.line_cache = PPU.LineCache()
+        self.vram = PPU.Memory(nes, self.line_cache)
+        self.tiles = PPU.TileCache(nes, self.line_cache)
         self.sram64 = PPU.OAM(nes)
         self.sram8 = PPU.OAM(nes)
         # render states
+        # one row of y, tile, attributes and x per sprite
+        self.sprites = np.zeros((64, 4), dtype=np.intp)
         self.sprite_data = {
-            'y': [0] * 64,
-            'tiles': [0] * 64,
-            'attributes': [0] * 64,
-            'x': [0] * 64
+            'y': self.sprites[:, 0],
+            'tiles': self.sprites[:, 1],
+            'attributes': self.sprites[:, 2],
+            'x': self.sprites[:, 3]
         }
-        self.colors = np.array([[0] * 240] * 256, ndmin=2, dtype=np.uint32)
-        self.values = np.array([[0] * 240] * 256, ndmin=2, dtype=np.uint32)
-        self.pindexes = np.array([[0] * 240] * 256, ndmin=2, dtype=np.uint32)
-        # self.frame_buffer = np.array([[0] * 240] * 256, ndmin=2, dtype=np.uint32)
+        # only draw the first 8 sprites found on a scanline, like the
+        # hardware; overflow is flagged either way
+        self.sprite_limit = True
+        self.frame = PPU.Frame()
+        self.pixels = self.frame.pixels
+        # the pixel value (0-3) drawn at each pixel, and the number of the
+        # sprite that drew it or 0xff, laid out like frame.pixels
+        self.values = np.zeros((240, 256), dtype=np.uint8)
+        self.pindexes = np.zeros((240, 256), dtype=np.uint8)
+        # the lines sprites have drawn on since the frame started: a row
+        # can only find pixels already drawn on those
+        self.covered = np.zeros(240, dtype=bool)
         self.display = display
 
         ''' Flags (Reg 1) '''
@@ -288,12 +470,20 @@ class PPU(object):
         self.frame_count = 0
         self.cycle = 0
         self.scanline = 241
+        # the cartridge's scanline counter (MMC3), clocked at dot 260 of
+        # every rendered line
+        self.scanline_counter = None
+        self.line_events = LINE_EVENTS
+        # fast-forward: only every frame_skip-th frame is drawn and output,
+        # the others keep the status flags and the NMI but draw only what
+        # those depend on
+        self.frame_skip = 1
+        self.skip_frame = False
         self.ignore_nmi = 0
         self.ignore_vblank = 1
 
         self.frame_x = 0
         self.frame_y = 0
-        self.render_bg_flag = 0
 
     def read_register(self, address):
         if address == 0x2002:
@@ -583,24 +773,27 @@ class PPU(object):
                 self.status = clear_bit(self.status, StatusBit.InVblank)
                 self.status = clear_bit(self.status, StatusBit.SpriteOverflow)
                 self.status = clear_bit(self.status, StatusBit.Sprite0Hit)
+            elif self.cycle == 260:
+                if self.scanline_counter and (self.show_background or self.show_sprites):
+                    self.scanline_counter.clock()
             elif self.cycle == 304:
                 if self.show_background or self.show_sprites:
                     self.vram_addr = self.vram_addr_buffer
         elif 0 <= self.scanline < 240:
             # handle all 256 cycles of rendering at once
-            if self.cycle == 254:
+            if self.cycle == 254 and self.skip_frame:
                 if self.show_background:
-                    # self.create_tile_row()
-                    if self.vram.nametable.nt_changed[self.frame_y / 8]:
-                        if self.frame_y % 8 == 7:
-                            self.vram.nametable.nt_changed[self.frame_y / 8] = 0
-                        self.create_tile_row()
-                    elif self.vram.nametable.at_changed[self.frame_y / 32]:
-                        if self.frame_y % 8 == 7:
-                            self.vram.nametable.at_changed[self.frame_y / 32] = 0
-                        self.create_tile_row()
+                    if self.row_needed():
+                        self.draw_tile_row()
                     else:
+                        # the row would have been drawn over the whole line
                         self.frame_y = (self.frame_y + 1) % 240
+                if self.show_sprites:
+                    self.check_sprites()
+            elif self.cycle == 254:
+                self.frame.emphasis[self.scanline] = self.mask >> 5
+                if self.show_background:
+                    self.draw_tile_row()
                 if self.show_sprites:
                     self.evaluate_sprites()
             elif self.cycle == 256:
@@ -610,6 +803,9 @@ class PPU(object):
                 if self.show_background or self.show_sprites:
                     self.vram_addr = ((self.vram_addr & ~0x41f) |
                                       (self.vram_addr_buffer & 0x41f))
+            elif self.cycle == 260:
+                if self.scanline_counter and (self.show_background or self.show_sprites):
+                    self.scanline_counter.clock()
         elif self.scanline == 241:
             if self.cycle == 1:
                 if not self.ignore_vblank:
@@ -624,6 +820,7 @@ class PPU(object):
                 self.cycle = -1
                 self.scanline = -1
                 self.frame_count += 1
+                self.skip_frame = self.frame_skip > 1 and self.frame_count % self.frame_skip != 0
 
         if self.cycle >= 340:
             self.cycle = -1
@@ -632,113 +829,206 @@ class PPU(object):
         self.cycle += 1
         # self.pr.disable()
 
-    def create_tile_row(self):
-        # get the first tile layer
-        attr = self.vram.nametable.at_byte(self.nametable_addr, self.frame_x, self.frame_y)
-        index = self.vram.nametable.nt_byte(self.nametable_addr, self.frame_x, self.frame_y)
-        tile = self.get_bg_tbl_address(index)
-
-        # flip 10th bit on wraparound
-        if (self.vram_addr & 0x1f) == 0x1f:
-            self.vram_addr ^= 0x41f
-        else:
-            self.vram_addr += 1
-
-        low, high = self.vram.read(tile), self.vram.read(tile + 8)
-        self.shift16_1, self.shift16_2 = low, high
-
-        # get the second tile layer
-        attr_buffer = self.vram.nametable.at_byte(self.nametable_addr, self.frame_x, self.frame_y)
-        index = self.vram.nametable.nt_byte(self.nametable_addr, self.frame_x, self.frame_y)
-        tile = self.get_bg_tbl_address(index)
-
-        # flip 10th bit on wraparound
-        if (self.vram_addr & 0x1f) == 0x1f:
-            self.vram_addr ^= 0x41f
-        else:
-            self.vram_addr += 1
-
-        low, high = self.vram.read(tile), self.vram.read(tile + 8)
-
-        # shift the first tile to make room for the second
-        self.shift16_1 = ((self.shift16_1 << 8) & 0xffff) | low
-        self.shift16_2 = ((self.shift16_2 << 8) & 0xffff) | high
-
-        left_latch = 0
-        # for each tile in the row
-        for tile8 in range(32):
-            # for each pixel in the row of the tile
-            for bit in range(8):
-                # fb_row = self.scanline*256 + ((tile8 * 8) - bit)
-                x = (tile8 * 8) - bit
-                if tile8 == 0:
-                    y = self.scanline - 8
-                else:
-                    y = self.scanline
-                if self.values[x][y] != 0:
-                    continue
-
-                # a pixel value is taken by layering a bit from each of the
-                # 16-bit shift registers; the bit used is computed with k
-                # and fine x
-                # current = (15 - bit - self.fine_x)
-                pxvalue = (((self.shift16_1 >> bit) & 1) |
-                           (((self.shift16_2 >> bit) & 1) << 1))
-
-                # attr corresponds to the first tile, while attr_buffer
-                # corresponds to the second; if we're taking bit 8 or higher,
-                # then it's the second tile
-                if bit >= 8:
-                    if (self.frame_y / 16) % 2 == 0:
-                        palette = self.get_background_entry(((attr >> (2 * (left_latch % 2))) & 0x3) << 2, pxvalue)
-                    elif left_latch == 0:
-                        palette = self.get_background_entry(((attr >> 4) & 0x3) << 2, pxvalue)
-                    else:
-                        palette = self.get_background_entry(((attr >> 6) & 0x3) << 2, pxvalue)
+    def run(self, dots):
+        """
+        Advance the PPU by a number of dots, the same as calling step()
+        that many times. Only the dots with work to do are stepped; the
+        dots in between are skipped by moving the cycle forward.
+        """
+        while dots > 0:
+            cycle = self.cycle
+            if cycle < 340:
+                scanline = self.scanline
+                if -1 <= scanline <= 260:
+                    events = self.line_events[scanline + 1]
                 else:
-                    if (self.frame_y / 16) % 2 == 0:
-                        palette = self.get_background_entry(((attr_buffer >> (2 * (left_latch % 2))) & 0x3) << 2, pxvalue)
-                    elif left_latch == 0:
-                        palette = self.get_background_entry(((attr_buffer >> 4) & 0x3) << 2, pxvalue)
-                    else:
-                        palette = self.get_background_entry(((attr_buffer >> 6) & 0x3) << 2, pxvalue)
-
-                # import random
-                # palette = random.randrange(64)
-                self.colors[x][y] = rgb_palette[palette % 64]
-                self.values[x][y] = pxvalue
-                self.pindexes[x][y] = -1
-                self.increment_frame_xy()
-            if (tile8 + 1) % 2 == 0:
-                left_latch = not left_latch
-                attr = attr_buffer
-                attr_buffer = self.vram.nametable.at_byte(self.nametable_addr, self.frame_x, self.frame_y)
-            # shift in a new tile
-            index = self.vram.nametable.nt_byte(self.nametable_addr, self.frame_x, self.frame_y)
-            tile = self.get_bg_tbl_address(index)
-
-            # flip 10th bit on wraparound
-            if (self.vram_addr & 0x1f) == 0x1f:
-                self.vram_addr ^= 0x41f
-            else:
-                self.vram_addr += 1
-
-            low, high = self.vram.read(tile), self.vram.read(tile + 8)
-            self.shift16_1 = ((self.shift16_1 << 8) & 0xffff) | low
-            self.shift16_2 = ((self.shift16_2 << 8) & 0xffff) | high
-
-    def get_background_entry(self, attribute, pixel):
-        if not pixel:
-            return self.vram.read(0x3f00)
-        return self.vram.read(0x3f00 + attribute + pixel)
+                    events = (340,)
+                for event in events:
+                    if event >= cycle:
+                        break
+                if event - cycle >= dots:
+                    self.cycle = cycle + dots
+                    return
+                dots -= event - cycle
+                self.cycle = event
+            self.step()
+            dots -= 1
+
+    def set_scanline_counter(self, counter):
+        """ Clock counter.clock() at the end of every rendered line """
+        self.scanline_counter = counter
+        self.line_events = COUNTER_LINE_EVENTS if counter else LINE_EVENTS
+
+    def dots_to_event(self):
+        """
+        Number of dots the PPU can run behind the CPU: up to vblank, or up
+        to the scanline clock that raises the cartridge's next IRQ.
+        """
+        dots = self.dots_to_vblank()
+        if self.scanline_counter is not None:
+            clocks = self.scanline_counter.clocks_to_irq()
+            if clocks:
+                dots = min(dots, self.dots_to_scanline_clock(clocks))
+        return dots
+
+    def dots_to_scanline_clock(self, clocks):
+        """
+        Number of dots until the given number of scanline clocks (dot 260
+        of lines -1 to 239) have been stepped, as if rendering stays on.
+        """
+        line, cycle = self.scanline + 1, self.cycle
+        dots = 0
+        if cycle > 340:
+            dots, line, cycle = 1, line + 1, 0
+        if line > 261:
+            return float('inf')
+        # line of the first clock still to come, counting on into the
+        # next frame's 262 lines
+        first = line if cycle <= 260 else line + 1
+        if first > 240:
+            first = 262
+        ahead = first % 262 + clocks - 1
+        target = first - first % 262 + (ahead / 241) * 262 + ahead % 241
+        return dots + (target - line) * DOTS_PER_SCANLINE + 260 - cycle + 1
+
+    def dots_to_vblank(self):
+        """
+        Number of dots until the one that starts vblank, raising the NMI
+        and outputting the frame, has been stepped.
+        """
+        scanline, cycle = self.scanline, self.cycle
+        dots = 0
+        if cycle > 340:
+            # pushed past the end of the line by a DMA
+            dots, scanline, cycle = 1, scanline + 1, 0
+        if scanline > 260:
+            # pushed past the end of the frame by a DMA, vblank never comes
+            return float('inf')
+        dot = scanline * DOTS_PER_SCANLINE + cycle
+        if dot > VBLANK_DOT:
+            # run to the end of the frame first
+            dots += 261 * DOTS_PER_SCANLINE - dot
+            dot = -DOTS_PER_SCANLINE
+        return dots + VBLANK_DOT - dot + 1
+
+    def draw_tile_row(self):
+        """
+        Draw the background row of the line with create_tile_row, or copy
+        it from the line cache when nothing it is drawn from has changed
+        since the last frame. Rows some pixels of which already hold a
+        sprite are always drawn, they skip those pixels.
+        """
+        line = self.scanline
+        spans = [((line + offset) % 240, columns) for offset, columns in ROW_SPANS]
+        fine_y = self.vram_addr >> 12
+        table = self.vram.quarters[self.nametable_addr]
+        key = (self.frame_x, self.frame_y, table, fine_y, self.background_tbl_addr)
+        clear = self.row_clear()
+        cache = self.line_cache
+        if clear and cache.fresh(line, key):
+            for y, columns in spans:
+                self.pixels[y, columns] = cache.pixels[line, columns]
+                self.values[y, columns] = cache.values[line, columns]
+                self.pindexes[y, columns] = 0xff
+            self.frame_y = (self.frame_y + 1) % 240
+            self.fetched_row()
+            self.shift16_1, self.shift16_2 = cache.shifts[line]
+            return
+
+        self.create_tile_row()
+        if clear and fine_y < 8:
+            # the nametable bytes and pattern tiles of the 33 fetches
+            fetch = (key[1] * 256 + key[0] + FETCH_STEPS) % FRAME_PIXELS
+            fetch_x = fetch & 0xff
+            fetch_y = fetch >> 8
+            index = ((fetch_y >> 3) * 32 + (fetch_x >> 3) - 1) % 960
+            names = np.frombuffer(self.vram.nametable.nametables[self.nametable_addr],
+                                  dtype=np.uint8)
+            patterns = names[index] + (0x100 if self.background_tbl_addr else 0)
+            sources = (table, set(index >> 5), set(fetch_y // 30), patterns)
+            for y, columns in spans:
+                cache.pixels[line, columns] = self.pixels[y, columns]
+                cache.values[line, columns] = self.values[y, columns]
+            cache.store(line, key, sources, (self.shift16_1, self.shift16_2))
+
+    def fetched_row(self):
+        """
+        The row fetched 34 tiles, moving coarse x, and the horizontal
+        nametable on wraparound, along with it
+        """
+        coarse_x = (self.vram_addr & 0x1f) + 34
+        self.vram_addr = (self.vram_addr & ~0x1f) | (coarse_x & 0x1f)
+        if (coarse_x >> 5) & 0x1:
+            self.vram_addr ^= 0x400
 
-    def get_bg_tbl_address(self, v):
-        if self.background_tbl_addr:
-            table = 0x1000
+    def create_tile_row(self):
+        """
+        Draw one row of background tiles, fetched from the nametable at
+        frame_x/frame_y, into the scanline. Pixels already holding a
+        non-zero value are left alone and do not advance frame_x/frame_y,
+        so the fetch position of every tile and the attribute choice of
+        every pixel follow from how many pixels before it were drawn.
+        That mask is fixed when the row starts, which lets the whole row
+        be composed at once from the tile cache.
+        """
+        nametable = self.vram.nametable
+        names = np.frombuffer(nametable.nametables[self.nametable_addr], dtype=np.uint8)
+        attrs = np.frombuffer(nametable.attrtables[self.nametable_addr], dtype=np.uint8)
+
+        ys = np.empty(256, dtype=np.intp)
+        ys.fill(self.scanline)
+        ys[:8] = (self.scanline - 8) % 240
+        drawn = self.values[ys, ROW_X] == 0
+        count = np.cumsum(drawn)
+
+        # frame position of every pixel and of every tile fetch: one
+        # before the row starts and one after each tile
+        start = self.frame_y * 256 + self.frame_x
+        position = (start + count - drawn) % FRAME_PIXELS
+        fetch = np.empty(33, dtype=np.intp)
+        fetch[0] = start
+        fetch[1:] = (start + count[7::8]) % FRAME_PIXELS
+        fetch_x = fetch & 0xff
+        fetch_y = fetch >> 8
+        # a name byte fetched at frame_x < 8 wraps around to the end of the
+        # table, like the bytearray index did
+        index = names[(fetch_y >> 3) * 32 + (fetch_x >> 3) - 1].astype(np.intp)
+        attr = attrs[(fetch_y // 30) * 8 + (fetch_x >> 5)]
+
+        fine_y = self.vram_addr >> 12
+        table = 0x1000 if self.background_tbl_addr else 0
+        if fine_y < 8:
+            pixel = self.tiles.get((table >> 4) + index[:32])[:, fine_y].ravel()
         else:
-            table = 0
-
-        return (v << 4) | (self.vram_addr >> 12) | table
+            pixel = np.empty(256, dtype=np.uint8)
+            bits = np.arange(8)
+            for tile in range(32):
+                address = (index[tile] << 4) | fine_y | table
+                low = self.vram.read(address) & 0xff
+                high = self.vram.read(address + 8) & 0xff
+                pixel[tile * 8:tile * 8 + 8] = ((low >> bits) & 0x1) | (((high >> bits) & 0x1) << 1)
+
+        # on odd attribute rows of 16 pixels the latch picks the upper
+        # quadrants, on even ones it picks between the two lower ones
+        shift = 2 * ROW_LATCH + 4 * ((position >> 12) & 0x1)
+        palette = ((attr[ROW_ATTR_FETCH] >> shift) & 0x3) << 2
+        entry = np.where(pixel, palette + pixel, 0)
+        colors = np.frombuffer(self.vram.palettetable._memory, dtype=np.uint8)[entry]
+
+        xs, ys = ROW_X[drawn], ys[drawn]
+        self.pixels[ys, xs] = colors[drawn] & 0x3f
+        self.values[ys, xs] = pixel[drawn]
+        self.pindexes[ys, xs] = 0xff
+
+        end = (start + int(count[-1])) % FRAME_PIXELS
+        self.frame_x = end & 0xff
+        self.frame_y = end >> 8
+        self.fetched_row()
+
+        last = (int(index[31]) << 4) | fine_y | table
+        after = (int(index[32]) << 4) | fine_y | table
+        self.shift16_1 = ((self.vram.read(last) & 0xff) << 8) | self.vram.read(after)
+        self.shift16_2 = ((self.vram.read(last + 8) & 0xff) << 8) | self.vram.read(after + 8)
 
     def update_sprite_buffer(self, address, v):
         i = address / 4
@@ -753,126 +1043,161 @@ class PPU(object):
             self.sprite_data['x'][i] = v
 
     def evaluate_sprites(self):
-        if self.sprite_size:
-            sprite_height = 16
-        else:
-            sprite_height = 8
-
-        sprite_count = 0
-        for i, y in zip(range(len(self.sprite_data['y'])), self.sprite_data['y']):
-            if (y > (self.scanline - 1) - sprite_height and
-                    y + (sprite_height - 1) < (self.scanline - 1) + sprite_height):
-                attr_val = self.sprite_data['attributes'][i] & 0x3
-                tile = self.sprite_data['tiles'][i]
-                c = (self.scanline - 1) - y
-
-                y_flip = self.sprite_data['attributes'][i] >> 7
-                if y_flip:
-                    y_coord = y + ((sprite_height - 1) - c)
-                else:
-                    y_coord = y + c + 1
-
-                if self.sprite_size:
-                    s = self.get_sprite_tbl_address(tile)
-
-                    top = self._nes.rom.read_tile(s)
-                    bottom = self._nes.rom.read_tile(s + 16)
-
-                    if c > 7 and y_flip:
-                        tile = top
-                        y_coord += 8
-                    elif c < 8 and y_flip:
-                        tile = bottom
-                        y_coord -= 8
-                    elif c > 7:
-                        tile = bottom
-                    else:
-                        tile = top
-
-                    self.mux_tile([tile[c % 8], tile[(c % 8)+8]],
-                                  self.sprite_data['x'][i], y_coord,
-                                  attr_val, i)
-                else:
-                    s = self.get_sprite_tbl_address(tile)
-                    tile = self._nes.rom.read_tile(s)
-                    self.mux_tile([tile[c], tile[c+8]],
-                                  self.sprite_data['x'][i], y_coord,
-                                  attr_val, i)
-                sprite_count += 1
-
-                # if sprite_count == 9:
-                #     if self.sprite_limit:
-                #         set_bit(self.status, StatusBit.SpriteOverflow)
-                #         break
-
-    def mux_tile(self, tiles, x, y, palette_index, index):
-        attr = self.sprite_data['attributes'][index]
-        is_sprite0 = (index == 0)
-        for b in range(8):
-            if (attr >> 6) & 1 != 0:
-                x_coord = x + b
-            else:
-                x_coord = x + (7 - b)
+        """
+        Find the sprites on the previous scanline and composite their rows
+        over the frame
+        """
+        found, row = self.find_sprites()
+        if len(found):
+            self.draw_sprites(found, row)
 
-            if x_coord > 255:
-                continue
+    def find_sprites(self):
+        """
+        The numbers of the sprites on the previous scanline and the row of
+        each it is on, flagging sprite overflow when there are more than 8
+        """
+        sprite_height = 16 if self.sprite_size else 8
+        row = (self.scanline - 1) - self.sprites[:, 0]
+        found = np.flatnonzero((row >= 0) & (row < sprite_height))
+        if len(found) > 8:
+            self.status = set_bit(self.status, StatusBit.SpriteOverflow)
+            if self.sprite_limit:
+                found = found[:8]
+        return found, row[found]
+
+    def draw_sprites(self, found, row):
+        """
+        Composite rows row of sprites found over the frame. Each pixel goes
+        to the lowest numbered sprite that is not blocked there by a sprite
+        drawn earlier in the frame or, with background priority, by a
+        non-zero pixel, which is the order the sprites used to be drawn in
+        one by one.
+        """
+        sprite_height = 16 if self.sprite_size else 8
+        y, tiles, attributes, x = self.sprites[found].T
+        y_flip = attributes >= 0x80
 
-            # store the 0th and 1st bits
-            pixel = (tiles[0] >> b) & 0x1
-            pixel += ((tiles[1] >> b & 0x1) << 1)
-
-            transparent = 0
-            if attr and not pixel:
-                transparent = 1
-
-            if y * 256 + x_coord < 0xf000 and not transparent:
-                priority = (attr >> 5) & 0x1
-
-                hit = (self.status & 0x40 == 0x40)
-                if (self.values[x_coord][y] != 0 and is_sprite0
-                        and not hit):
-                    # sprite 0 has been hit
-                    self.status = set_bit(self.status, StatusBit.Sprite0Hit)
-
-                if -1 < self.pindexes[x_coord][y] < index:
-                    # higher priority sprite is already rendered here; skip
-                    continue
-                elif self.values[x_coord][y] != 0 and priority == 1:
-                    # pixel is already rendered and priority 1 indicates
-                    # that this should be skipped
-                    continue
-
-                # lookup pixel's color, taking sprites into account
-                pal = self.vram.read(0x3f10 + (palette_index * 0x4) + pixel)
-                self.colors[x_coord][y] = rgb_palette[pal % 64]
-                self.values[x_coord][y] = pixel
-                self.pindexes[x_coord][y] = index
-
-    def get_sprite_tbl_address(self, tile):
+        # the pattern row comes from the unflipped sprite; flipping moves
+        # the line it is drawn on instead
+        line = np.where(y_flip, y + (sprite_height - 1) - row, self.scanline)
         if self.sprite_size:
-            # 8x16 sprites
-            if tile & 1 != 0:
-                return 0x1000 | ((tile >> 1) * 0x20)
-            else:
-                return (tile >> 1) * 0x20
-        # selecting the sprite nametable
-        if self.sprite_tbl_addr:
-            table = 0x1000
-        else:
-            table = 0
-
-        return tile * 0x10 + table
+            # 8x16: bit 0 of the tile number picks the pattern table, the
+            # other bits the top tile of a pair
+            tiles = (tiles & 0x1) * 0x100 + (tiles & ~0x1) + ((row > 7) != y_flip)
+            line += np.where(y_flip, np.where(row > 7, 8, -8), 0)
+            row = row & 0x7
+        elif self.sprite_tbl_addr:
+            tiles = tiles + 0x100
+        pixels = self.tiles.get(tiles, row)
+        columns = x[:, np.newaxis] + SPRITE_COLUMNS[attributes]
+
+        # a sprite with no attribute bits set draws its zero pixels too
+        visible = ((columns <= 255) & (pixels | (attributes == 0)[:, np.newaxis] != 0) &
+                   (line < 240)[:, np.newaxis])
+        sprite, bit = np.nonzero(visible)
+        x = columns[sprite, bit]
+        y = line[sprite]
+        pixels = pixels[sprite, bit]
+        attributes = attributes[sprite]
+        index = found[sprite]
+        position = y * 256 + x
+        values = self.values.flat[position]
+
+        if found[0] == 0:
+            # sprite 0 hit: an opaque sprite 0 pixel over a non-zero one
+            if values[index == 0].any():
+                self.status = set_bit(self.status, StatusBit.Sprite0Hit)
+
+        drawn = np.flatnonzero((self.pindexes.flat[position] >= index) &
+                               ((values == 0) | (attributes & 0x20 == 0)))
+        position, first = np.unique(position[drawn], return_index=True)
+        drawn = drawn[first]
+        pixels = pixels[drawn]
+        colors = np.frombuffer(self.vram.palettetable._memory, dtype=np.uint8)[
+            0x10 + ((attributes[drawn] & 0x3) << 2) + pixels]
+
+        self.pixels.flat[position] = colors & 0x3f
+        self.values.flat[position] = pixels
+        self.pindexes.flat[position] = index[drawn]
+        self.covered[y[drawn]] = True
+
+    def check_sprites(self):
+        """
+        The sprite pass of a skipped frame. Overflow is flagged as drawn
+        frames flag it, but of the sprites found only those whose pixels
+        can still change the frame's status are composited: the ones that
+        cover pixels of rows not drawn yet, which those rows then skip,
+        and the ones on the lines sprite 0 has yet to be tested on. What
+        the others would draw is never looked at.
+        """
+        found, row = self.find_sprites()
+        if not len(found):
+            return
+        sprite_height = 16 if self.sprite_size else 8
+        scanline = self.scanline
+        top = self.sprites[0, 0]
+        pending = not self.status & 0x40 and top < 240 and scanline <= top + sprite_height
+        # few sprites share a line, one by one beats a dozen array ops
+        needed = []
+        for i, (sprite, sprite_row) in enumerate(zip(self.sprites[found].tolist(), row.tolist())):
+            y, _, attributes, x = sprite
+            # the line draw_sprites composes it on
+            line = scanline
+            if attributes >= 0x80:
+                line = y + (sprite_height - 1) - sprite_row
+                if self.sprite_size:
+                    line += 8 if sprite_row > 7 else -8
+            if line >= 240:
+                continue
+            # the row of a line draws columns 1-248 of it, the row 8
+            # lines down its columns 0 and 249-255
+            if (line > scanline or
+                    (x == 0 or x >= 242) and (line + 8) % 240 > scanline or
+                    pending and top <= line <= top + sprite_height):
+                needed.append(i)
+        if needed:
+            self.draw_sprites(found[needed], row[needed])
+
+    def row_needed(self):
+        """
+        Whether a skipped frame has to draw the background row of the line
+        after all. Sprites are still composited on skipped frames, and a
+        row some pixels of which they already hold skips those pixels,
+        which moves frame_x and frame_y differently from a whole row. Rows
+        covering the lines sprite 0 is composed on, before it hits, are
+        what its hit is tested against.
+        """
+        if not self.row_clear():
+            return True
+        line = self.scanline
+        if not self.show_sprites or self.status & 0x40:
+            return False
+        # a sprite is composed on lines y to y + height, flipped or not,
+        # and a row draws on its own line and the one 8 above
+        y = self.sprites[0, 0]
+        sprite_height = 16 if self.sprite_size else 8
+        return y < 240 and (line - y) % 240 <= sprite_height + 8
+
+    def row_clear(self):
+        """ Whether none of the pixels the line's row draws hold a sprite """
+        line = self.scanline
+        # line - 8 wraps to the bottom lines for the top rows
+        if not (self.covered[line] or self.covered[line - 8]):
+            return True
+        return not any(self.values[(line + offset) % 240, columns].any()
+                       for offset, columns in ROW_SPANS)
 
     def render_output(self):
-        if type(self.display) == int:
+        if self.skip_frame:
+            if type(self.display) != int:
+                self.display.SkipFrame()
+        elif type(self.display) == int:
             self.display = 1
         else:
-            self.display.NewFrame(self.colors)
-        if self.render_bg_flag:
-            for i in range(32):
-                self.vram.nametable.nt_changed[i] = 1
+            self.display.NewFrame(self.frame)
         self.values.fill(0)
-        self.pindexes.fill(-1)
+        self.pindexes.fill(0xff)
+        self.covered.fill(False)
 
     def end_scanline(self):
         # wraparound
@@ -899,12 +1224,3 @@ class PPU(object):
 
             self.vram_addr = ((self.vram_addr & 0x7be0) |
                               (self.vram_addr_buffer & 0x41f))
-
-    def increment_frame_xy(self):
-        self.frame_x += 1
-        if self.frame_x == 256:
-            self.frame_x = 0
-            self.frame_y += 1
-        if self.frame_y == 240:
-            self.frame_x = 0
-            self.frame_y = 0
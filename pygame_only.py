@@ -5,7 +5,7 @@ import sys
 import nes
 
 with open("roms/mario.nes", 'rb') as rom:
-    emu = nes.NES(rom.read())
+    emu = nes.NES(rom.read(), None, 'pygame')
 
 pygame.init()
 screen = pygame.display.set_mode((256, 240))
@@ -54,5 +54,5 @@ while 1:
 
     if emu.ppu.display == 1:
         emu.ppu.display = 0
-        pygame.surfarray.blit_array(screen, emu.ppu.colors)
+        pygame.surfarray.blit_array(screen, emu.ppu.frame.rgb().T)
         pygame.display.update()
\ No newline at end of file
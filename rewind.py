@@ -0,0 +1,172 @@
+'''
+Rewind: a history of save states taken once a frame, which can be
+stepped back through.
+
+The history is a ring of chunks. Each chunk starts with a keyframe, a
+full zlib-compressed state, and then holds one delta per captured frame.
+A delta is the XOR of a frame's state with the frame before it,
+run-length encoded as the runs of bytes that changed. Most of a state
+(ROM-side memory, the framebuffer of a still screen) is the same from one
+frame to the next, so deltas are a few hundred bytes. Since XOR undoes
+itself the newest state steps back through the deltas one frame at a
+time, and the keyframes let a jump further back start from the nearest
+chunk instead. When the history grows past max_bytes the oldest chunks
+are dropped.
+'''
+import collections
+import zlib
+
+import numpy as np
+
+import savestate
+
+# changed bytes closer than this are stored as one run, a run costs 8
+# bytes of bookkeeping
+GAP = 8
+
+
+class Delta(object):
+    """ The runs of bytes that differ between two states """
+    def __init__(self, delta):
+        changed = np.flatnonzero(delta)
+        if len(changed):
+            ends = np.flatnonzero(np.diff(changed) > GAP)
+            self.starts = changed[np.r_[0, ends + 1]].astype(np.uint32)
+            stops = changed[np.r_[ends, len(changed) - 1]] + 1
+            self.lengths = (stops - self.starts).astype(np.uint32)
+        else:
+            self.starts = self.lengths = np.zeros(0, np.uint32)
+        self.data = delta[self.positions()]
+        self.nbytes = self.starts.nbytes + self.lengths.nbytes + self.data.nbytes
+
+    def positions(self):
+        """ Offsets of every byte in the runs """
+        lengths = self.lengths.astype(np.intp)
+        firsts = np.cumsum(lengths) - lengths
+        return (np.arange(lengths.sum(), dtype=np.intp) +
+                np.repeat(self.starts.astype(np.intp) - firsts, lengths))
+
+    def apply(self, state):
+        """ XOR the delta into state, turning one of its two states into the other """
+        state[self.positions()] ^= self.data
+
+
+class Chunk(object):
+    """ A keyframe and the deltas of the frames from it on """
+    def __init__(self, state):
+        self.keyframe = zlib.compress(state.tobytes(), 1)
+        # deltas[0] leads from the frame before the keyframe, None when
+        # that frame is not in the history
+        self.deltas = []
+        self.nbytes = len(self.keyframe)
+
+    def state(self):
+        return np.frombuffer(zlib.decompress(self.keyframe), np.uint8).copy()
+
+
+class Rewind(object):
+    def __init__(self, nes, keyframe_interval=60, max_bytes=16 << 20):
+        self.nes = nes
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        self.chunks = collections.deque()
+        # the newest state, which stepping back starts from
+        self.latest = None
+        self.nbytes = 0
+        self.frames = 0
+
+    def __len__(self):
+        """ Number of frames held """
+        return self.frames
+
+    def capture(self):
+        """ Add the NES's current state as the newest frame """
+        state = np.frombuffer(savestate.save(self.nes), np.uint8).copy()
+        delta = None
+        if self.latest is not None and len(self.latest) == len(state):
+            delta = Delta(self.latest ^ state)
+        elif self.latest is not None:
+            # a different cartridge, the old history does not lead here
+            self.clear()
+
+        if not self.chunks or len(self.chunks[-1].deltas) >= self.keyframe_interval:
+            self.chunks.append(Chunk(state))
+            self.nbytes += self.chunks[-1].nbytes
+        chunk = self.chunks[-1]
+        chunk.deltas.append(delta)
+        if delta is not None:
+            chunk.nbytes += delta.nbytes
+            self.nbytes += delta.nbytes
+        self.latest = state
+        self.frames += 1
+
+        # drop the oldest chunks, always keeping the newest
+        while self.nbytes > self.max_bytes and len(self.chunks) > 1:
+            self.evict()
+
+    def evict(self):
+        oldest = self.chunks.popleft()
+        self.nbytes -= oldest.nbytes
+        self.frames -= len(oldest.deltas)
+        # the new oldest frame has nothing before it to step back to
+        first = self.chunks[0]
+        if first.deltas[0] is not None:
+            first.nbytes -= first.deltas[0].nbytes
+            self.nbytes -= first.deltas[0].nbytes
+            first.deltas[0] = None
+
+    def step_back(self, frames=1):
+        """
+        Restore the state from the given number of frames before the
+        newest one and forget the frames after it, so running on records
+        a new history from there. Stops at the oldest frame held; returns
+        the number of frames stepped back.
+        """
+        frames = min(frames, self.frames - 1)
+        if frames <= 0:
+            return 0
+
+        # find the chunk the target frame is in and its index there
+        target = self.frames - 1 - frames
+        index = target
+        for number, chunk in enumerate(self.chunks):
+            if index < len(chunk.deltas):
+                break
+            index -= len(chunk.deltas)
+
+        if index < frames:
+            # closer to the chunk's keyframe, apply its deltas forward
+            state = chunk.state()
+            for delta in chunk.deltas[1:index + 1]:
+                delta.apply(state)
+        else:
+            # closer to the newest state, undo deltas backward
+            state = self.latest
+            for delta in self.newest_deltas(frames):
+                delta.apply(state)
+
+        while len(self.chunks) > number + 1:
+            dropped = self.chunks.pop()
+            self.nbytes -= dropped.nbytes
+        dropped = chunk.deltas[index + 1:]
+        del chunk.deltas[index + 1:]
+        for delta in dropped:
+            chunk.nbytes -= delta.nbytes
+            self.nbytes -= delta.nbytes
+        self.frames = target + 1
+        self.latest = state
+
+        savestate.load(self.nes, state.tobytes())
+        return frames
+
+    def newest_deltas(self, count):
+        """ The last count deltas, newest first """
+        for chunk in reversed(self.chunks):
+            for delta in reversed(chunk.deltas):
+                if not count:
+                    return
+                yield delta
+                count -= 1
@@ -0,0 +1,173 @@
+'''
+ROM catalog: indexes directories of ROMs by CRC32 and SHA-1 together
+with their parsed headers, kept in an on-disk JSON cache. A file is only
+read and hashed again when its size or modification time changed, so
+opening a large library costs one stat() per file.
+
+    python -m romdb roms/ [--cache FILE]
+'''
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import zlib
+
+import cartridge
+
+logger = logging.getLogger(__name__)
+
+# bump when the cached entries change shape, older caches are discarded
+CACHE_VERSION = 1
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.pynes', 'romdb.json')
+
+
+def describe(path, data):
+    """
+    Catalog entry for the ROM file at path. The hashes cover the ROM data
+    after the header and trainer, the way ROM databases list them.
+    """
+    header = cartridge.Header(data)
+    rom = data[header.prg_start:header.size]
+    return {
+        'path': path,
+        'crc32': '{:08x}'.format(zlib.crc32(rom) & 0xffffffff),
+        'sha1': hashlib.sha1(rom).hexdigest(),
+        'header': header.as_dict(),
+    }
+
+
+class RomDatabase(object):
+    def __init__(self, cache_path=DEFAULT_CACHE):
+        self.cache_path = cache_path
+        # path -> entry, where an entry also keeps the size and mtime it
+        # was made from
+        self.entries = {}
+        self.by_crc32 = {}
+        self.by_sha1 = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path) as cache:
+                stored = json.load(cache)
+        except (IOError, ValueError):
+            return
+        if stored.get('version') != CACHE_VERSION:
+            return
+        for entry in stored['roms']:
+            self.add(entry)
+
+    def save(self):
+        """
+        Write the cache if anything changed, replacing it atomically except
+        on Windows, where a rename cannot replace the old file
+        """
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.cache_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp = self.cache_path + '.tmp'
+        with open(temp, 'w') as cache:
+            json.dump({'version': CACHE_VERSION,
+                       'roms': sorted(self.entries.values(), key=lambda e: e['path'])},
+                      cache, indent=1, sort_keys=True)
+        if sys.platform == 'win32' and os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+        os.rename(temp, self.cache_path)
+        self.dirty = False
+
+    def add(self, entry):
+        self.remove(entry['path'])
+        self.entries[entry['path']] = entry
+        self.by_crc32.setdefault(entry['crc32'], []).append(entry)
+        self.by_sha1.setdefault(entry['sha1'], []).append(entry)
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.by_crc32[entry['crc32']].remove(entry)
+            self.by_sha1[entry['sha1']].remove(entry)
+
+    def scan(self, directory, extensions=('.nes',)):
+        """
+        Bring the catalog up to date with the ROMs under directory and
+        return their entries. Files whose size and mtime match the cache
+        are not opened.
+        """
+        found = []
+        seen = set()
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.lower().endswith(extensions):
+                    continue
+                path = os.path.abspath(os.path.join(root, name))
+                seen.add(path)
+                entry = self.lookup(path)
+                if entry is not None:
+                    found.append(entry)
+
+        # forget files that were removed from the directory
+        prefix = os.path.join(os.path.abspath(directory), '')
+        for path in list(self.entries):
+            if path.startswith(prefix) and path not in seen:
+                self.remove(path)
+                self.dirty = True
+        return found
+
+    def lookup(self, path):
+        """ Entry for one file, from the cache when it is still current """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if (entry is not None and entry['size'] == stat.st_size and
+                entry['mtime'] == stat.st_mtime):
+            return entry
+
+        try:
+            with open(path, 'rb') as rom:
+                entry = describe(path, rom.read())
+        except Exception as error:
+            logger.error("Skipping %s: %s", path, error)
+            return None
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime
+        self.add(entry)
+        self.dirty = True
+        return entry
+
+    def find(self, crc32=None, sha1=None):
+        """ Entries matching a CRC32 (hex string) or SHA-1 """
+        if crc32 is None and sha1 is None:
+            raise ValueError("find() needs a crc32 or a sha1")
+        if sha1 is not None:
+            return list(self.by_sha1.get(sha1.lower(), []))
+        return list(self.by_crc32.get(crc32.lower(), []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Catalog a directory of ROMs.')
+    parser.add_argument('directory')
+    parser.add_argument('--cache', default=DEFAULT_CACHE)
+    args = parser.parse_args()
+
+    db = RomDatabase(args.cache)
+    entries = db.scan(args.directory)
+    db.save()
+    for entry in entries:
+        header = entry['header']
+        print '{} {:8} mapper {:3}.{} PRG {:4}K CHR {:4}K {}'.format(
+            entry['crc32'], header['format'], header['mapper'], header['submapper'],
+            header['prg_rom_size'] / 1024, header['chr_rom_size'] / 1024,
+            os.path.relpath(entry['path']))
+
+
+if __name__ == '__main__':
+    main()
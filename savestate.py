@@ -0,0 +1,191 @@
+'''
+Save states: a snapshot of the whole machine as a versioned binary blob.
+
+    'PYNS', format version (uint16), SHA-1 of the ROM image (20 bytes)
+    then tagged sections: tag (4 bytes), length (uint32), payload
+
+Scalar registers are packed with struct, memories are stored as raw
+bytes. Loading checks the version and that the state was taken with the
+same ROM, and writes every buffer back in place since the CPU page
+table and translated blocks hold references to them.
+'''
+import struct
+
+import numpy as np
+
+from cpu import cpu as cpu_module
+
+MAGIC = 'PYNS'
+VERSION = 4
+HEADER = struct.Struct('<4sH20s')
+SECTION = struct.Struct('<4sI')
+
+NES_FIELDS = ('ppu_dots', 'halt_cpu')
+CPU_FIELDS = ('pc', 'sp', 'a', 'x', 'y', 'carry', 'interrupt', 'decimal', 'brk',
+              'unused', 'overflow', 'nz', 'irq_requested', 'nmi_requested',
+              '_cycles', 'instructions')
+PPU_FIELDS = ('nmi_on_vblank', 'master_slave', 'sprite_size', 'background_tbl_addr',
+              'sprite_tbl_addr', 'vram_addr_inc', 'nametable_addr', 'more_red',
+              'more_green', 'more_blue', 'show_sprites', 'show_background',
+              'show_sprites_plus', 'show_background_plus', 'monochrome', 'control',
+              'mask', 'status', 'vram_data_buffer', 'vram_addr', 'vram_addr_buffer',
+              'sprite_ram_addr', 'vram_data', 'fine_x', 'vram_addr_latch', 'shift16_1',
+              'shift16_2', 'frame_count', 'cycle', 'scanline', 'ignore_nmi',
+              'ignore_vblank', 'frame_x', 'frame_y')
+APU_FIELDS = ('frame_interrupt', 'length_counter_status', 'fiveframe',
+              'disable_frame_int', '_clock', '_fast_clock')
+CHANNEL_FIELDS = ('_enabled', 'duty', 'loop_envelope', 'const_vol', 'volume', 'sweep',
+                  'sweep_en', 'sweep_period', 'sweep_negative', 'sweep_shift',
+                  'sweep_start', 'timer', 'length_counter', 'envelope_start',
+                  'envelope_counter', 'envelope', 'sequence', 'interrupt')
+MIRRORINGS = ['Horizontal', 'Vertical', 'SingleUpper', 'SingleLower']
+
+
+def pack_ints(values):
+    """ A count followed by that many signed 64-bit ints """
+    values = [int(value) for value in values]
+    return struct.pack('<I{}q'.format(len(values)), len(values), *values)
+
+
+def unpack_ints(data):
+    count = struct.unpack_from('<I', data)[0]
+    return list(struct.unpack_from('<{}q'.format(count), data, 4))
+
+
+def pack_fields(obj, fields):
+    return pack_ints(getattr(obj, name, 0) for name in fields)
+
+
+def unpack_fields(obj, fields, data):
+    for name, value in zip(fields, unpack_ints(data)):
+        setattr(obj, name, value)
+
+
+def save(nes):
+    """ Snapshot nes into a bytes string """
+    nes.sync_ppu()
+    cpu, ppu, cart = nes.cpu, nes.ppu, nes.rom
+    memory = cpu.memory
+    nametable = ppu.vram.nametable
+    controller = cpu.controller
+    apu = cpu.apu
+
+    sections = [
+        ('NES ', pack_fields(nes, NES_FIELDS)),
+        ('CPU ', pack_fields(cpu, CPU_FIELDS) + pack_ints([cpu_module.scanlines])),
+        ('RAM ', str(memory.ram)),
+        ('SRAM', str(memory.sram)),
+        ('IO  ', str(memory.io)),
+        ('PPU ', pack_fields(ppu, PPU_FIELDS)),
+        ('OAM ', str(ppu.sram64._memory) + str(ppu.sram8._memory)),
+        ('SPRS', ppu.sprites.astype(np.uint8).tobytes()),
+        ('NTBL', ''.join(str(table) for table in nametable._nametables + nametable._attrtables) +
+                 chr(MIRRORINGS.index(nametable.mirroring))),
+        ('PAL ', str(ppu.vram.palettetable._memory)),
+        ('FRAM', ppu.frame.tobytes() + ppu.values.tobytes() + ppu.pindexes.tobytes()),
+        ('CART', pack_ints(cart.prg_windows + cart.chr_windows) +
+                 pack_ints(cart.mapper.save_state())),
+        ('PAD ', pack_ints(controller._shiftreg + controller._controllerstatus +
+                           [controller._strobe])),
+        ('APU ', pack_fields(apu, APU_FIELDS) +
+                 ''.join(pack_fields(channel, CHANNEL_FIELDS)
+                         for channel in (apu.pulse1, apu.pulse2, apu.triangle,
+                                         apu.noise, apu.DMC))),
+    ]
+    if cart.chr is not cart.image:
+        sections.append(('CRAM', str(cart.chr)))
+
+    return HEADER.pack(MAGIC, VERSION, cart.digest()) + ''.join(
+        SECTION.pack(tag, len(payload)) + payload for tag, payload in sections)
+
+
+def read_sections(nes, data):
+    """ Check the header of a state and split it into {tag: payload} """
+    if len(data) < HEADER.size:
+        raise Exception('Not a save state')
+    magic, version, digest = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise Exception('Not a save state')
+    if version != VERSION:
+        raise Exception('Unsupported save state version {}'.format(version))
+    if digest != nes.rom.digest():
+        raise Exception('Save state was taken with a different ROM')
+
+    sections = {}
+    offset = HEADER.size
+    while offset < len(data):
+        tag, length = SECTION.unpack_from(data, offset)
+        offset += SECTION.size
+        sections[tag] = data[offset:offset + length]
+        offset += length
+    return sections
+
+
+def load(nes, data):
+    """ Restore a snapshot taken by save() """
+    sections = read_sections(nes, data)
+    cpu, ppu, cart = nes.cpu, nes.ppu, nes.rom
+    memory = cpu.memory
+    nametable = ppu.vram.nametable
+    controller = cpu.controller
+    apu = cpu.apu
+
+    unpack_fields(nes, NES_FIELDS, sections['NES '])
+    cpu_state = sections['CPU ']
+    unpack_fields(cpu, CPU_FIELDS, cpu_state)
+    cpu_module.scanlines = unpack_ints(cpu_state[4 + 8 * len(CPU_FIELDS):])[0]
+    memory.ram[:] = sections['RAM ']
+    memory.sram[:] = sections['SRAM']
+    memory.io[:] = sections['IO  ']
+
+    unpack_fields(ppu, PPU_FIELDS, sections['PPU '])
+    oam = sections['OAM ']
+    ppu.sram64._memory[:] = oam[:0x100]
+    ppu.sram8._memory[:] = oam[0x100:]
+    ppu.sprites[:] = np.frombuffer(sections['SPRS'], dtype=np.uint8).reshape(64, 4)
+    tables = sections['NTBL']
+    offset = 0
+    for table in nametable._nametables + nametable._attrtables:
+        table[:] = tables[offset:offset + len(table)]
+        offset += len(table)
+    nametable.set_mirroring(MIRRORINGS[ord(tables[offset])])
+    ppu.vram.palettetable._memory[:] = sections['PAL ']
+
+    frame = sections['FRAM']
+    pixels = ppu.pixels.size
+    lines = ppu.frame.emphasis.size
+    ppu.pixels[:] = np.frombuffer(frame, dtype=np.uint8, count=pixels).reshape(ppu.pixels.shape)
+    ppu.frame.emphasis[:] = np.frombuffer(frame, dtype=np.uint8, count=lines, offset=pixels)
+    offset = pixels + lines
+    values = np.frombuffer(frame, dtype=np.uint8, count=pixels, offset=offset)
+    ppu.values[:] = values.reshape(ppu.values.shape)
+    pindexes = np.frombuffer(frame, dtype=np.uint8, count=pixels, offset=offset + pixels)
+    ppu.pindexes[:] = pindexes.reshape(ppu.pindexes.shape)
+    ppu.covered[:] = ppu.values.any(axis=1)
+
+    cart_state = sections['CART']
+    windows = unpack_ints(cart_state)
+    cart.mapper.load_state(unpack_ints(cart_state[4 + 8 * len(windows):]))
+    cart.prg_windows[:] = windows[:4]
+    cart.chr_windows[:] = windows[4:]
+    if 'CRAM' in sections:
+        cart.chr[:] = sections['CRAM']
+    memory.map_prg()
+    for window, offset in enumerate(cart.chr_windows):
+        ppu.vram.map_window(window, offset)
+        ppu.tiles.map_window(window, (offset - cart.chr_base) >> 4)
+    ppu.tiles.invalidate_all()
+
+    pad = unpack_ints(sections['PAD '])
+    controller._shiftreg[:] = pad[0:2]
+    controller._controllerstatus[:] = pad[2:4]
+    controller._strobe = pad[4]
+
+    apu_state = sections['APU ']
+    unpack_fields(apu, APU_FIELDS, apu_state)
+    offset = 4 + 8 * len(APU_FIELDS)
+    for channel in (apu.pulse1, apu.pulse2, apu.triangle, apu.noise, apu.DMC):
+        unpack_fields(channel, CHANNEL_FIELDS, apu_state[offset:])
+        offset += 4 + 8 * len(CHANNEL_FIELDS)
+
+    nes.ppu_deadline = ppu.dots_to_event()
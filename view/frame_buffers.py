@@ -0,0 +1,54 @@
+'''
+Hands finished frames from the emulator thread to the GUI thread without
+either one waiting on the other.
+
+Three frames go round between a free list, a ready list and the one the
+GUI is showing. The emulator copies each finished frame into a free one
+(or, when the GUI has fallen behind, the oldest ready one it never took)
+and appends it to the ready list; the GUI takes the newest ready frame,
+shows it and puts it back on the free list. Only appends and pops, which
+deques make atomic, touch the shared lists, so there is no lock and the
+frame being shown is never written to.
+'''
+import collections
+
+import ppu
+
+
+def pop(frames):
+    """ The oldest of frames, or None """
+    try:
+        return frames.popleft()
+    except IndexError:
+        return None
+
+
+class TripleBuffer(object):
+    def __init__(self):
+        self.free = collections.deque(ppu.PPU.Frame() for _ in range(3))
+        self.ready = collections.deque()
+
+    def publish(self, frame):
+        """ Queue a copy of frame, called from the emulator thread """
+        back = None
+        while back is None:
+            # with none free at least one is waiting, or is on its way
+            # back to the free list from take(): drop the oldest
+            back = pop(self.free) or pop(self.ready)
+        back.copy(frame)
+        self.ready.append(back)
+
+    def take(self):
+        """ The newest frame published, or None; hand it back with release() """
+        frame = pop(self.ready)
+        if frame is None:
+            return None
+        # the ones before the newest were never shown and never will be
+        newer = pop(self.ready)
+        while newer is not None:
+            self.free.append(frame)
+            frame, newer = newer, pop(self.ready)
+        return frame
+
+    def release(self, frame):
+        self.free.append(frame)
@@ -3,12 +3,16 @@ import os
 import wx
 import pygame
 
+from frame_buffers import TripleBuffer
+
 
 class Display(wx.Window):
     def __init__(self, *args, **kwargs):
         wx.Window.__init__(self, *args, **kwargs)
         self.parent = kwargs['parent']
         self.nes = None
+        # held down to step back through the rewind history
+        self.rewinding = False
         self.hwnd = self.GetHandle()
         if sys.platform == "win32":
             os.environ['SDL_VIDEODRIVER'] = 'windib'
@@ -21,6 +25,8 @@ class Display(wx.Window):
         self.surface = pygame.surfarray.pixels2d(self.screen)
         # self.surface = pygame.PixelArray(self.screen)
         self.size = self.GetSizeTuple()
+        # frames from the emulator thread, shown by the timer
+        self.frames = TripleBuffer()
 
         self.gamepad1 = {
             'up': 0,
@@ -57,8 +63,11 @@ class Display(wx.Window):
             if event.type == pygame.QUIT:
                 return
             elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_RSHIFT:
-                    self.nes.ppu.render_bg_flag = not self.nes.ppu.render_bg_flag
+                if event.key == pygame.K_BACKSPACE:
+                    self.rewinding = True
+                if event.key == pygame.K_TAB:
+                    # fast-forward, showing one frame in every four
+                    self.nes.set_frame_skip(4)
                 for button in self.gamepad1:
                     if event.key == self.gamepad1[button]:
                         self.nes.parse_input(1, button, 1)
@@ -66,13 +75,17 @@ class Display(wx.Window):
                     if event.key == self.gamepad2[button]:
                         self.nes.parse_input(2, button, 1)
             elif event.type == pygame.KEYUP:
+                if event.key == pygame.K_BACKSPACE:
+                    self.rewinding = False
+                if event.key == pygame.K_TAB:
+                    self.nes.set_frame_skip(1)
                 for button in self.gamepad1:
                     if event.key == self.gamepad1[button]:
                         self.nes.parse_input(1, button, 0)
                 for button in self.gamepad2:
                     if event.key == self.gamepad2[button]:
                         self.nes.parse_input(2, button, 0)
-        # self.Redraw()
+        self.Present()
 
     def Redraw(self):
         pygame.display.update()
@@ -82,11 +95,22 @@ class Display(wx.Window):
             self.surface[x, y] = buffer[x, y]
         pygame.display.update(pygame.Rect(0, y-1, 256, 2))
 
-    def NewFrame(self, buffer):
-        # pygame.pixelcopy.array_to_surface(self.screen, buffer)
-        pygame.surfarray.blit_array(self.screen, buffer)
+    def NewFrame(self, frame):
+        # called on the emulator thread, which only queues a copy
+        self.frames.publish(frame)
+
+    def Present(self):
+        """ Show the newest frame the emulator finished, if there is a new one """
+        frame = self.frames.take()
+        if frame is None:
+            return
+        pygame.surfarray.blit_array(self.screen, frame.rgb().T)
+        self.frames.release(frame)
         pygame.display.update()
 
+    def SkipFrame(self):
+        pass
+
     def OnPaint(self, event):
         self.Redraw()
 